@@ -0,0 +1,151 @@
+#ann_index.py
+"""Build and load FAISS indices for context retrieval.
+
+All index types built here use inner product on L2-normalised embeddings, so
+the scores FAISS returns are cosine similarities. Supported types:
+
+    flat      exact search (IndexFlatIP)
+    ivf_flat  inverted lists over full vectors, tuned with ``nprobe``
+    ivf_pq    inverted lists over product-quantised codes, tuned with ``nprobe``
+    hnsw      graph search, tuned with ``efSearch``
+
+Search-time knobs are read from ``RAG_INDEX_NPROBE`` and ``RAG_INDEX_EF_SEARCH``.
+With ``RAG_INDEX_MMAP=1`` the vectors are memory-mapped from the index file
+instead of read into private memory, so every process serving the same file
+shares one copy in the page cache.
+
+Rebuild the legacy IndexFlatL2 as HNSW with::
+
+    python ann_index.py ai_integration/pubmedqa_faiss.index ai_integration/pubmedqa_hnsw.index --type hnsw
+"""
+import argparse
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+DEFAULT_NPROBE = int(os.getenv('RAG_INDEX_NPROBE', '16'))
+DEFAULT_EF_SEARCH = int(os.getenv('RAG_INDEX_EF_SEARCH', '64'))
+MMAP_INDEX = os.getenv('RAG_INDEX_MMAP', '0') == '1'
+
+
+# ------------------- Building -------------------
+
+def default_nlist(n_vectors):
+    """Rule of thumb: about 4 * sqrt(N) inverted lists, at least 1."""
+    return max(1, int(4 * math.sqrt(n_vectors)))
+
+
+def build_index(embeddings, index_type="flat", nlist=None, pq_m=16, pq_bits=8,
+                hnsw_m=32, ef_construction=200):
+    """Build an inner-product index over ``embeddings`` (normalised in place)."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    faiss.normalize_L2(embeddings)
+    n_vectors, dimension = embeddings.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        nlist = nlist or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_bits,
+                                     faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+
+    index.add(embeddings)
+    return index
+
+
+def read_vectors(index):
+    """Reconstruct every stored vector of an index that keeps full vectors."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+# ------------------- Loading and Searching -------------------
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Apply search-time parameters where the index type supports them."""
+    nprobe = DEFAULT_NPROBE if nprobe is None else nprobe
+    ef_search = DEFAULT_EF_SEARCH if ef_search is None else ef_search
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+
+    hnsw_index = faiss.downcast_index(index)
+    if hasattr(hnsw_index, "hnsw"):
+        hnsw_index.hnsw.efSearch = ef_search
+
+    return index
+
+
+def mmap_io_flags():
+    """Read flags that map the stored vectors / codes read-only instead of copying them.
+
+    ``IO_FLAG_MMAP_IFC`` (faiss >= 1.8) maps the codes of flat, IVF and HNSW
+    indices; older releases only map IVF inverted lists with ``IO_FLAG_MMAP``.
+    """
+    return getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def load_index(index_path, nprobe=None, ef_search=None, io_flags=None):
+    """Read an index from disk and apply the configured search parameters."""
+    if io_flags is None:
+        io_flags = mmap_io_flags() if MMAP_INDEX else 0
+    index = faiss.read_index(index_path, io_flags)
+    return configure_search(index, nprobe=nprobe, ef_search=ef_search)
+
+
+def similarity_scores(index, distances):
+    """Convert raw FAISS scores into cosine similarities.
+
+    Inner-product indices already return cosine scores for normalised vectors.
+    L2 indices return squared distances, where ``cos = 1 - d / 2``.
+    """
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1.0 - distances / 2.0
+
+
+# ------------------- CLI -------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild a FAISS index with another index type.")
+    parser.add_argument("source", help="existing index holding full vectors (e.g. the flat index)")
+    parser.add_argument("output", help="where to write the new index")
+    parser.add_argument("--type", choices=INDEX_TYPES, default="hnsw")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--pq-bits", type=int, default=8)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    args = parser.parse_args()
+
+    vectors = read_vectors(faiss.read_index(args.source))
+    index = build_index(
+        vectors,
+        index_type=args.type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        pq_bits=args.pq_bits,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+    )
+    faiss.write_index(index, args.output)
+    print(f"Wrote {args.type} index with {index.ntotal} vectors to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#answer_cache.py
+"""Semantic cache of answers to context-free questions.
+
+A paraphrase of a question answered a minute ago ("what lowers blood pressure
+in older adults" / "how to reduce hypertension in the elderly") would
+otherwise run full beam search or a Gemini call again. ``AnswerCache`` stores
+each answer under the L2-normalized embedding of its question in a small
+FAISS inner-product index per namespace (one per model). A lookup whose
+nearest stored question has cosine similarity of at least ``threshold``
+returns the stored answer.
+
+Only turns whose answer depends on nothing but the question may be cached:
+no uploaded documents and, for Gemini, no earlier messages in the prompt.
+The caller decides that; see ``RAGSystem.answer`` and ``process_with_gemini``.
+
+Entries expire ``ttl`` seconds after they were stored; beyond ``max_entries``
+per namespace the least recently used entry is evicted.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+import metrics
+
+# Minimum cosine similarity between questions for a hit; too low and different questions share answers
+ANSWER_CACHE_THRESHOLD = float(os.getenv('RAG_ANSWER_CACHE_THRESHOLD', '0.95'))
+# Entries per namespace (0 disables the cache)
+ANSWER_CACHE_SIZE = int(os.getenv('RAG_ANSWER_CACHE_SIZE', '1000'))
+ANSWER_CACHE_TTL_S = float(os.getenv('RAG_ANSWER_CACHE_TTL_S', '3600'))
+# Neighbours checked per lookup, so an expired nearest entry does not hide a live one
+SEARCH_DEPTH = 4
+
+
+class _Namespace:
+    def __init__(self, dim):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> (question, payload, stored_at), least recently used first
+        self.next_id = 0
+
+
+class AnswerCache:
+    """Answers by question embedding, see the module docstring."""
+
+    def __init__(self, dim, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_SIZE,
+                 ttl=ANSWER_CACHE_TTL_S, clock=time.time):
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+        self.expired = 0
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _namespace(self, name):
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            namespace = self._namespaces[name] = _Namespace(self.dim)
+        return namespace
+
+    def _remove(self, namespace, ids):
+        for entry_id in ids:
+            namespace.entries.pop(entry_id, None)
+        namespace.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def lookup(self, name, embedding):
+        """``(payload, similarity, cached question)`` of the closest live entry, or None on a miss."""
+        if not self.enabled:
+            return None
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            namespace = self._namespace(name)
+            hit = None
+            if namespace.index.ntotal:
+                scores, ids = namespace.index.search(query, min(SEARCH_DEPTH, namespace.index.ntotal))
+                now = self.clock()
+                stale = []
+                for score, entry_id in zip(scores[0], ids[0]):
+                    if entry_id < 0 or score < self.threshold:
+                        break
+                    question, payload, stored_at = namespace.entries[entry_id]
+                    if now - stored_at > self.ttl:
+                        stale.append(entry_id)
+                        continue
+                    namespace.entries.move_to_end(entry_id)
+                    hit = (payload, float(score), question)
+                    break
+                if stale:
+                    self._remove(namespace, stale)
+                    self.expired += len(stale)
+            counter = self.hits if hit is not None else self.misses
+            counter[name] = counter.get(name, 0) + 1
+            return hit
+
+    def store(self, name, embedding, question, payload):
+        """Remember ``payload`` (treated as immutable) as the answer to ``question``."""
+        if not self.enabled:
+            return
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            namespace = self._namespace(name)
+            entry_id = namespace.next_id
+            namespace.next_id += 1
+            namespace.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            namespace.entries[entry_id] = (question, payload, self.clock())
+            overflow = len(namespace.entries) - self.max_entries
+            if overflow > 0:
+                self._remove(namespace, list(namespace.entries)[:overflow])
+                self.evictions += overflow
+
+    def clear(self):
+        with self._lock:
+            self._namespaces.clear()
+
+    def stats(self):
+        with self._lock:
+            names = sorted(set(self.hits) | set(self.misses) | set(self._namespaces))
+            per_namespace = {}
+            for name in names:
+                hits, misses = self.hits.get(name, 0), self.misses.get(name, 0)
+                namespace = self._namespaces.get(name)
+                per_namespace[name] = {
+                    'entries': len(namespace.entries) if namespace else 0,
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+                }
+            return {
+                'threshold': self.threshold,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'namespaces': per_namespace,
+            }
+
+    def metric_families(self):
+        namespaces = self.stats()['namespaces']
+        return [
+            ('medqa_answer_cache_lookups_total', metrics.COUNTER, 'Semantic answer cache lookups by model and result.',
+             [({'model': name, 'result': result}, counts[key])
+              for name, counts in namespaces.items() for result, key in (('hit', 'hits'), ('miss', 'misses'))]),
+            ('medqa_answer_cache_entries', metrics.GAUGE, 'Answers held in the semantic answer cache.',
+             [({'model': name}, counts['entries']) for name, counts in namespaces.items()]),
+        ]
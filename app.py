@@ -1,19 +1,36 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify 
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g, send_file
 from models.Authuser import AuthUser
-from models.file_handler import allowed_file, extract_text_from_file
+from models.file_handler import (
+    MAX_CHARS, MAX_PAGES, MAX_UPLOAD_BYTES, FileTooLargeError, allowed_file, is_image_file, iter_text_from_file,
+    start_pdf_pool
+)
+from models.extraction_cache import ExtractionCache
+from models.ocr_queue import OCRQueue, OCRQueueFullError
 from models.context import ChatContext
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 import uuid
-from rag_qa import load_rag_system, rag_pipeline
+from inference_client import INFERENCE_SERVER_URL, InferenceClient
+from gemini_client import GeminiClient, GenAIBackend, FakeBackend
+import hmac
 import json
+import threading
+import time
 import traceback
+import metrics
+from functools import wraps
+from profiling import ProfileStore, ContinuousProfiler, profile_request, MODES as PROFILE_MODES
 
 
 load_dotenv()  # Load environment variables
 
+# PDF extraction workers are forked before any thread starts (in each worker when pre-forking)
+PREFORK = os.getenv('RAG_PREFORK') == '1'
+if not PREFORK:
+    start_pdf_pool()
+
 app = Flask(__name__)
 
 app.secret_key = os.getenv('SECRET_KEY') or 'dev-secret-key'
@@ -21,17 +38,33 @@ app.secret_key = os.getenv('SECRET_KEY') or 'dev-secret-key'
 AuthUser.init_db()
 ChatContext.init_db()
 
+# Gemini calls go through a bounded client with deadlines, retries and a circuit breaker.
+# GEMINI_BACKEND=fake swaps in an offline simulator for load testing.
 gemini_api_key = os.getenv('GEMINI_API_KEY')
-if gemini_api_key:
+if os.getenv('GEMINI_BACKEND') == 'fake':
+    gemini_client = GeminiClient(FakeBackend(
+        median_ms=float(os.getenv('GEMINI_FAKE_MEDIAN_MS', '800')),
+        failure_rate=float(os.getenv('GEMINI_FAKE_FAILURE_RATE', '0'))
+    ))
+elif gemini_api_key:
     genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel('gemini-2.5-flash-preview-04-17')
+    gemini_client = GeminiClient(GenAIBackend())
 else:
     print("Warning: GEMINI_API_KEY not found in environment variables")
-    model = None
+    gemini_client = None
 
 # Configure file uploads
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Reject oversized uploads before Werkzeug buffers them (small margin for the form fields)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+
+# Image OCR runs on a bounded background pool so web workers never wait on tesseract
+ocr_queue = OCRQueue()
+
+# Extracted text is stored by content hash, so re-uploading a file skips parsing and OCR
+extraction_cache = ExtractionCache(app.config['UPLOAD_FOLDER'])
+EXTRACTION_LIMITS = (MAX_PAGES, MAX_CHARS)
 
 
 # Load RAG system components once at startup
@@ -39,18 +72,187 @@ model_path = "ai_integration/t5-small-pubmedqa"
 index_path = "ai_integration/pubmedqa_faiss.index"
 context_map_path = "ai_integration/context_map.pkl"
 
-# Initialize RAG system
-print("Loading RAG system components...")
-try:
-    rag_model, rag_tokenizer, embedding_model, index, context_map = load_rag_system(
-        model_path, index_path, context_map_path
-    )
-    print("RAG system loaded successfully!")
-    rag_system_loaded = True
-except Exception as e:
-    print(f"Failed to load RAG system: {e}")
-    traceback.print_exc()
-    rag_system_loaded = False
+# Initialize RAG system in the background so the web app can serve requests right away.
+# RAG_BACKEND=fake swaps in offline stand-in models for load testing.
+# In pre-fork mode (gunicorn.conf.py) the master loads the models before forking and
+# each worker starts serving them from start_worker.
+if INFERENCE_SERVER_URL:
+    # The models run in inference_server.py; this process does not even import them
+    rag_system = InferenceClient(INFERENCE_SERVER_URL)
+else:
+    from rag_system import RAGSystem
+    from stub_backends import StubRAGSystem
+    rag_class = StubRAGSystem if os.getenv('RAG_BACKEND') == 'fake' else RAGSystem
+    rag_system = rag_class(model_path, index_path, context_map_path, top_k=3)
+    if PREFORK:
+        rag_system.load(serve=False)
+    else:
+        rag_system.start()
+
+# Optional bearer token for /metrics; without it the endpoint is open (keep it off public networks)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def app_metrics():
+    """Queue depths, cache counters and component state, read when /metrics is scraped"""
+    families = rag_system.metric_families()
+
+    ocr = ocr_queue.status()
+    families.append(('medqa_ocr_pending', metrics.GAUGE, 'OCR jobs queued or running.', [({}, ocr['pending'])]))
+
+    cache = extraction_cache.stats()
+    families += [
+        ('medqa_extraction_cache_hits_total', metrics.COUNTER, 'Uploads served from the extraction cache.',
+         [({}, cache['hits'])]),
+        ('medqa_extraction_cache_misses_total', metrics.COUNTER, 'Uploads that had to be extracted.',
+         [({}, cache['misses'])]),
+        ('medqa_extraction_cache_hit_ratio', metrics.GAUGE, 'Extraction cache hits per lookup.',
+         [({}, cache['hit_rate'])]),
+        ('medqa_extraction_cache_evictions_total', metrics.COUNTER, 'Extraction cache entries evicted.',
+         [({}, cache['evictions'])]),
+        ('medqa_extraction_cache_bytes', metrics.GAUGE, 'Size of the extraction cache on disk.',
+         [({}, cache['size_bytes'])]),
+    ]
+    if gemini_client is not None:
+        families.append(('medqa_gemini_circuit_open', metrics.GAUGE, 'Whether the Gemini circuit breaker is open.',
+                         [({}, int(gemini_client.status()['circuit'] != 'closed'))]))
+    return families
+
+metrics.register_collector(app_metrics)
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    g.metrics_token = metrics.begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    """Per-stage breakdown of this request (stages finished before the response started)"""
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    metrics.REQUEST_SECONDS.observe(total, request.endpoint or 'unmatched', request.method,
+                                    str(response.status_code))
+    response.headers['Server-Timing'] = metrics.server_timing_header(metrics.request_timings(), total)
+    return response
+
+@app.teardown_request
+def end_request_timing(exc):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.end_request(token)
+
+# ------------------- Profiling -------------------
+
+# Comma-separated emails of users allowed to profile requests and download profiles
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+profile_store = ProfileStore()
+# Low-rate sampling of every request (PROFILE_CONTINUOUS_HZ, off by default)
+continuous_profiler = ContinuousProfiler()
+if not PREFORK:
+    continuous_profiler.start()
+
+def is_admin():
+    return 'user_id' in session and session.get('email', '').lower() in ADMIN_EMAILS
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def requested_profile_mode():
+    """Profiling mode asked for with ``X-Profile: sample|cprofile`` or ``?profile=``, admins only"""
+    mode = (request.headers.get('X-Profile') or request.args.get('profile') or '').lower()
+    if not mode or not is_admin():
+        return None
+    if mode in ('1', 'true'):
+        return 'sample'
+    return mode if mode in PROFILE_MODES else None
+
+def profiled(view):
+    """Run the request under a profiler when an admin asks for it; the profile id is sent back as X-Profile-Id"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        mode = requested_profile_mode()
+        if mode is None:
+            return view(*args, **kwargs)
+        g.profiling = True
+        with profile_request(profile_store, mode, request.endpoint,
+                             path=request.path, user=session.get('email')) as run:
+            response = app.make_response(view(*args, **kwargs))
+        response.headers['X-Profile-Id'] = run.id
+        return response
+    return wrapper
+
+@app.before_request
+def enter_continuous_profile():
+    continuous_profiler.enter(request.endpoint or 'unmatched')
+
+@app.teardown_request
+def leave_continuous_profile(exc):
+    continuous_profiler.leave()
+
+@app.route('/admin/profiles')
+@admin_required
+def list_profiles():
+    continuous = continuous_profiler.snapshot()
+    return jsonify({
+        'profiles': profile_store.list(),
+        'continuous': continuous[1] if continuous else None
+    })
+
+@app.route('/admin/profiles/continuous')
+@admin_required
+def continuous_profile():
+    """Collapsed stacks of all requests since start (or the last ``?reset=1``), rooted at the endpoint"""
+    continuous = continuous_profiler.snapshot(reset=request.args.get('reset') == '1')
+    if continuous is None:
+        return jsonify({'error': 'Continuous profiling is off (set PROFILE_CONTINUOUS_HZ)'}), 404
+    return Response(continuous[0], mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=continuous.collapsed'})
+
+@app.route('/admin/profiles/<profile_id>')
+@admin_required
+def get_profile(profile_id):
+    summary = profile_store.get(profile_id)
+    if summary is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(summary)
+
+@app.route('/admin/profiles/<profile_id>/<fmt>')
+@admin_required
+def download_profile(profile_id, fmt):
+    """Download a profile as collapsed stacks (flamegraph.pl, speedscope) or cProfile stats"""
+    if fmt not in ('collapsed', 'pstats'):
+        return jsonify({'error': 'Format must be collapsed or pstats'}), 400
+    try:
+        path = profile_store.path(profile_id, fmt)
+    except KeyError:
+        path = None
+    if path is None or not os.path.exists(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{profile_id}.{fmt}",
+                     mimetype='text/plain' if fmt == 'collapsed' else 'application/octet-stream')
+
+def start_worker():
+    """Start this process's threads in a pre-forked worker (gunicorn post_fork hook)"""
+    start_pdf_pool()
+    continuous_profiler.start()
+    if not INFERENCE_SERVER_URL and rag_system.state != rag_system.FAILED:
+        threading.Thread(target=rag_system.start_serving, name='rag-start', daemon=True).start()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    # Constant-time comparison so the token cannot be guessed from response times
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    if METRICS_TOKEN and not hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}".encode('utf-8')):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
 
 @app.route('/')
 def home():
@@ -124,6 +326,7 @@ def chat():
     return render_template('index.html')
 
 @app.route('/api/chat', methods=['POST'])
+@profiled
 def chat_api():
     # Check if user is either guest or logged in
     if 'guest' not in session and 'user_id' not in session:
@@ -135,26 +338,16 @@ def chat_api():
     if not user_message:
         return jsonify({'error': 'No message provided'}), 400
     
-    # Create session if it doesn't exist (for both guest and logged-in users)
-    if 'session_id' not in session:
-        if 'guest' in session:
-            session['session_id'] = f"guest_{str(uuid.uuid4())[:8]}"
-        else:
-            # For logged-in users, create a proper session with title
-            title = user_message[:30] + '...' if len(user_message) > 30 else user_message
-            session['session_id'] = ChatContext.create_session(session['user_id'], title)
-    
-    # Store user message
-    if 'guest' not in session:  # Only store messages for authenticated users
-        ChatContext.add_message(session['session_id'], 'user', user_message)
+    ensure_chat_session(user_message)
     
     try:
         # Process based on selected model
-        if selected_model == 'rag' and rag_system_loaded:
+        if selected_model == 'rag' and rag_system.is_ready:
             # Use the RAG model for response generation
             result = process_with_rag_model(user_message)
             ai_response = result['generated_answer']
             context_info = result.get('retrieved_contexts', [])
+            decoding_profile = result.get('decoding_profile')
             
             # Store AI response with model info and context
             if 'guest' not in session:  # Only store messages for authenticated users
@@ -163,17 +356,19 @@ def chat_api():
                     'assistant', 
                     ai_response, 
                     model=selected_model,
-                    context_info=json.dumps(context_info)
+                    context_info=json.dumps(context_info),
+                    decoding_profile=decoding_profile
                 )
             
             return jsonify({
                 'response': ai_response,
                 'isMarkdown': True,
-                'context_info': context_info
+                'context_info': context_info,
+                'decoding_profile': decoding_profile
             })
         elif selected_model == 'gemini':
             # Check if Gemini API is configured
-            if model is None:
+            if gemini_client is None:
                 error_msg = "Gemini API key not configured. Please check your environment variables."
                 print(error_msg)
                 return jsonify({'error': error_msg}), 500
@@ -204,12 +399,106 @@ def chat_api():
         traceback.print_exc()  # Print detailed stack trace
         return jsonify({'error': f"An error occurred: {error_detail}"}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_api():
+    """Stream the answer as Server-Sent Events while it is being generated."""
+    if 'guest' not in session and 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_message = request.json.get('message')
+    selected_model = request.json.get('model', 'gemini')
+    
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+    
+    context_info = []
+    decoding_profile = None
+    # Generator that holds a RAG admission until it is closed
+    answer_stream = None
+    # Set when a Gemini answer should be stored in the answer cache once complete
+    cache_embedding = None
+    try:
+        if selected_model == 'rag' and rag_system.is_ready:
+            ensure_chat_session(user_message)
+            session_key = session['session_id']
+            rag_system.ensure_documents(session_key, session_documents(session_key))
+            # Same admission, decoding profile and answer cache as /api/chat; the result comes first
+            answer_stream = rag_system.answer_stream(user_message, session_key)
+            result = next(answer_stream)
+            context_info = result.get('retrieved_contexts', [])
+            decoding_profile = result.get('decoding_profile')
+            chunks = stream_rag_answer(answer_stream)
+        elif selected_model == 'gemini':
+            if gemini_client is None:
+                return jsonify({'error': "Gemini API key not configured. Please check your environment variables."}), 500
+            ensure_chat_session(user_message)
+            cache_embedding, cached = cached_gemini_answer(user_message)
+            if cached is not None:
+                cache_embedding = None
+                chunks = iter([cached])
+            else:
+                chunks = stream_gemini_answer(build_gemini_prompt(user_message))
+        else:
+            return jsonify({'error': f"Selected model '{selected_model}' is not available"}), 400
+    except Exception as e:
+        print(f"Error in chat_stream_api: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': f"An error occurred: {str(e)}"}), 500
+    
+    # Read these now; the generator may outlive the request context
+    is_guest = 'guest' in session
+    session_id = session.get('session_id')
+    
+    def generate():
+        parts = []
+        try:
+            yield sse_event('meta', {
+                'model': selected_model,
+                'context_info': context_info,
+                'decoding_profile': decoding_profile
+            })
+            for piece in chunks:
+                parts.append(piece)
+                yield sse_event('token', {'text': piece})
+        except Exception as e:
+            print(f"Error while streaming: {str(e)}")
+            traceback.print_exc()
+            yield sse_event('error', {'error': f"An error occurred: {str(e)}"})
+            return
+        finally:
+            # Releases the RAG admission when the client leaves before the answer is done
+            if answer_stream is not None:
+                answer_stream.close()
+        
+        ai_response = ''.join(parts)
+        if cache_embedding is not None:
+            rag_system.answer_cache.store('gemini', cache_embedding, user_message, {'answer': ai_response})
+        if not is_guest:
+            ChatContext.add_message(
+                session_id,
+                'assistant',
+                ai_response,
+                model=selected_model,
+                context_info=json.dumps(context_info) if selected_model == 'rag' else None,
+                decoding_profile=decoding_profile
+            )
+        yield sse_event('done', {'response': ai_response})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/chat/sessions', methods=['GET'])
 def get_user_sessions():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    sessions = ChatContext.get_user_sessions(session['user_id'])
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', default=0, type=int)
+    
+    sessions = ChatContext.get_user_sessions(session['user_id'], limit=limit, offset=max(0, offset))
     return jsonify({'sessions': sessions})
 
 @app.route('/api/chat/session/<session_id>', methods=['GET', 'DELETE', 'POST'])
@@ -218,18 +507,27 @@ def manage_session(session_id):
         return jsonify({'error': 'Unauthorized'}), 401
     
     if request.method == 'GET':
-        messages = ChatContext.get_session_messages(session_id)
-        # Verify this session belongs to the current user
+        # Verify this session belongs to the current user before reading messages
         session_info = ChatContext.get_session_info(session_id)
         if not session_info or session_info['user_id'] != session['user_id']:
             return jsonify({'error': 'Unauthorized access to session'}), 403
         
+        # Keyset pagination: newest page first, then older pages via before_id
+        before_id = request.args.get('before_id', type=int)
+        limit = min(max(request.args.get('limit', default=50, type=int), 1), 200)
+        messages, has_more = ChatContext.get_session_messages_page(session_id, before_id, limit)
+        
         session['session_id'] = session_id  # Set the active session
-        return jsonify({'messages': messages})
+        return jsonify({
+            'messages': messages,
+            'has_more': has_more,
+            'next_before_id': messages[0]['id'] if messages else None
+        })
     
     elif request.method == 'DELETE':
         success = ChatContext.delete_session(session_id, session['user_id'])
         if success:
+            rag_system.session_index.drop(session_id)
             # If deleting the active session, clear it from session
             if session.get('session_id') == session_id:
                 session.pop('session_id', None)
@@ -258,6 +556,7 @@ def create_new_session():
     return jsonify({'session_id': session_id})
 
 @app.route('/api/upload', methods=['POST'])
+@profiled
 def upload_file():
     # Check if user is either guest or logged in
     if 'guest' not in session and 'user_id' not in session:
@@ -274,29 +573,162 @@ def upload_file():
         return jsonify({'error': 'File type not allowed'}), 400
     
     try:
-        extracted_text = extract_text_from_file(file)
-        if not extracted_text:
+        # Uploads are indexed into the chat session's document index, so make sure it exists
+        session_key = ensure_upload_session()
+        original_name = file.filename
+        digest = extraction_cache.digest(file)
+        filepath = extraction_cache.text_path(digest)
+
+        cached = extraction_cache.get(digest, EXTRACTION_LIMITS)
+        if cached is not None:
+            try:
+                with open(filepath, encoding='utf-8') as f:
+                    preview = f.read(501)
+            except OSError:
+                # Swept between the lookup and the read: extract it again
+                cached = None
+        if cached is not None:
+            result = upload_result(original_name, filepath, preview)
+            remember_document(session_key, filepath, original_name)
+            result.update(pages=cached['pages'], truncated=cached['truncated'], cached=True)
+            return jsonify(index_upload(session_key, result))
+
+        if is_image_file(file):
+            def on_ocr_result(text):
+                result = save_extracted_text(original_name, [text], filepath)
+                if result is not None:
+                    extraction_cache.put(digest, limits=EXTRACTION_LIMITS)
+                return index_upload(session_key, result)
+
+            # OCR is queued; the client polls /api/upload/<job_id> for the result
+            job_id = ocr_queue.submit(file.read(), upload_owner(), original_name, on_result=on_ocr_result)
+            # The result arrives outside this request, so the cookie is updated now
+            remember_document(session_key, filepath, original_name)
+            return jsonify({'job_id': job_id, 'status': OCRQueue.QUEUED, 'filename': original_name}), 202
+
+        report = {}
+        result = save_extracted_text(original_name, iter_text_from_file(file, report), filepath)
+        if result is None:
             return jsonify({'error': 'Could not extract text from file'}), 400
-            
-        # Generate a unique filename
-        filename = f"{uuid.uuid4().hex}.txt"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(extracted_text)
-            
-        return jsonify({
-            'filename': file.filename,
-            'content': extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text,
-            'saved_path': filepath
-        })
+        remember_document(session_key, filepath, original_name)
+        extraction_cache.put(digest, report['pages'], report['truncated'], EXTRACTION_LIMITS)
+        result.update(pages=report['pages'], truncated=report['truncated'], cached=False)
+        return jsonify(index_upload(session_key, result))
+    except FileTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except OCRQueueFullError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f"Error in upload_file: {str(e)}")
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Status of a queued OCR job, with the extracted text once it is done"""
+    if 'guest' not in session and 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = ocr_queue.get(job_id, upload_owner())
+    if job is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(job)
+
+def upload_owner():
+    """Identify who may read an upload job: the user, or this guest's browser session."""
+    if 'user_id' in session:
+        return f"user:{session['user_id']}"
+    if 'upload_token' not in session:
+        session['upload_token'] = uuid.uuid4().hex
+    return f"guest:{session['upload_token']}"
+
+def save_extracted_text(original_name, pieces, filepath):
+    """Write extracted text to ``filepath`` as it arrives; None if there was none.
+
+    Only the preview returned to the client is kept in memory. The file is
+    written under a temporary name and renamed, so concurrent identical
+    uploads never see a half-written file.
+    """
+    tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+    preview = ''
+    chars = 0
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for i, piece in enumerate(pieces):
+                if i:
+                    f.write('\n')
+                f.write(piece)
+                chars += len(piece)
+                if len(preview) <= 500:
+                    preview += ('\n' if i else '') + piece[:501]
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    if not chars:
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, filepath)
+    return upload_result(original_name, filepath, preview)
+
+def upload_result(original_name, filepath, preview):
+    return {
+        'filename': original_name,
+        'content': preview[:500] + "..." if len(preview) > 500 else preview,
+        'saved_path': filepath
+    }
+
+def index_upload(session_key, result):
+    """Add saved upload text to the session's document index (needs the RAG embedder).
+
+    ``result['indexed']`` is the number of chunks added; 0 means the client has
+    to fall back to sending the text itself.
+    """
+    if result is None:
+        raise ValueError('Could not extract text from file')
+    result['indexed'] = 0
+    if rag_system.is_ready:
+        try:
+            with open(result['saved_path'], encoding='utf-8') as f:
+                result['indexed'] = rag_system.add_document(
+                    session_key, result['filename'], f, source=result['saved_path'])
+        except Exception as e:
+            print(f"Error indexing upload: {str(e)}")
+    return result
+
+# Per chat session, the saved uploads to search (kept in the cookie so any worker can rebuild its index)
+MAX_REMEMBERED_SESSIONS = 5
+MAX_DOCUMENTS_PER_SESSION = 10
+
+def ensure_upload_session():
+    """Return the active chat session id, creating a session if there is none yet."""
+    if 'session_id' not in session:
+        if 'guest' in session:
+            session['session_id'] = f"guest_{str(uuid.uuid4())[:8]}"
+        else:
+            session['session_id'] = ChatContext.create_session(session['user_id'])
+    return session['session_id']
+
+def remember_document(session_key, filepath, filename):
+    documents = session.get('documents', {})
+    entries = documents.pop(session_key, [])
+    # Re-uploading a file must not push other documents out of the list
+    if not any(entry[0] == filepath for entry in entries):
+        entries = (entries + [[filepath, filename]])[-MAX_DOCUMENTS_PER_SESSION:]
+    documents[session_key] = entries  # most recently used session last
+    session['documents'] = dict(list(documents.items())[-MAX_REMEMBERED_SESSIONS:])
+
+def session_documents(session_key):
+    return [tuple(entry) for entry in session.get('documents', {}).get(session_key, [])]
     
+@app.errorhandler(413)
+def request_entity_too_large(e):
+    return jsonify({'error': f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"}), 413
+
 @app.route('/logout')
 def logout():
+    for session_key in session.get('documents', {}):
+        rag_system.session_index.drop(session_key)
     session.clear()
     return redirect(url_for('home'))
 
@@ -304,38 +736,124 @@ def logout():
 def check_system_status():
     """Endpoint to check if models are available"""
     status = {
-        'rag_system': rag_system_loaded,
-        'gemini_api': model is not None
+        'rag_system': rag_system.is_ready,
+        'rag_status': rag_system.status(),
+        'gemini_api': gemini_client is not None
     }
+    if gemini_client is not None:
+        status['gemini_circuit'] = gemini_client.status()['circuit']
+    status['ocr_queue'] = ocr_queue.status()
+    status['extraction_cache'] = extraction_cache.stats()
     return jsonify(status)
 
+def ensure_chat_session(user_message):
+    """Create the chat session if needed and store the user's message."""
+    # Create session if it doesn't exist (for both guest and logged-in users)
+    if 'session_id' not in session:
+        if 'guest' in session:
+            session['session_id'] = f"guest_{str(uuid.uuid4())[:8]}"
+        else:
+            # For logged-in users, create a proper session with title
+            title = user_message[:30] + '...' if len(user_message) > 30 else user_message
+            session['session_id'] = ChatContext.create_session(session['user_id'], title)
+    
+    # Store user message
+    if 'guest' not in session:  # Only store messages for authenticated users
+        ChatContext.add_message(session['session_id'], 'user', user_message)
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def document_excerpts(user_message):
+    """Prompt section with the uploaded-document chunks that match the question"""
+    session_key = session.get('session_id')
+    if session_key is None:
+        return ""
+    rag_system.ensure_documents(session_key, session_documents(session_key))
+    chunks = rag_system.search_documents(user_message, session_key)
+    if not chunks:
+        return ""
+    excerpts = "\n".join(f"[{chunk['filename']}] {chunk['context']}" for chunk in chunks)
+    return f"\nRelevant excerpts from the patient's uploaded documents:\n{excerpts}\n"
+
+def build_gemini_prompt(user_message):
+    """Build the Gemini prompt, including recent history for logged-in users"""
+    excerpts = document_excerpts(user_message)
+    
+    # Guest users don't have chat history context
+    if 'guest' in session or 'session_id' not in session:
+        return f"""Act as a medical expert. Use markdown formatting in your responses.
+        Keep responses concise and focused on general medical information.
+        {excerpts}
+        Question: {user_message}
+        Answer:"""
+    
+    # Get last 5 messages for context (excluding current message)
+    context_messages = ChatContext.get_session_messages(session['session_id'], limit=5)
+    
+    # Build medical-focused prompt with context
+    prompt = """Act as a medical expert. Use markdown formatting in your responses to highlight 
+    important information, create headers for sections, and format lists properly. 
+    Previous context:\n"""
+    
+    for msg in context_messages:
+        role = "Patient" if msg['role'] == 'user' else "Doctor"
+        prompt += f"{role}: {msg['content']}\n"
+    
+    prompt += excerpts
+    prompt += f"\nNew question: {user_message}:"
+    return prompt
+
+def stream_gemini_answer(prompt):
+    """Yield Gemini response text chunk by chunk using the streaming API"""
+    yield from metrics.timed_iter('gemini', gemini_client.stream(prompt), 'stream')
+
+def stream_rag_answer(pieces):
+    """Yield the RAG answer incrementally, with the same heading as the non-streaming path"""
+    yield "### Medical Answer\n\n"
+    yield from pieces
+
+def answer_cache_embedding(user_message):
+    """Question embedding for the Gemini answer cache, or None when the prompt would carry
+    more than the question (uploaded documents or earlier messages)"""
+    if not rag_system.is_ready or not rag_system.answer_cache.enabled:
+        return None
+    session_key = session.get('session_id')
+    if session_documents(session_key):
+        return None
+    if 'guest' not in session and session_key is not None:
+        # The current question is already stored; anything older is history
+        _, has_history = ChatContext.get_session_messages_page(session_key, limit=1)
+        if has_history:
+            return None
+    return rag_system.embed_query(user_message)
+
+def cached_gemini_answer(user_message):
+    """``(embedding, answer)`` from the Gemini answer cache; the embedding is None when the
+    answer must not be cached, the answer None on a miss"""
+    cache_embedding = answer_cache_embedding(user_message)
+    if cache_embedding is None:
+        return None, None
+    with metrics.timed('answer_cache', 'lookup'):
+        hit = rag_system.answer_cache.lookup('gemini', cache_embedding)
+    return cache_embedding, hit[0]['answer'] if hit is not None else None
+
 def process_with_gemini(user_message):
     """Process the user message with Gemini API"""
     try:
-        # Guest users don't have chat history context
-        if 'guest' in session or 'session_id' not in session:
-            prompt = f"""Act as a medical expert. Use markdown formatting in your responses.
-            Keep responses concise and focused on general medical information.
-            Question: {user_message}
-            Answer:"""
-        else:
-            # Get last 5 messages for context (excluding current message)
-            context_messages = ChatContext.get_session_messages(session['session_id'], limit=5)
-            
-            # Build medical-focused prompt with context
-            prompt = """Act as a medical expert. Use markdown formatting in your responses to highlight 
-            important information, create headers for sections, and format lists properly. 
-            Previous context:\n"""
-            
-            for msg in context_messages:
-                role = "Patient" if msg['role'] == 'user' else "Doctor"
-                prompt += f"{role}: {msg['content']}\n"
-            
-            prompt += f"\nNew question: {user_message}:"
+        cache_embedding, cached = cached_gemini_answer(user_message)
+        if cached is not None:
+            return cached
+
+        prompt = build_gemini_prompt(user_message)
         
         # Generate response
-        response = model.generate_content(prompt)
-        return response.text
+        with metrics.timed('gemini', 'generate'):
+            answer = gemini_client.generate(prompt)
+        if cache_embedding is not None:
+            rag_system.answer_cache.store('gemini', cache_embedding, user_message, {'answer': answer})
+        return answer
     except Exception as e:
         print(f"Error in process_with_gemini: {str(e)}")
         traceback.print_exc()
@@ -344,19 +862,12 @@ def process_with_gemini(user_message):
 def process_with_rag_model(user_message):
     """Process the user message with the RAG model"""
     try:
-        if not rag_system_loaded:
-            raise Exception("RAG system is not properly loaded")
-        
-        # Use the RAG pipeline to generate a response
-        result = rag_pipeline(
-            user_message, 
-            rag_model, 
-            rag_tokenizer, 
-            embedding_model, 
-            index, 
-            context_map, 
-            top_k=3
-        )
+        # Use the RAG pipeline to generate a response (batched with concurrent requests),
+        # retrieving from the session's uploaded documents as well as PubMedQA
+        session_key = session.get('session_id')
+        rag_system.ensure_documents(session_key, session_documents(session_key))
+        # A profiled request answers on its own thread so generation shows up in its profile
+        result = rag_system.answer(user_message, session_key, inline=g.get('profiling', False))
         
         # Format the answer with markdown for better presentation
         formatted_answer = f"### Medical Answer\n\n{result['generated_answer']}"
@@ -0,0 +1,112 @@
+#benchmarks/adaptive_decoding.py
+"""Simulate overload to compare fixed full-beam decoding with adaptive profiles.
+
+Generation is replaced by sleeps calibrated per profile, so this runs offline
+and isolates the scheduling behaviour (RAGBatcher + DecodingController).
+Usage:
+    python benchmarks/adaptive_decoding.py --rate 12 --duration 20
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from decoding import DecodingController
+from rag_batcher import RAGBatcher
+
+# Seconds for a batch of one, roughly t5-small on a laptop CPU
+PROFILE_COST = {'full_beam': 1.2, 'small_beam': 0.6, 'greedy': 0.25}
+# Extra cost per additional request in the same padded batch
+BATCH_GROWTH = 0.15
+
+
+def batch_seconds(profile, size):
+    return PROFILE_COST[profile] * (1 + BATCH_GROWTH * (size - 1))
+
+
+def fake_batch_fn(controller):
+    def run(items):
+        by_profile = {}
+        for position, (_, profile) in enumerate(items):
+            by_profile.setdefault(profile, []).append(position)
+        results = [None] * len(items)
+        for profile, positions in by_profile.items():
+            seconds = batch_seconds(profile, len(positions))
+            time.sleep(seconds)
+            controller.record(profile, seconds)
+            for i in positions:
+                results[i] = profile
+        return results
+    return run
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def simulate(adaptive, rate, duration, slo_ms, seed):
+    # Seeded the way RAGSystem.warm_up does it: one full batch per profile
+    controller = DecodingController(
+        slo_ms=slo_ms, max_batch_size=8,
+        initial_estimates={p: batch_seconds(p, 8) for p in PROFILE_COST}
+    )
+    batcher = RAGBatcher(fake_batch_fn(controller), max_batch_size=8, max_wait_ms=10).start()
+    rng = random.Random(seed)
+    latencies, profiles = [], Counter()
+    lock = threading.Lock()
+    threads = []
+
+    def request():
+        profile = controller.choose() if adaptive else 'full_beam'
+        start = time.perf_counter()
+        try:
+            used = batcher.submit(("question", profile))
+        finally:
+            if adaptive:
+                controller.release(profile)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            profiles[used] += 1
+
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        t = threading.Thread(target=request)
+        t.start()
+        threads.append(t)
+        time.sleep(rng.expovariate(rate))
+    for t in threads:
+        t.join()
+    batcher.stop()
+
+    within_slo = sum(l * 1000 <= slo_ms for l in latencies) / len(latencies)
+    return {
+        'p50_s': percentile(latencies, 50),
+        'p99_s': percentile(latencies, 99),
+        'within_slo': within_slo,
+        'profiles': dict(profiles),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=12.0, help='arrivals per second')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--slo-ms', type=float, default=4000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"Poisson arrivals at {args.rate}/s for {args.duration}s, SLO {args.slo_ms:.0f} ms")
+    print(f"{'mode':<10}{'p50 s':>8}{'p99 s':>8}{'in SLO':>8}  profiles")
+    for name, adaptive in (('fixed', False), ('adaptive', True)):
+        r = simulate(adaptive, args.rate, args.duration, args.slo_ms, args.seed)
+        print(f"{name:<10}{r['p50_s']:>8.2f}{r['p99_s']:>8.2f}{r['within_slo']:>8.0%}  {r['profiles']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#benchmarks/ann_tuning.py
+"""Measure recall@k and QPS of approximate indices against exact search.
+
+Vectors come from an existing flat index (``--index``) or are generated
+synthetically (``--synthetic N``). Queries are perturbed copies of stored
+vectors, so they behave like real paraphrased questions. Usage:
+    python benchmarks/ann_tuning.py --index ai_integration/pubmedqa_faiss.index
+    python benchmarks/ann_tuning.py --synthetic 100000 --dim 384
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ann_index import build_index, configure_search, read_vectors
+
+NPROBE_GRID = (1, 4, 8, 16, 32, 64, 128)
+EF_SEARCH_GRID = (16, 32, 64, 128, 256)
+
+
+def make_queries(vectors, n_queries, noise, seed):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + noise * rng.standard_normal((len(picks), vectors.shape[1])).astype("float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(truth, found):
+    hits = sum(len(set(t) & set(f[f >= 0])) for t, f in zip(truth, found))
+    return hits / truth.size
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    return found, len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--index', help='flat index to take vectors from')
+    source.add_argument('--synthetic', type=int, help='number of random vectors to generate')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--noise', type=float, default=0.05)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--types', default='ivf_flat,ivf_pq,hnsw')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.index:
+        vectors = read_vectors(faiss.read_index(args.index))
+    else:
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((args.synthetic, args.dim)).astype("float32")
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    faiss.normalize_L2(vectors)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+
+    exact = build_index(vectors.copy(), "flat")
+    truth, exact_qps = timed_search(exact, queries, args.k)
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, recall@{args.k} vs exact inner product")
+    print(f"{'index':<10}{'param':<14}{'recall':>8}{'QPS':>12}{'build s':>10}")
+    print(f"{'flat':<10}{'-':<14}{1.0:>8.3f}{exact_qps:>12.0f}{0.0:>10.1f}")
+
+    for index_type in args.types.split(','):
+        start = time.perf_counter()
+        index = build_index(vectors.copy(), index_type)
+        build_s = time.perf_counter() - start
+
+        if index_type == 'hnsw':
+            grid = [('efSearch', value, dict(ef_search=value)) for value in EF_SEARCH_GRID]
+        else:
+            grid = [('nprobe', value, dict(nprobe=value)) for value in NPROBE_GRID]
+
+        for name, value, params in grid:
+            configure_search(index, **params)
+            found, qps = timed_search(index, queries, args.k)
+            print(f"{index_type:<10}{f'{name}={value}':<14}{recall_at_k(truth, found):>8.3f}"
+                  f"{qps:>12.0f}{build_s:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#benchmarks/answer_cache.py
+"""Replay a question log through the semantic answer cache: hit rate, latency and near misses.
+
+The log is one of:
+
+    --db instance/database.db   user messages from the chat history, in order
+    --log questions.txt         one question per line (or .jsonl with
+                                ``question`` and optional ``timestamp``)
+    (neither)                   a synthetic log: Zipf-popular questions asked
+                                in several phrasings, Poisson arrivals
+
+For each threshold the report shows the hit ratio, how many hits matched a
+differently worded question (the paraphrase hits exact-match caching would
+miss), the lookup latency, the generation time saved at ``--answer-ms`` per
+avoided answer, and the lowest-similarity hits so a threshold can be checked
+by eye before it is deployed. TTL and size follow ``RAG_ANSWER_CACHE_TTL_S`` /
+``RAG_ANSWER_CACHE_SIZE``, with the log's timestamps as the clock.
+
+The embedder is all-MiniLM-L6-v2 as in production; ``--random-embedder``
+uses the untrained stand-in from ``benchmarks/run.py`` (offline, latency only:
+its similarities are meaningless). Usage:
+    python benchmarks/answer_cache.py --db instance/database.db --thresholds 0.9 0.95
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from run import OUTCOMES, POPULATIONS, TOPICS, Fixtures
+
+PHRASINGS = [
+    "Does {topic} affect {outcome} in {population}?",
+    "Is {topic} associated with {outcome} among {population}?",
+    "What is the effect of {topic} on {outcome} in {population}?",
+    "does {topic} change {outcome} for {population}",
+]
+
+
+def synthetic_log(count, exponent=1.1, seed=3):
+    rng = np.random.default_rng(seed)
+    topics = [(t, o, p) for t in TOPICS for o in OUTCOMES for p in POPULATIONS]
+    rng.shuffle(topics)
+    ranks = np.arange(1, len(topics) + 1)
+    probs = 1 / ranks ** exponent
+    probs /= probs.sum()
+    clock = 0.0
+    log = []
+    for i in rng.choice(len(topics), size=count, p=probs):
+        topic, outcome, population = topics[i]
+        template = PHRASINGS[rng.integers(len(PHRASINGS))]
+        clock += rng.exponential(2.0)  # one question every ~2 s
+        log.append((template.format(topic=topic, outcome=outcome, population=population), clock))
+    return log
+
+
+def db_log(path):
+    """User messages from the chat database, oldest first."""
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT content, timestamp FROM chat_messages WHERE role = 'user' ORDER BY id").fetchall()
+    log = []
+    for content, timestamp in rows:
+        try:
+            clock = datetime.fromisoformat(str(timestamp)).timestamp()
+        except ValueError:
+            clock = log[-1][1] if log else 0.0
+        log.append((content, clock))
+    return log
+
+
+def file_log(path):
+    log = []
+    with open(path, encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith('.jsonl'):
+                record = json.loads(line)
+                log.append((record['question'], float(record.get('timestamp', i))))
+            else:
+                log.append((line, float(i)))
+    return log
+
+
+def load_embedder(random_embedder):
+    if random_embedder:
+        return Fixtures(tempfile.mkdtemp(prefix='medqa_answer_cache_'), 'tiny').embedder()
+    from rag_qa import load_embedding_model
+    return load_embedding_model()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='chat database to read user messages from')
+    parser.add_argument('--log', help='question log (.txt or .jsonl)')
+    parser.add_argument('--synthetic', type=int, default=3000, help='synthetic log length')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.85, 0.9, 0.95, 0.98])
+    parser.add_argument('--answer-ms', type=float, default=1200.0, help='cost of one generated answer')
+    parser.add_argument('--show', type=int, default=5, help='lowest-similarity hits to print per threshold')
+    parser.add_argument('--random-embedder', action='store_true')
+    args = parser.parse_args()
+
+    from answer_cache import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_S, AnswerCache
+    from query_cache import normalize_query
+
+    if args.db:
+        log = db_log(args.db)
+    elif args.log:
+        log = file_log(args.log)
+    else:
+        log = synthetic_log(args.synthetic)
+    print(f"{len(log)} questions, {len({normalize_query(q) for q, _ in log})} distinct after normalization; "
+          f"cache size {ANSWER_CACHE_SIZE}, ttl {ANSWER_CACHE_TTL_S:.0f}s")
+
+    import faiss
+    embedder = load_embedder(args.random_embedder)
+    embed_ms = []
+    embeddings = []
+    for question, _ in log:
+        start = time.perf_counter()
+        embedding = embedder.encode([question])
+        faiss.normalize_L2(embedding)
+        embed_ms.append((time.perf_counter() - start) * 1000)
+        embeddings.append(embedding[0])
+    print(f"embedding p50 {np.percentile(embed_ms, 50):.2f} ms, p95 {np.percentile(embed_ms, 95):.2f} ms")
+
+    print(f"\n{'threshold':>10}{'hit ratio':>11}{'paraphrase':>12}{'lookup p50':>12}{'lookup p95':>12}{'saved s':>10}")
+    near_misses = {}
+    for threshold in args.thresholds:
+        now = [0.0]
+        cache = AnswerCache(len(embeddings[0]), threshold=threshold, clock=lambda: now[0])
+        lookup_ms = []
+        hits = paraphrases = 0
+        weakest = []
+        for (question, clock), embedding in zip(log, embeddings):
+            now[0] = clock
+            start = time.perf_counter()
+            hit = cache.lookup('replay', embedding)
+            lookup_ms.append((time.perf_counter() - start) * 1000)
+            if hit is None:
+                cache.store('replay', embedding, question, {'answer': None})
+                continue
+            hits += 1
+            _, similarity, cached_question = hit
+            if normalize_query(cached_question) != normalize_query(question):
+                paraphrases += 1
+                weakest.append((similarity, question, cached_question))
+        near_misses[threshold] = sorted(weakest)[:args.show]
+        print(f"{threshold:>10.2f}{hits / len(log):>11.1%}{paraphrases:>12}"
+              f"{np.percentile(lookup_ms, 50):>12.3f}{np.percentile(lookup_ms, 95):>12.3f}"
+              f"{hits * args.answer_ms / 1000:>10.0f}")
+
+    for threshold, pairs in near_misses.items():
+        if pairs:
+            print(f"\nLowest-similarity hits at {threshold:.2f}:")
+            for similarity, question, cached_question in pairs:
+                print(f"  {similarity:.3f}  {question!r}  ->  {cached_question!r}")
+
+
+if __name__ == '__main__':
+    main()
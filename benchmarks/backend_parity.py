@@ -0,0 +1,98 @@
+#benchmarks/backend_parity.py
+"""Check answer/embedding parity and speed of the alternative CPU backends.
+
+Every backend answers the same questions over the same retrieved contexts as
+the fp32 PyTorch model; the int8 embedder is compared against the fp32 one by
+cosine similarity. Usage:
+    python benchmarks/backend_parity.py --backends torch-int8,onnx,onnx-int8
+"""
+import argparse
+import difflib
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rag_qa import generate_answer, load_embedding_model, load_generator, retrieve_context
+from ann_index import load_index
+from context_store import load_context_map
+from rag_system import SAMPLE_QUESTIONS
+
+EXTRA_QUESTIONS = [
+    "Is obesity associated with asthma severity in children?",
+    "Do statins lower the risk of dementia?",
+    "What predicts readmission after heart failure hospitalization?",
+    "Does early mobilization improve outcomes after hip surgery?",
+]
+
+
+def time_answers(questions, contexts, model, tokenizer):
+    answers, latencies = [], []
+    for question, ctx in zip(questions, contexts):
+        start = time.perf_counter()
+        answers.append(generate_answer(question, ctx, model, tokenizer))
+        latencies.append(time.perf_counter() - start)
+    return answers, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-path', default='ai_integration/t5-small-pubmedqa')
+    parser.add_argument('--index-path', default='ai_integration/pubmedqa_faiss.index')
+    parser.add_argument('--context-map-path', default='ai_integration/context_map.pkl')
+    parser.add_argument('--backends', default='torch-int8,onnx,onnx-int8')
+    args = parser.parse_args()
+
+    questions = SAMPLE_QUESTIONS + EXTRA_QUESTIONS
+
+    # ------------------- Embedder -------------------
+    fp32_embedder = load_embedding_model(quantize=False)
+    int8_embedder = load_embedding_model(quantize=True)
+
+    timings = {}
+    vectors = {}
+    for name, embedder in (('fp32', fp32_embedder), ('int8', int8_embedder)):
+        embedder.encode(questions)  # warm-up
+        start = time.perf_counter()
+        for _ in range(5):
+            vectors[name] = embedder.encode(questions, normalize_embeddings=True)
+        timings[name] = (time.perf_counter() - start) / (5 * len(questions))
+    cosines = np.sum(vectors['fp32'] * vectors['int8'], axis=1)
+
+    print("Embedder        ms/query  min cos  mean cos")
+    print(f"fp32          {timings['fp32'] * 1000:>10.2f}        -         -")
+    print(f"int8          {timings['int8'] * 1000:>10.2f}  {cosines.min():>7.4f}  {cosines.mean():>8.4f}")
+
+    # ------------------- Generator -------------------
+    index = load_index(args.index_path)
+    context_map = load_context_map(args.context_map_path)
+    contexts = [retrieve_context(q, fp32_embedder, index, context_map)[0] for q in questions]
+
+    model, tokenizer = load_generator(args.model_path, 'torch')
+    generate_answer(questions[0], contexts[0], model, tokenizer)  # warm-up
+    reference, ref_latencies = time_answers(questions, contexts, model, tokenizer)
+
+    print()
+    print(f"{'Generator':<12}{'p50 ms':>10}{'speedup':>9}{'exact':>8}{'similarity':>12}")
+    ref_p50 = statistics.median(ref_latencies)
+    print(f"{'torch':<12}{ref_p50 * 1000:>10.0f}{1.0:>9.2f}{1.0:>8.2f}{1.0:>12.3f}")
+
+    for backend in args.backends.split(','):
+        model, tokenizer = load_generator(args.model_path, backend)
+        generate_answer(questions[0], contexts[0], model, tokenizer)
+        answers, latencies = time_answers(questions, contexts, model, tokenizer)
+
+        p50 = statistics.median(latencies)
+        exact = sum(a == r for a, r in zip(answers, reference)) / len(reference)
+        similarity = statistics.mean(
+            difflib.SequenceMatcher(None, a, r).ratio() for a, r in zip(answers, reference)
+        )
+        print(f"{backend:<12}{p50 * 1000:>10.0f}{ref_p50 / p50:>9.2f}{exact:>8.2f}{similarity:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#benchmarks/bm25_retrieval.py
+"""Build time, size, memory and query latency of the BM25 index.
+
+With a context map (the full PubMedQA pqa_artificial map has ~211k rows) the
+index is built over its passages; without one a synthetic corpus of the same
+shape is generated (Zipf-distributed vocabulary, ~220 terms per passage).
+Queries are spans of passage text, as medical questions reuse the terms of
+the abstracts that answer them.
+
+The index is searched in a fresh subprocess so the RSS numbers only include
+what ``BM25Index`` itself maps and allocates; mmap pages are reported
+separately because they are shared page cache, not per-process memory. Usage:
+    python benchmarks/bm25_retrieval.py [--context-map ai_integration/context_map.pkl] [--docs 211269]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from bm25_index import build_bm25_index
+
+CHILD = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+import numpy as np
+from bm25_index import BM25Index, reciprocal_rank_fusion
+
+def rss_kb():
+    # Anonymous (private) and file-backed (shared page cache, i.e. the mmap) resident memory
+    usage = {{}}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                usage[line.split(":")[0]] = int(line.split()[1])
+    return usage
+
+queries = json.load(open({queries!r}))
+before = rss_kb()
+start = time.perf_counter()
+index = BM25Index({path!r})
+open_s = time.perf_counter() - start
+opened = rss_kb()
+
+latencies = []
+fusion = []
+rng = np.random.default_rng(0)
+for query in queries:
+    start = time.perf_counter()
+    ids, _ = index.search([query], {depth})[0]
+    latencies.append(time.perf_counter() - start)
+    dense = rng.integers(0, len(index), {depth}).tolist()  # stand-in for the FAISS ranking
+    start = time.perf_counter()
+    reciprocal_rank_fusion([dense, ids.tolist()])
+    fusion.append(time.perf_counter() - start)
+
+after = rss_kb()
+print(json.dumps({{
+    "open_s": open_s,
+    "rss_open_mb": {{k: (opened[k] - before[k]) / 1024 for k in before}},
+    "rss_after_mb": {{k: (after[k] - before[k]) / 1024 for k in before}},
+    "latencies": latencies,
+    "fusion": fusion,
+}}))
+'''
+
+
+def synthetic_corpus(docs, vocab=60000, mean_terms=220, seed=0):
+    rng = np.random.default_rng(seed)
+    words = np.array([f"t{i:x}" for i in range(vocab)])
+    ranks = np.arange(1, vocab + 1)
+    probs = 1 / ranks ** 1.05
+    probs /= probs.sum()
+    lengths = np.maximum(20, rng.normal(mean_terms, 50, docs).astype(int))
+    tokens = words[rng.choice(vocab, size=int(lengths.sum()), p=probs)]
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        yield " ".join(tokens[start:end])
+
+
+def corpus_texts(args):
+    if args.context_map:
+        from context_store import load_context_map
+        context_map = load_context_map(args.context_map)
+        return [context_map[i]["context"] for i in range(len(context_map))]
+    return list(synthetic_corpus(args.docs))
+
+
+def sample_queries(texts, count, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(texts), count):
+        words = texts[i].split()
+        length = int(rng.integers(6, 14))
+        start = int(rng.integers(0, max(1, len(words) - length)))
+        queries.append(" ".join(words[start:start + length]))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--context-map', help='context map (.pkl or .ctx); synthetic corpus if omitted')
+    parser.add_argument('--docs', type=int, default=211269, help='synthetic corpus size')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--depth', type=int, default=20, help='candidates per query (RAG_FUSION_DEPTH)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    texts = corpus_texts(args)
+    print(f"corpus: {len(texts)} passages, {sum(len(t) for t in texts) / 1e6:.1f} MB of text "
+          f"({time.perf_counter() - start:.1f}s to load)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.bm25')
+        start = time.perf_counter()
+        build_bm25_index(texts, path)
+        build_s = time.perf_counter() - start
+        print(f"build: {build_s:.1f}s, index {os.path.getsize(path) / 1e6:.1f} MB")
+
+        queries_path = os.path.join(tmp, 'queries.json')
+        with open(queries_path, 'w') as f:
+            json.dump(sample_queries(texts, args.queries), f)
+        del texts
+
+        code = CHILD.format(root=ROOT, path=path, queries=queries_path, depth=args.depth)
+        out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+
+    latencies = np.array(r['latencies']) * 1000
+    fusion = np.array(r['fusion']) * 1000
+    print(f"open: {r['open_s'] * 1000:.1f} ms")
+    for label, key in (('after open', 'rss_open_mb'), (f"after {len(latencies)} queries", 'rss_after_mb')):
+        print(f"RSS {label}: +{r[key]['RssAnon']:.1f} MB anonymous, +{r[key]['RssFile']:.1f} MB mmap (page cache)")
+    print(f"{'':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in (('bm25', latencies), ('rrf', fusion)):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{name:<10}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
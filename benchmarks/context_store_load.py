@@ -0,0 +1,68 @@
+#benchmarks/context_store_load.py
+"""Compare startup time and RSS of the pickled context map and the mmap store.
+
+Each variant is loaded in a fresh subprocess so the numbers are not polluted
+by the other one. Usage:
+    python benchmarks/context_store_load.py ai_integration/context_map.pkl ai_integration/context_map.ctx
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r'''
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+from context_store import ContextStore
+import pickle
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+before = rss_kb()
+start = time.perf_counter()
+if {kind!r} == "pickle":
+    with open({path!r}, "rb") as f:
+        store = pickle.load(f)
+else:
+    store = ContextStore({path!r})
+load_s = time.perf_counter() - start
+
+# Touch a handful of rows the way retrieve_context does
+start = time.perf_counter()
+n = len(store)
+for i in range(0, n, max(1, n // 100)):
+    row = store[i]
+    row["context"], row["question"], row["answer"]
+lookup_s = time.perf_counter() - start
+
+print(json.dumps({{"load_s": load_s, "lookup_s": lookup_s, "rss_delta_mb": (rss_kb() - before) / 1024}}))
+'''
+
+
+def measure(kind, path):
+    code = CHILD.format(root=ROOT, kind=kind, path=path)
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    pickle_path, store_path = sys.argv[1], sys.argv[2]
+
+    print(f"{'format':<10}{'load s':>10}{'100 rows ms':>14}{'RSS MB':>10}")
+    for kind, path in (('pickle', pickle_path), ('mmap', store_path)):
+        r = measure(kind, path)
+        print(f"{kind:<10}{r['load_s']:>10.3f}{r['lookup_s'] * 1000:>14.2f}{r['rss_delta_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
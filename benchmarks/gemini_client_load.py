@@ -0,0 +1,104 @@
+#benchmarks/gemini_client_load.py
+"""Offline load test of GeminiClient against the fake backend.
+
+Compares direct backend calls (what process_with_gemini used to do) with the
+bounded client, under a healthy upstream and under an upstream that starts
+failing. Usage:
+    python benchmarks/gemini_client_load.py --clients 32 --requests 400
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gemini_client import CircuitBreaker, FakeBackend, GeminiClient
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def run(call, clients, total):
+    latencies = []
+    outcomes = Counter()
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                call("What are the symptoms of anaemia?")
+                outcome = 'ok'
+            except Exception as e:
+                outcome = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    return {
+        'ok_per_s': outcomes['ok'] / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'outcomes': dict(outcomes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--median-ms', type=float, default=50)
+    parser.add_argument('--timeout', type=float, default=1.0)
+    args = parser.parse_args()
+
+    scenarios = {
+        'healthy': dict(median_ms=args.median_ms, sigma=0.6, failure_rate=0.02),
+        'degraded': dict(median_ms=args.median_ms * 20, sigma=1.0, failure_rate=0.5),
+    }
+
+    print(f"{args.clients} clients, {args.requests} requests, {args.timeout}s deadline")
+    print(f"{'scenario':<10}{'mode':<8}{'ok/s':>8}{'p50 ms':>10}{'p99 ms':>10}  outcomes")
+    for name, params in scenarios.items():
+        direct = FakeBackend(seed=1, **params)
+        client = GeminiClient(
+            FakeBackend(seed=1, **params),
+            max_concurrency=16,
+            max_queued=32,
+            timeout=args.timeout,
+            breaker=CircuitBreaker(failure_threshold=10, reset_timeout=0.5),
+        )
+        modes = {
+            # No deadline of its own: the old code waited as long as the upstream took
+            'direct': lambda prompt: direct.generate(prompt, timeout=float('inf')),
+            'client': client.generate,
+        }
+        for mode, call in modes.items():
+            r = run(call, args.clients, args.requests)
+            print(f"{name:<10}{mode:<8}{r['ok_per_s']:>8.1f}{r['p50_ms']:>10.1f}"
+                  f"{r['p99_ms']:>10.1f}  {r['outcomes']}")
+        client.shutdown()
+
+
+if __name__ == '__main__':
+    main()
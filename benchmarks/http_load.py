@@ -0,0 +1,334 @@
+#benchmarks/http_load.py
+"""End-to-end HTTP load test of the web app with offline stub models.
+
+Starts the app in a scratch directory (its own SQLite database and uploads)
+with ``RAG_BACKEND=fake`` and ``GEMINI_BACKEND=fake`` (see
+``stub_backends.py`` and ``gemini_client.FakeBackend``), so no model files or
+API key are needed. The stub latencies are log-normal with the medians given
+by ``--rag-ms`` (one full-beam answer), ``--embed-ms`` and ``--gemini-ms``.
+
+``--users`` virtual users each sign up, log in, then loop over a weighted mix
+of requests for ``--duration`` seconds (closed loop, optional think time):
+
+    chat_gemini    POST /api/chat, model gemini
+    chat_rag       POST /api/chat, model rag
+    sessions       GET  /api/chat/sessions
+    session_load   GET  /api/chat/session/<id>
+    new_session    POST /api/chat/new
+    upload         POST /api/upload with a generated DOCX (unique content
+                   unless --repeat-uploads, which measures cache hits)
+    login          POST /login again
+
+The report has requests/s, error rate and latency percentiles per endpoint.
+``--output`` saves it as JSON with the configuration, to compare worker
+counts and servers. Usage:
+    python benchmarks/http_load.py --users 32 --duration 60
+    python benchmarks/http_load.py --server gunicorn --workers 4 --threads 8 --users 64
+    python benchmarks/http_load.py --url http://127.0.0.1:5000 --users 16   # an already running app
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from http.cookiejar import CookieJar
+from io import BytesIO
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from run import synthetic_passages, synthetic_questions
+
+MIX = {
+    'chat_gemini': 35,
+    'chat_rag': 25,
+    'sessions': 15,
+    'session_load': 10,
+    'new_session': 5,
+    'upload': 5,
+    'login': 5,
+}
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+# ------------------- Server -------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir, port):
+    env = dict(os.environ)
+    env.update({
+        'RAG_BACKEND': 'fake',
+        'GEMINI_BACKEND': 'fake',
+        'RAG_FAKE_GENERATE_MS': str(args.rag_ms),
+        'RAG_FAKE_EMBED_MS': str(args.embed_ms),
+        'GEMINI_FAKE_MEDIAN_MS': str(args.gemini_ms),
+        'SECRET_KEY': 'load-test',
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')])),
+    })
+    if args.server == 'gunicorn':
+        if shutil.which('gunicorn') is None:
+            sys.exit("gunicorn is not installed (pip install gunicorn)")
+        command = ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+                   '--threads', str(args.threads), '--chdir', workdir, *args.server_args, 'app:app']
+    else:
+        command = [sys.executable, '-c',
+                   f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(base_url, server, timeout, workers):
+    """Poll the status endpoint until every worker reports the RAG system ready and warmed up."""
+    deadline = time.monotonic() + timeout
+    ready_in_a_row = 0
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            sys.exit("server exited during start-up, see server.log")
+        try:
+            with urllib.request.urlopen(f"{base_url}/api/check-system-status", timeout=5) as response:
+                status = json.load(response)['rag_status']
+            warmed = status['warmup']['status'] in ('done', 'disabled', 'failed')
+            ready_in_a_row = ready_in_a_row + 1 if status['state'] == 'ready' and warmed else 0
+            # Requests land on arbitrary workers; several ready answers in a row cover all of them
+            if ready_in_a_row >= 2 * workers:
+                return
+        except (OSError, ValueError, KeyError):
+            ready_in_a_row = 0
+        time.sleep(0.5)
+    sys.exit(f"app not ready after {timeout}s")
+
+
+# ------------------- Virtual users -------------------
+
+def docx_document(seed, paragraphs=20):
+    """A DOCX with its own text per seed, so each upload misses the extraction cache."""
+    from docx import Document
+
+    doc = Document()
+    for text in synthetic_passages(paragraphs, seed):
+        doc.add_paragraph(text)
+    out = BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # report the 302 itself; following it would time a page render
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, mimetype) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {mimetype}\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # endpoint -> [(seconds, status)]
+        self._lock = threading.Lock()
+
+    def add(self, label, seconds, status):
+        with self._lock:
+            self.samples.setdefault(label, []).append((seconds, status))
+
+
+class VirtualUser:
+    def __init__(self, base_url, number, args, recorder, questions):
+        self.base_url = base_url
+        self.email = f"load-{number}-{uuid.uuid4().hex[:6]}@example.com"
+        self.password = 'load-test-password'
+        self.args = args
+        self.recorder = recorder
+        self.questions = questions
+        self.random = random.Random(number)
+        self.session_ids = []
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect)
+
+    def request(self, label, method, path, json_body=None, form=None, files=None):
+        headers = {}
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif files is not None:
+            data, headers['Content-Type'] = multipart(form or {}, files)
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        start = time.perf_counter()
+        body = None
+        try:
+            with self.opener.open(req, timeout=self.args.timeout) as response:
+                status = response.status
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            status = e.code
+            e.read()
+        except OSError:
+            status = 0  # connection refused / reset / timed out
+        self.recorder.add(label, time.perf_counter() - start, status)
+        return status, body
+
+    def login(self):
+        self.request('login', 'POST', '/login', form={'email': self.email, 'password': self.password})
+
+    def question(self):
+        # Popular questions repeat, as in production traffic
+        return self.questions[min(int(self.random.paretovariate(1.2)) - 1, len(self.questions) - 1)]
+
+    def step(self, action):
+        if action in ('chat_gemini', 'chat_rag'):
+            model = 'gemini' if action == 'chat_gemini' else 'rag'
+            self.request(action, 'POST', '/api/chat', json_body={'message': self.question(), 'model': model})
+        elif action == 'sessions':
+            status, body = self.request(action, 'GET', '/api/chat/sessions')
+            if status == 200:
+                self.session_ids = [s['id'] for s in json.loads(body)['sessions']]
+        elif action == 'session_load':
+            if not self.session_ids:
+                return self.step('sessions')
+            self.request(action, 'GET', f"/api/chat/session/{self.random.choice(self.session_ids)}")
+        elif action == 'new_session':
+            self.request(action, 'POST', '/api/chat/new', json_body={})
+        elif action == 'upload':
+            content = docx_document(0 if self.args.repeat_uploads else self.random.getrandbits(32))
+            self.request(action, 'POST', '/api/upload', files={'file': ('notes.docx', content, DOCX_MIME)})
+        elif action == 'login':
+            self.login()
+
+    def run(self, deadline):
+        self.request('signup', 'POST', '/signup', form={'email': self.email, 'password': self.password})
+        self.login()
+        actions, weights = zip(*MIX.items())
+        while time.monotonic() < deadline:
+            self.step(self.random.choices(actions, weights)[0])
+            if self.args.think_ms > 0:
+                time.sleep(self.random.expovariate(1000.0 / self.args.think_ms))
+
+
+# ------------------- Report -------------------
+
+def report(recorder, elapsed):
+    rows = {}
+    everything = []
+    for label in sorted(recorder.samples):
+        samples = recorder.samples[label]
+        everything += samples
+        rows[label] = summarize(samples, elapsed)
+    rows['total'] = summarize(everything, elapsed)
+    print(f"\n{'endpoint':<14}{'requests':>9}{'req/s':>9}{'errors':>9}{'p50 ms':>10}{'p90 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}  error statuses")
+    for label, row in rows.items():
+        print(f"{label:<14}{row['requests']:>9}{row['rps']:>9.1f}{row['error_rate']:>9.1%}{row['p50_ms']:>10.0f}"
+              f"{row['p90_ms']:>10.0f}{row['p99_ms']:>10.0f}{row['max_ms']:>10.0f}  "
+              + ', '.join(f"{status}: {count}" for status, count in row['error_statuses'].items()))
+    return rows
+
+
+def summarize(samples, elapsed):
+    latencies = np.array([seconds for seconds, _ in samples]) * 1000
+    errors = {}
+    for _, status in samples:
+        if status == 0 or status >= 400:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        'requests': len(samples),
+        'rps': len(samples) / elapsed,
+        'error_rate': sum(errors.values()) / len(samples),
+        'error_statuses': errors,
+        'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': latencies.max(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='load an already running app instead of starting one')
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help='extra gunicorn arguments (must come last)')
+    parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load after start-up')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='mean pause between a user\'s requests')
+    parser.add_argument('--rag-ms', type=float, default=1500.0, help='median stub full-beam answer latency')
+    parser.add_argument('--embed-ms', type=float, default=10.0, help='median stub embedding latency')
+    parser.add_argument('--gemini-ms', type=float, default=800.0, help='median fake Gemini latency')
+    parser.add_argument('--repeat-uploads', action='store_true', help='upload the same file every time')
+    parser.add_argument('--timeout', type=float, default=60.0, help='client timeout per request')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='write the report JSON here')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='medqa_http_load_')
+    server = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = start_server(args, workdir, port)
+        workers = args.workers if args.server == 'gunicorn' else 1
+        wait_until_ready(base_url, server, args.startup_timeout, workers)
+
+        questions = synthetic_questions(500)
+        recorder = Recorder()
+        print(f"{args.users} users for {args.duration:.0f}s against {base_url} "
+              f"({args.server if not args.url else 'external'}"
+              f"{f', {args.workers} workers x {args.threads} threads' if args.server == 'gunicorn' else ''})",
+              flush=True)
+        start = time.monotonic()
+        deadline = start + args.duration
+        users = [VirtualUser(base_url, i, args, recorder, questions) for i in range(args.users)]
+        threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        rows = report(recorder, time.monotonic() - start)
+
+        if args.output:
+            config = {key: value for key, value in vars(args).items() if key != 'output'}
+            with open(args.output, 'w') as f:
+                json.dump({'config': config, 'results': rows}, f, indent=2)
+            print(f"Report written to {args.output}")
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#benchmarks/prefork_memory.py
+"""Memory of N serving workers: independent model loads vs pre-fork sharing.
+
+Each mode starts ``--workers`` processes that load or inherit the RAG system
+(synthetic T5, MiniLM-shaped embedder, flat FAISS index, context and token
+stores, built once in ``--workdir``), answer ``--queries`` questions through
+``RAGSystem.answer`` and then run a full garbage collection, as a
+long-running worker eventually does:
+
+    independent        every worker imports and loads everything itself
+                       (gunicorn without preload_app)
+    independent-mmap   the same with the FAISS index memory-mapped
+                       (RAG_INDEX_MMAP=1)
+    prefork            the master loads once with GC disabled, gc.freeze()s
+                       and forks; workers only call start_serving
+                       (gunicorn.conf.py)
+    prefork-nofreeze   the same without gc.freeze, showing what collections
+                       in the workers un-share
+
+While every worker is still alive the master reads each one's
+/proc/<pid>/smaps_rollup:
+
+    RSS   resident pages, shared ones counted in full in every process
+    PSS   shared pages divided among the processes mapping them; the sum
+          over all processes is the real footprint
+    USS   pages private to the worker (Private_Clean + Private_Dirty), what
+          stopping it would free
+
+Linux only. Usage:
+    python benchmarks/prefork_memory.py --workers 4 --corpus-size 100000
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+MODES = ('independent', 'independent-mmap', 'prefork', 'prefork-nofreeze')
+FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def memory(pid):
+    """RSS, PSS and USS of ``pid`` in MiB."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return {'rss': values['Rss'], 'pss': values['Pss'],
+            'uss': values['Private_Clean'] + values['Private_Dirty']}
+
+
+# ------------------- Fixtures -------------------
+
+def build_fixtures(workdir, model_size, corpus_size):
+    """Write the generator, embedder, index and stores once; return their paths."""
+    import faiss
+    from run import Fixtures
+
+    paths = {
+        'model': os.path.join(workdir, f't5-{model_size}'),
+        'embedder': os.path.join(workdir, 'minilm-st'),
+        'index': os.path.join(workdir, f'corpus_{corpus_size}.index'),
+        'context_map': os.path.join(workdir, f'corpus_{corpus_size}.ctx'),
+    }
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+    fx = Fixtures(workdir, model_size)
+    index, _, _ = fx.corpus(corpus_size, 'flat')
+    faiss.write_index(index, paths['index'])
+    fx.embedder().save(paths['embedder'])
+    return paths
+
+
+# ------------------- Workers -------------------
+
+def serve(rag, questions, prefork):
+    """Worker body: start serving, answer the questions, then collect garbage."""
+    import torch
+    torch.set_num_threads(1)
+    start = time.perf_counter()
+    if prefork:
+        ok = rag.start_serving(warm_up=False)
+    else:
+        ok = rag.load(warm_up=False)
+    if not ok:
+        raise RuntimeError(rag.error)
+    ready = time.perf_counter() - start
+    for question in questions:
+        rag.answer(question)
+    gc.collect()
+    return ready
+
+
+def run_mode(args, paths):
+    """Fork the workers of one mode, measure them and print one JSON line."""
+    from run import synthetic_questions
+
+    prefork = args.run_mode.startswith('prefork')
+    rag = None
+    if prefork:
+        # What gunicorn.conf.py does in the master
+        gc.disable()
+        from rag_system import RAGSystem
+        rag = RAGSystem(paths['model'], paths['index'], paths['context_map'], top_k=3)
+        if not rag.load(serve=False):
+            raise RuntimeError(rag.error)
+        if args.run_mode == 'prefork':
+            gc.freeze()
+
+    questions = synthetic_questions(args.queries * args.workers, seed=7)
+    workers = []
+    for n in range(args.workers):
+        ready_r, ready_w = os.pipe()
+        go_r, go_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            os.close(go_w)
+            status = 1
+            try:
+                if prefork:
+                    gc.enable()
+                else:
+                    from rag_system import RAGSystem
+                    rag = RAGSystem(paths['model'], paths['index'], paths['context_map'], top_k=3)
+                ready = serve(rag, questions[n::args.workers], prefork)
+                os.write(ready_w, json.dumps({'ready_s': ready}).encode() + b'\n')
+                os.read(go_r, 1)  # stay alive until the master has measured everyone
+                status = 0
+            except Exception as e:
+                print(f"Worker {n} failed: {e}", file=sys.stderr)
+                os.write(ready_w, json.dumps({'error': str(e)}).encode() + b'\n')
+            finally:
+                os._exit(status)
+        os.close(ready_w)
+        os.close(go_r)
+        workers.append((pid, ready_r, go_w))
+
+    reports = []
+    for pid, ready_r, _ in workers:
+        with os.fdopen(ready_r) as f:
+            reports.append(json.loads(f.readline() or '{"error": "no report"}'))
+    measured = [dict(memory(pid), **report) for (pid, _, _), report in zip(workers, reports)]
+    master = memory(os.getpid())
+    for pid, _, go_w in workers:
+        # Later workers inherited this pipe as well, so closing it alone would not wake the worker
+        os.write(go_w, b'1')
+        os.close(go_w)
+        os.waitpid(pid, 0)
+    print(json.dumps({'mode': args.run_mode, 'workers': measured, 'master': master}))
+
+
+# ------------------- Report -------------------
+
+def report(results):
+    print(f"\n{'mode':<18}{'USS/worker':>12}{'PSS/worker':>12}{'RSS/worker':>12}"
+          f"{'master PSS':>12}{'total PSS':>11}{'ready s':>9}")
+    totals = {}
+    for result in results:
+        workers = result['workers']
+        errors = [w['error'] for w in workers if 'error' in w]
+        if errors:
+            print(f"{result['mode']:<18}failed: {errors[0]}")
+            continue
+        mean = lambda key: sum(w[key] for w in workers) / len(workers)
+        total = sum(w['pss'] for w in workers) + result['master']['pss']
+        totals[result['mode']] = total
+        print(f"{result['mode']:<18}{mean('uss'):>12.0f}{mean('pss'):>12.0f}{mean('rss'):>12.0f}"
+              f"{result['master']['pss']:>12.0f}{total:>11.0f}{mean('ready_s'):>9.2f}")
+    print("(MiB; total PSS is the workers plus the master)")
+    if 'independent' in totals:
+        for mode, total in totals.items():
+            if mode != 'independent':
+                print(f"  {mode}: {totals['independent'] - total:.0f} MiB "
+                      f"({1 - total / totals['independent']:.0%}) less than independent")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=8, help='questions answered per worker')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--model-size', choices=['tiny', 'small'], default='small')
+    parser.add_argument('--corpus-size', type=int, default=100000)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'medqa_prefork'))
+    parser.add_argument('--run-mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    paths = build_fixtures(args.workdir, args.model_size, args.corpus_size)
+    if args.run_mode:
+        run_mode(args, paths)
+        return
+
+    results = []
+    for mode in args.modes:
+        print(f"Running {mode} with {args.workers} workers...", flush=True)
+        env = dict(os.environ, RAG_EMBEDDING_MODEL=paths['embedder'],
+                   RAG_INDEX_MMAP='0' if mode == 'independent' else '1',
+                   RAG_QUERY_CACHE_DB='', RAG_WARMUP_QUERIES='0')
+        command = [sys.executable, os.path.abspath(__file__), '--run-mode', mode,
+                   '--workers', str(args.workers), '--queries', str(args.queries),
+                   '--model-size', args.model_size, '--corpus-size', str(args.corpus_size),
+                   '--workdir', args.workdir]
+        output = subprocess.run(command, env=env, capture_output=True, text=True)
+        lines = [line for line in output.stdout.splitlines() if line.startswith('{')]
+        if output.returncode or not lines:
+            print(output.stderr[-2000:])
+            continue
+        results.append(json.loads(lines[-1]))
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
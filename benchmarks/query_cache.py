@@ -0,0 +1,118 @@
+#benchmarks/query_cache.py
+"""Retrieval latency and hit rate of the query cache on a Zipf-distributed question stream.
+
+A pool of distinct questions is drawn with Zipf-distributed popularity (a few
+hundred questions make up most of the traffic), some repeats differing only in
+case, spacing or a trailing question mark. The stream is replayed through
+``retrieve_context`` (hybrid dense + BM25 over a synthetic corpus, random
+MiniLM-shaped embedder; see ``benchmarks/run.py``) with:
+
+    none            no cache: every question is embedded and searched
+    memory/<size>   in-process LRU of <size> entries
+    restart         a fresh process-level cache over the SQLite tier filled by
+                    a previous run, i.e. a worker after a restart
+
+Usage:
+    python benchmarks/query_cache.py [--corpus 100000] [--distinct 2000] [--requests 5000] [--zipf 1.1]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from run import Fixtures, synthetic_passages, synthetic_questions
+
+
+def question_stream(distinct, requests, exponent, seed=2):
+    rng = np.random.default_rng(seed)
+    pool = list(dict.fromkeys(synthetic_questions(distinct * 4, seed)))
+    pool += [f"{q[:-1]} after {years} years?" for years in range(2, 30) for q in pool[:distinct]]
+    pool = list(dict.fromkeys(pool))[:distinct]
+    ranks = np.arange(1, len(pool) + 1)
+    probs = 1 / ranks ** exponent
+    probs /= probs.sum()
+    stream = []
+    for i in rng.choice(len(pool), size=requests, p=probs):
+        question = pool[i]
+        variant = rng.random()
+        if variant < 0.1:
+            question = question.lower()
+        elif variant < 0.2:
+            question = "  " + question.rstrip('?') + " "
+        stream.append(question)
+    return stream, len(pool)
+
+
+def replay(stream, retrieve):
+    latencies = np.empty(len(stream))
+    start = time.perf_counter()
+    for i, question in enumerate(stream):
+        t = time.perf_counter()
+        retrieve(question)
+        latencies[i] = time.perf_counter() - t
+    return latencies * 1000, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', type=int, default=100000, help='synthetic passages')
+    parser.add_argument('--distinct', type=int, default=2000, help='distinct questions in the pool')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of question popularity')
+    parser.add_argument('--cache-sizes', type=int, nargs='+', default=[256, 4096])
+    parser.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    from bm25_index import BM25Index, build_bm25_index
+    from query_cache import QueryCache
+    from rag_qa import retrieve_context
+
+    workdir = tempfile.mkdtemp(prefix='medqa_query_cache_')
+    try:
+        fx = Fixtures(workdir, 'tiny')
+        embedder = fx.embedder()
+        index, context_map, _ = fx.corpus(args.corpus)
+        bm25_path = os.path.join(workdir, 'corpus.bm25')
+        build_bm25_index(synthetic_passages(args.corpus, fx.seed), bm25_path)
+        lexical_index = BM25Index(bm25_path)
+
+        stream, distinct = question_stream(args.distinct, args.requests, args.zipf)
+        print(f"corpus {args.corpus} passages, {args.requests} requests over {distinct} distinct questions "
+              f"(zipf {args.zipf}), {len(set(stream))} distinct strings in the stream")
+        print(f"{'':<16}{'hit ratio':>10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'req/s':>10}")
+
+        def run(label, cache):
+            latencies, total = replay(stream, lambda q: retrieve_context(
+                q, embedder, index, context_map, args.top_k, lexical_index=lexical_index, query_cache=cache))
+            ratio = cache.stats()['hit_ratio'] if cache is not None else 0.0
+            p50, p95 = np.percentile(latencies, [50, 95])
+            print(f"{label:<16}{ratio:>10.1%}{p50:>10.2f}{p95:>10.2f}{latencies.mean():>10.2f}"
+                  f"{len(stream) / total:>10.0f}", flush=True)
+
+        run('none', None)
+        for size in args.cache_sizes:
+            run(f'memory/{size}', QueryCache('bench', max_entries=size, db_path=None))
+
+        db_path = os.path.join(workdir, 'query_cache.db')
+        size = max(args.cache_sizes)
+        warm = QueryCache('bench', max_entries=size, db_path=db_path)
+        replay(stream, lambda q: retrieve_context(
+            q, embedder, index, context_map, args.top_k, lexical_index=lexical_index, query_cache=warm))
+        warm.close()
+        restarted = QueryCache('bench', max_entries=size, db_path=db_path)
+        run('restart', restarted)
+        stats = restarted.stats()
+        print(f"restart served {stats['db_hits']} lookups from SQLite and {stats['hits']} from memory")
+        restarted.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#benchmarks/rag_batching.py
+"""Compare one-at-a-time RAG calls with the micro-batching scheduler.
+
+Usage:
+    python benchmarks/rag_batching.py --clients 16 --requests 128
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rag_qa import load_rag_system, rag_pipeline, rag_pipeline_batch
+from rag_batcher import RAGBatcher
+
+QUESTIONS = [
+    "What is the treatment for hypertension in elderly patients?",
+    "Does metformin reduce cardiovascular risk in type 2 diabetes?",
+    "Is vitamin D supplementation associated with fewer fractures?",
+    "What are the risk factors for postoperative delirium?",
+    "Does early mobilization improve outcomes after hip surgery?",
+    "Is obesity associated with asthma severity in children?",
+    "Do statins lower the risk of dementia?",
+    "What predicts readmission after heart failure hospitalization?",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def run_load(call, clients, total_requests):
+    """Drive ``call(question)`` from ``clients`` threads and collect latencies."""
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            call(QUESTIONS[i % len(QUESTIONS)])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    return {
+        'throughput_rps': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-path', default='ai_integration/t5-small-pubmedqa')
+    parser.add_argument('--index-path', default='ai_integration/pubmedqa_faiss.index')
+    parser.add_argument('--context-map-path', default='ai_integration/context_map.pkl')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=128)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    model, tokenizer, embedding_model, index, context_map = load_rag_system(
+        args.model_path, args.index_path, args.context_map_path
+    )
+
+    def single(question):
+        return rag_pipeline(question, model, tokenizer, embedding_model, index, context_map)
+
+    batcher = RAGBatcher(
+        lambda questions: rag_pipeline_batch(
+            questions, model, tokenizer, embedding_model, index, context_map
+        ),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    ).start()
+
+    # Warm up both paths so lazy initialisation does not skew the first run
+    single(QUESTIONS[0])
+    batcher.submit(QUESTIONS[0])
+
+    results = {
+        'one_at_a_time': run_load(single, args.clients, args.requests),
+        'batched': run_load(batcher.submit, args.clients, args.requests),
+    }
+    batcher.stop()
+
+    print(f"{'mode':<15}{'req/s':>10}{'p50 ms':>12}{'p99 ms':>12}{'mean ms':>12}")
+    for mode, r in results.items():
+        print(f"{mode:<15}{r['throughput_rps']:>10.2f}{r['p50_ms']:>12.1f}"
+              f"{r['p99_ms']:>12.1f}{r['mean_ms']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+#benchmarks/run.py
+"""Offline benchmark suite for the RAG and persistence hot paths.
+
+Everything is synthetic so the suite runs on a CPU without downloads:
+
+    corpus      generated medical-sounding passages
+    index       FAISS index over random unit vectors (one per passage)
+    store       mmap context store and token store built from the corpus
+    embedder    randomly initialised BERT with the all-MiniLM-L6-v2 shape
+    generator   randomly initialised T5 with a SentencePiece tokenizer trained
+                on the corpus (``--model-size small`` uses the t5-small shape)
+
+Timed groups:
+
+    retrieval     retrieve_context / retrieve_context_batch per index type
+    generation    prompt assembly (text vs pre-tokenized passages), and
+                  generate_answer / generate_answer_batch per decoding profile
+    pipeline      rag_pipeline / rag_pipeline_batch
+    chat_context  ChatContext against a pooled SQLite database
+    extraction    file_handler on generated PDF, DOCX and PPTX files (and OCR
+                  when tesseract is installed)
+
+An untrained generator seldom emits EOS, so generation timings are close to
+the worst case of each profile (``max_new_tokens`` steps).
+
+Results are written as JSON. With ``--baseline`` the p50 of every case is
+compared against a saved run and the exit status is 1 on a regression.
+Usage:
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+    python benchmarks/run.py --quick --only retrieval chat_context --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+GROUPS = ('retrieval', 'generation', 'pipeline', 'chat_context', 'extraction')
+
+MODEL_SHAPES = {
+    'tiny': {'d_model': 128, 'd_ff': 512, 'num_layers': 2, 'num_heads': 4},
+    'small': {'d_model': 512, 'd_ff': 2048, 'num_layers': 6, 'num_heads': 8},
+}
+EMBEDDING_DIM = 384
+
+TOPICS = ["hypertension", "metformin", "statin", "asthma", "delirium", "osteoporosis", "sepsis",
+          "vitamin d", "aspirin", "obesity", "dementia", "stroke", "heart failure", "insulin",
+          "chemotherapy", "influenza", "depression", "anemia", "hip fracture", "smoking"]
+POPULATIONS = ["elderly patients", "children", "pregnant women", "adults with diabetes",
+               "postoperative patients", "nursing home residents", "outpatients", "smokers"]
+OUTCOMES = ["mortality", "readmission", "cardiovascular events", "fracture risk", "length of stay",
+            "quality of life", "cognitive decline", "blood pressure", "glycemic control"]
+SENTENCES = [
+    "Background: {topic} is associated with {outcome} in {population}.",
+    "Methods: We conducted a randomized controlled trial of {n} {population} over {years} years.",
+    "A retrospective cohort of {n} {population} was analysed for {outcome}.",
+    "Results: {topic} reduced {outcome} compared with placebo (p < 0.0{p}).",
+    "No significant difference in {outcome} was observed after adjustment for age and sex.",
+    "Conclusions: {topic} may improve {outcome} in {population}, but larger trials are needed.",
+]
+
+
+# ------------------- Timing -------------------
+
+def measure(fn, repeat, warmup=1):
+    """Run ``fn`` ``warmup + repeat`` times and summarise the timed runs in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 4),
+        'mean_ms': round(statistics.fmean(samples), 4),
+        'min_ms': round(samples[0], 4),
+        'runs': len(samples),
+    }
+
+
+def record(results, name, stats):
+    results[name] = stats
+    print(f"  {name:<58}{stats['p50_ms']:>12.3f} ms p50{stats['p95_ms']:>12.3f} ms p95", flush=True)
+
+
+# ------------------- Fixtures -------------------
+
+def synthetic_passages(count, seed=0):
+    rng = np.random.default_rng(seed)
+    passages = []
+    for _ in range(count):
+        sentences = []
+        for template in rng.choice(SENTENCES, size=int(rng.integers(5, 9))):
+            sentences.append(template.format(
+                topic=rng.choice(TOPICS), outcome=rng.choice(OUTCOMES), population=rng.choice(POPULATIONS),
+                n=int(rng.integers(40, 5000)), years=int(rng.integers(1, 10)), p=int(rng.integers(1, 5))
+            ))
+        passages.append(" ".join(sentences))
+    return passages
+
+
+def synthetic_questions(count, seed=1):
+    rng = np.random.default_rng(seed)
+    return [f"Does {rng.choice(TOPICS)} affect {rng.choice(OUTCOMES)} in {rng.choice(POPULATIONS)}?"
+            for _ in range(count)]
+
+
+class Fixtures:
+    """Synthetic models, corpora, indexes and stores, built lazily in ``workdir``."""
+
+    def __init__(self, workdir, model_size, seed=0):
+        self.workdir = workdir
+        self.model_size = model_size
+        self.seed = seed
+        self._corpora = {}
+        self._generator = None
+        self._embedder = None
+
+    def generator(self):
+        """Random T5 saved to disk and loaded through ``rag_qa.load_generator``."""
+        if self._generator is None:
+            import sentencepiece as spm
+            import torch
+            from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer
+            from rag_qa import load_generator
+
+            path = os.path.join(self.workdir, f't5-{self.model_size}')
+            os.makedirs(path, exist_ok=True)
+            corpus_path = os.path.join(self.workdir, 'spm_corpus.txt')
+            with open(corpus_path, 'w') as f:
+                f.write("\n".join(synthetic_passages(2000, self.seed) + synthetic_questions(500)))
+            spm.SentencePieceTrainer.train(
+                input=corpus_path, model_prefix=os.path.join(path, 'spiece'), vocab_size=1000,
+                pad_id=0, eos_id=1, unk_id=2, bos_id=-1, minloglevel=2
+            )
+            spiece = os.path.join(path, 'spiece.model')
+            try:
+                tokenizer = T5Tokenizer(spiece, extra_ids=0)
+            except TypeError:
+                # transformers 5 builds the tokenizer from the vocabulary instead of the model file
+                sp = spm.SentencePieceProcessor(model_file=spiece)
+                tokenizer = T5Tokenizer(
+                    vocab=[(sp.id_to_piece(i), sp.get_score(i)) for i in range(sp.get_piece_size())],
+                    extra_ids=0)
+            torch.manual_seed(self.seed)
+            config = T5Config(vocab_size=len(tokenizer), decoder_start_token_id=tokenizer.pad_token_id,
+                              **MODEL_SHAPES[self.model_size])
+            T5ForConditionalGeneration(config).save_pretrained(path)
+            tokenizer.save_pretrained(path)
+            self._generator = load_generator(path, backend='torch')
+        return self._generator
+
+    def embedder(self):
+        """Random BERT encoder with the all-MiniLM-L6-v2 shape (6 layers, 384 dims)."""
+        if self._embedder is None:
+            import torch
+            from collections import Counter
+            from sentence_transformers import SentenceTransformer, models
+            from transformers import BertConfig, BertModel, BertTokenizer
+
+            path = os.path.join(self.workdir, 'minilm')
+            os.makedirs(path, exist_ok=True)
+            words = Counter(" ".join(synthetic_passages(2000, self.seed)).lower().split())
+            vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + [w for w, _ in words.most_common(5000)]
+            with open(os.path.join(path, 'vocab.txt'), 'w') as f:
+                f.write("\n".join(vocab))
+            torch.manual_seed(self.seed)
+            config = BertConfig(vocab_size=len(vocab), hidden_size=EMBEDDING_DIM, num_hidden_layers=6,
+                                num_attention_heads=12, intermediate_size=1536)
+            BertModel(config).save_pretrained(path)
+            BertTokenizer(os.path.join(path, 'vocab.txt')).save_pretrained(path)
+            transformer = models.Transformer(path, max_seq_length=256)
+            self._embedder = SentenceTransformer(
+                modules=[transformer, models.Pooling(EMBEDDING_DIM, 'mean')], device='cpu')
+        return self._embedder
+
+    def corpus(self, size, index_type='flat'):
+        """``(index, context_store, token_store)`` over ``size`` synthetic passages."""
+        key = (size, index_type)
+        if key not in self._corpora:
+            from ann_index import build_index, configure_search
+            from context_store import ContextStore, write_context_store
+            from token_store import TokenStore, write_token_store
+
+            passages = synthetic_passages(size, self.seed)
+            questions = synthetic_questions(size, self.seed)
+            ctx_path = os.path.join(self.workdir, f'corpus_{size}.ctx')
+            tok_path = os.path.join(self.workdir, f'corpus_{size}.tok')
+            if not os.path.exists(ctx_path):
+                write_context_store(
+                    ({'context': p, 'question': q, 'answer': 'yes'} for p, q in zip(passages, questions)),
+                    ctx_path)
+            if not os.path.exists(tok_path):
+                write_token_store(passages, self.generator()[1], tok_path)
+
+            vectors = np.random.default_rng(self.seed).standard_normal((size, EMBEDDING_DIM)).astype('float32')
+            index = build_index(vectors, index_type)
+            configure_search(index)
+            self._corpora[key] = (index, ContextStore(ctx_path), TokenStore(tok_path))
+        return self._corpora[key]
+
+
+# ------------------- Groups -------------------
+
+def bench_retrieval(fx, args, results):
+    from rag_qa import retrieve_context, retrieve_context_batch
+
+    embedder = fx.embedder()
+    questions = synthetic_questions(max(args.batch_sizes))
+    for size in args.corpus_sizes:
+        for index_type in args.index_types:
+            index, context_map, _ = fx.corpus(size, index_type)
+            for batch in args.batch_sizes:
+                if batch == 1:
+                    fn = lambda: retrieve_context(questions[0], embedder, index, context_map, args.top_k)
+                else:
+                    fn = lambda: retrieve_context_batch(questions[:batch], embedder, index, context_map,
+                                                        args.top_k)
+                record(results, f"retrieval/{index_type}/corpus={size}/batch={batch}",
+                       measure(fn, args.repeat))
+
+
+def bench_generation(fx, args, results):
+    from rag_qa import encode_inputs, generate_answer, generate_answer_batch, generator_passages
+
+    model, tokenizer = fx.generator()
+    _, context_map, token_store = fx.corpus(min(args.corpus_sizes))
+    questions = synthetic_questions(max(args.batch_sizes))
+    retrieved = [[{'context': context_map[i]['context'], 'context_id': i} for i in range(j, j + args.top_k)]
+                 for j in range(len(questions))]
+
+    # Prompt assembly alone: tokenizing passage text vs slicing pre-tokenized passages
+    for source, store in (('text', None), ('tokens', token_store)):
+        for batch in args.batch_sizes:
+            fn = lambda: encode_inputs(questions[:batch],
+                                       [generator_passages(info, store) for info in retrieved[:batch]],
+                                       tokenizer)
+            record(results, f"prompt/passages={source}/batch={batch}", measure(fn, args.repeat))
+
+    passages = [generator_passages(info, token_store) for info in retrieved]
+    for profile in args.profiles:
+        for batch in args.batch_sizes:
+            if batch == 1:
+                fn = lambda: generate_answer(questions[0], passages[0], model, tokenizer, profile)
+            else:
+                fn = lambda: generate_answer_batch(questions[:batch], passages[:batch],
+                                                   model, tokenizer, profile)
+            record(results, f"generation/{profile}/batch={batch}", measure(fn, args.generation_repeat))
+
+
+def bench_pipeline(fx, args, results):
+    from rag_qa import rag_pipeline, rag_pipeline_batch
+
+    model, tokenizer = fx.generator()
+    embedder = fx.embedder()
+    size = max(args.corpus_sizes)
+    index, context_map, token_store = fx.corpus(size)
+    questions = synthetic_questions(max(args.batch_sizes))
+    profile = args.profiles[0]
+    for batch in args.batch_sizes:
+        if batch == 1:
+            fn = lambda: rag_pipeline(questions[0], model, tokenizer, embedder, index, context_map,
+                                      args.top_k, profile, token_store)
+        else:
+            fn = lambda: rag_pipeline_batch(questions[:batch], model, tokenizer, embedder, index,
+                                            context_map, args.top_k, profile, token_store)
+        record(results, f"pipeline/{profile}/corpus={size}/batch={batch}",
+               measure(fn, args.generation_repeat))
+
+
+def bench_chat_context(fx, args, results):
+    import models.db as db
+    from models.context import ChatContext
+
+    cwd = os.getcwd()
+    dbdir = os.path.join(fx.workdir, 'chat')
+    os.makedirs(dbdir, exist_ok=True)
+    try:
+        # init_db creates ./instance relative to the working directory
+        os.chdir(dbdir)
+        db.DB_PATH = os.path.join(dbdir, 'bench.db')
+        ChatContext.init_db()
+
+        user_ids = iter(range(10 ** 6, 10 ** 7))
+        record(results, "chat_context/create_session",
+               measure(lambda: ChatContext.create_session(next(user_ids)), args.repeat * 10))
+
+        for history in args.history_sizes:
+            user_id = history
+            session_ids = []
+            for n in range(args.sessions_per_user):
+                session_id = f"bench_{history}_{n}"
+                with db.connection() as conn:
+                    conn.execute("INSERT INTO chat_sessions (id, user_id) VALUES (?, ?)", (session_id, user_id))
+                    conn.executemany(
+                        "INSERT INTO chat_messages (session_id, role, content) VALUES (?, ?, ?)",
+                        [(session_id, 'user' if i % 2 == 0 else 'assistant', f"message {i} " + "x" * 300)
+                         for i in range(history)])
+                    conn.commit()
+                session_ids.append(session_id)
+            session_id = session_ids[0]
+
+            cases = {
+                'add_message': lambda: ChatContext.add_message(session_id, 'user', "question " + "x" * 300),
+                'get_session_messages/limit=5': lambda: ChatContext.get_session_messages(session_id, limit=5),
+                'get_session_messages/all': lambda: ChatContext.get_session_messages(session_id),
+                'get_session_messages_page': lambda: ChatContext.get_session_messages_page(session_id),
+                'get_user_sessions': lambda: ChatContext.get_user_sessions(user_id, limit=20),
+            }
+            for name, fn in cases.items():
+                record(results, f"chat_context/{name}/history={history}", measure(fn, args.repeat * 10))
+    finally:
+        db.close_all()
+        os.chdir(cwd)
+
+
+def make_pdf(pages):
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for page_number, text in enumerate(synthetic_passages(pages * 4)[::4]):
+        doc.new_page().insert_textbox(fitz.Rect(36, 36, 559, 806), text * 3, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_docx(paragraphs):
+    from docx import Document
+
+    doc = Document()
+    for text in synthetic_passages(paragraphs):
+        doc.add_paragraph(text)
+    out = BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def make_pptx(slides):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    for text in synthetic_passages(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = text[:40]
+        slide.shapes.add_textbox(Inches(1), Inches(1.5), Inches(8), Inches(5)).text_frame.text = text
+    out = BytesIO()
+    prs.save(out)
+    return out.getvalue()
+
+
+def make_png(lines):
+    from PIL import Image, ImageDraw
+
+    image = Image.new('L', (1600, 40 * lines + 40), 255)
+    draw = ImageDraw.Draw(image)
+    for i, text in enumerate(synthetic_questions(lines)):
+        draw.text((20, 20 + 40 * i), text, fill=0)
+    out = BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+def bench_extraction(fx, args, results):
+    from models.file_handler import iter_text_from_file
+
+    def extract(data):
+        return lambda: sum(len(piece) for piece in iter_text_from_file(BytesIO(data)))
+
+    for size in args.document_sizes:
+        for kind, make in (('pdf', make_pdf), ('docx', make_docx), ('pptx', make_pptx)):
+            record(results, f"extraction/{kind}/units={size}", measure(extract(make(size)), args.repeat))
+
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception:
+        print("  extraction/ocr skipped: tesseract is not installed")
+        return
+    record(results, "extraction/ocr/lines=20", measure(extract(make_png(20)), max(3, args.repeat // 3)))
+
+
+BENCHMARKS = {
+    'retrieval': bench_retrieval,
+    'generation': bench_generation,
+    'pipeline': bench_pipeline,
+    'chat_context': bench_chat_context,
+    'extraction': bench_extraction,
+}
+
+
+# ------------------- Reporting -------------------
+
+def environment(args):
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    for name in ('torch', 'transformers', 'faiss'):
+        try:
+            info[name] = __import__(name).__version__
+        except Exception:
+            pass
+    info['config'] = {key: value for key, value in vars(args).items()
+                      if key not in ('output', 'baseline', 'save_baseline')}
+    return info
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print p50 against ``baseline``; return the names of regressed cases."""
+    regressions = []
+    print(f"\n{'case':<58}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, stats in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name:<58}{'-':>12}{stats['p50_ms']:>12.3f}{'new':>10}")
+            continue
+        change = stats['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0.0
+        regressed = change > threshold and stats['p50_ms'] - old['p50_ms'] > min_delta_ms
+        if regressed:
+            regressions.append(name)
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<58}{old['p50_ms']:>12.3f}{stats['p50_ms']:>12.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--quick', action='store_true', help='small sizes and few runs (smoke test)')
+    parser.add_argument('--corpus-sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--index-types', nargs='+', default=['flat', 'ivf_flat'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--profiles', nargs='+', default=['greedy', 'small_beam', 'full_beam'])
+    parser.add_argument('--history-sizes', type=int, nargs='+', default=[100, 5000])
+    parser.add_argument('--sessions-per-user', type=int, default=50)
+    parser.add_argument('--document-sizes', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--model-size', choices=sorted(MODEL_SHAPES), default='tiny')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--generation-repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='compare against this results JSON')
+    parser.add_argument('--save-baseline', help='also write results JSON here as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed p50 slowdown (0.15 = 15%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='ignore slowdowns smaller than this many milliseconds')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.corpus_sizes = [2000]
+        args.index_types = ['flat']
+        args.batch_sizes = [1, 4]
+        args.history_sizes = [100]
+        args.sessions_per_user = 10
+        args.document_sizes = [10]
+        args.repeat = 5
+        args.generation_repeat = 2
+
+    workdir = tempfile.mkdtemp(prefix='medqa_bench_')
+    results = {}
+    try:
+        fixtures = Fixtures(workdir, args.model_size)
+        for group in args.only:
+            print(f"[{group}]", flush=True)
+            BENCHMARKS[group](fixtures, args, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'environment': environment(args), 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+    if not args.output and not args.save_baseline:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if baseline.get('environment', {}).get('config') != report['environment']['config']:
+            print("\nNote: the baseline was recorded with a different configuration")
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
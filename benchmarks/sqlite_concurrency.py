@@ -0,0 +1,146 @@
+#benchmarks/sqlite_concurrency.py
+"""Compare per-call SQLite connections with the pooled WAL connection layer.
+
+Every thread repeatedly stores a message and reads back the last five
+messages of its session, the same pattern as a Gemini chat turn. Usage:
+    python benchmarks/sqlite_concurrency.py --threads 32 --ops 200
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import models.db as db
+from models.context import ChatContext
+
+
+# ------------------- Previous implementation -------------------
+
+def legacy_add_message(db_path, session_id, role, content):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            INSERT INTO chat_messages
+            (session_id, role, content, model, context_info)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (session_id, role, content, None, None))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def legacy_get_session_messages(db_path, session_id, limit):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT * FROM chat_messages
+        WHERE session_id = ?
+        ORDER BY timestamp DESC
+        LIMIT ?
+    ''', (session_id, limit))
+    messages = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return messages
+
+
+# ------------------- Load driver -------------------
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def run(add_message, get_messages, threads, ops):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        session_id = f"bench_{n}"
+        local = []
+        for i in range(ops):
+            start = time.perf_counter()
+            try:
+                add_message(session_id, 'user', f"message {i} " + "x" * 200)
+                get_messages(session_id, 5)
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - start
+
+    return {
+        'ops_per_s': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else float('nan'),
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else float('nan'),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--ops', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='sqlite_bench_')
+    cwd = os.getcwd()
+    try:
+        # init_db creates ./instance relative to the working directory
+        os.chdir(workdir)
+
+        legacy_path = os.path.join(workdir, 'legacy.db')
+        db.DB_PATH = legacy_path
+        ChatContext.init_db()
+        db.close_all()
+        # init_db goes through the pool, which enables WAL; undo it for the old path
+        conn = sqlite3.connect(legacy_path)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.close()
+
+        results = {
+            'per-call connect': run(
+                lambda *a: legacy_add_message(legacy_path, *a),
+                lambda *a: legacy_get_session_messages(legacy_path, *a),
+                args.threads, args.ops
+            )
+        }
+
+        db.DB_PATH = os.path.join(workdir, 'pooled.db')
+        ChatContext.init_db()
+        results['pooled WAL'] = run(
+            ChatContext.add_message,
+            lambda session_id, limit: ChatContext.get_session_messages(session_id, limit=limit),
+            args.threads, args.ops
+        )
+        db.close_all()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.threads} threads x {args.ops} (add_message + get_session_messages)")
+    print(f"{'mode':<18}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<18}{r['ops_per_s']:>10.0f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
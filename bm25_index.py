@@ -0,0 +1,381 @@
+#bm25_index.py
+"""On-disk BM25 inverted index over the context map passages.
+
+Dense retrieval misses exact medical terms (drug names, gene symbols,
+acronyms). This index scores the same passages lexically with BM25 and
+``reciprocal_rank_fusion`` merges its ranking with the dense one.
+
+File layout (all integers little-endian)::
+
+    b"BM25IDX\\0"         magic
+    uint64               header length in bytes
+    header               JSON: {"version", "docs", "terms", "avgdl", "k1", "b", "arrays": {...}, "source"}
+    body, 8-byte aligned; arrays at the positions listed in the header:
+        doc_lengths      uint32[docs]      tokens per passage
+        term_offsets     uint64[terms + 1] into term_blob (terms sorted, UTF-8)
+        term_blob        bytes
+        doc_freqs        uint32[terms]
+        posting_offsets  uint64[terms + 1] into postings
+        postings         bytes; per term, varint doc-id gaps then varint term frequencies
+
+The file is opened with ``mmap``; only the posting lists of the query terms
+are read and decoded (vectorised with numpy). ``source`` identifies the
+version of the context map it was built from (see
+``context_store.source_fingerprint``); a stale index is not loaded. Build it
+with::
+
+    python bm25_index.py ai_integration/context_map.pkl ai_integration/context_map.bm25
+"""
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+
+import numpy as np
+
+from context_store import source_fingerprint
+
+MAGIC = b"BM25IDX\0"
+FORMAT_VERSION = 1
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+# Constant of reciprocal-rank fusion; 60 is the value from the original paper
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in
+into is it its may might more most no not of on or our should so such than that the their
+them then there these they this those to was we were what when where whether which while
+who why will with would you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased terms; compound terms (``il-6``, ``covid-19``) also yield their parts."""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token not in STOPWORDS:
+            terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-/.]", token) if part and part not in STOPWORDS)
+    return terms
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+# ------------------- Varint coding -------------------
+
+def varint_encode(values):
+    """LEB128-encode an array of non-negative integers (< 2**35) into uint8."""
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        nbytes += values >= (1 << shift)
+    starts = np.cumsum(nbytes) - nbytes
+    owner = np.repeat(np.arange(len(values)), nbytes)
+    position = np.arange(int(nbytes.sum())) - starts[owner]
+    out = ((values[owner] >> (7 * position).astype(np.uint64)) & 0x7F).astype(np.uint8)
+    out[position < nbytes[owner] - 1] |= 0x80
+    return out
+
+
+def varint_decode(buffer):
+    """Decode a uint8 buffer of LEB128 values into an int64 array."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if len(data) == 0 or data.max() < 0x80:  # every value fits in one byte (dense posting lists)
+        return data.astype(np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    groups = (data & 0x7F).astype(np.int64)
+    values = groups[starts]
+    lengths = ends - starts + 1
+    for i in range(1, int(lengths.max())):
+        longer = np.flatnonzero(lengths > i)
+        values[longer] |= groups[starts[longer] + i] << (7 * i)
+    return values
+
+
+# ------------------- Building -------------------
+
+def build_bm25_index(texts, output_path, k1=DEFAULT_K1, b=DEFAULT_B, source=None):
+    """Build an index over ``texts`` (position == row id) and write it to ``output_path``."""
+    vocabulary = {}
+    term_ids, doc_ids, freqs = [], [], []
+    doc_lengths = []
+
+    for doc_id, text in enumerate(texts):
+        terms = tokenize(text)
+        doc_lengths.append(len(terms))
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        ids = [vocabulary.setdefault(term, len(vocabulary)) for term in counts]
+        term_ids.append(np.asarray(ids, dtype=np.uint32))
+        doc_ids.append(np.full(len(ids), doc_id, dtype=np.uint32))
+        freqs.append(np.fromiter(counts.values(), dtype=np.uint32, count=len(counts)))
+
+    n_docs = len(doc_lengths)
+    term_ids = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.uint32)
+    doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.uint32)
+    freqs = np.concatenate(freqs) if freqs else np.zeros(0, dtype=np.uint32)
+
+    # Renumber terms in sorted order so lookups can binary-search the term blob
+    terms = sorted(vocabulary)
+    remap = np.empty(len(vocabulary), dtype=np.uint32)
+    for new_id, term in enumerate(terms):
+        remap[vocabulary[term]] = new_id
+    term_ids = remap[term_ids]
+
+    # Stable sort keeps doc ids ascending inside every posting list
+    order = np.argsort(term_ids, kind="stable")
+    term_ids, doc_ids, freqs = term_ids[order], doc_ids[order], freqs[order]
+    doc_freqs = np.bincount(term_ids, minlength=len(terms)).astype(np.uint32)
+    list_starts = np.concatenate(([0], np.cumsum(doc_freqs)[:-1])).astype(np.int64)
+
+    gaps = doc_ids.astype(np.int64)
+    gaps[1:] -= doc_ids[:-1]
+    gaps[list_starts] = doc_ids[list_starts]  # first entry of each list is absolute
+
+    postings = []
+    posting_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    for term_id, start in enumerate(list_starts):
+        stop = start + int(doc_freqs[term_id])
+        encoded = varint_encode(np.concatenate((gaps[start:stop], freqs[start:stop])))
+        postings.append(encoded)
+        posting_offsets[term_id + 1] = posting_offsets[term_id] + len(encoded)
+
+    term_bytes = [term.encode("utf-8") for term in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    np.cumsum([len(t) for t in term_bytes], out=term_offsets[1:])
+
+    arrays = [
+        ("doc_lengths", np.asarray(doc_lengths, dtype="<u4").tobytes()),
+        ("term_offsets", term_offsets.astype("<u8").tobytes()),
+        ("term_blob", b"".join(term_bytes)),
+        ("doc_freqs", doc_freqs.astype("<u4").tobytes()),
+        ("posting_offsets", posting_offsets.astype("<u8").tobytes()),
+        ("postings", None),
+    ]
+    positions = {}
+    cursor = 0
+    for name, data in arrays:
+        size = int(posting_offsets[-1]) if data is None else len(data)
+        positions[name] = cursor
+        cursor = _align(cursor + size)
+
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "docs": n_docs,
+        "terms": len(terms),
+        "avgdl": float(np.mean(doc_lengths)) if n_docs else 0.0,
+        "k1": k1,
+        "b": b,
+        "arrays": positions,
+        "source": source,
+    }).encode("utf-8")
+    body_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, data in arrays:
+            f.write(b"\0" * (body_start + positions[name] - f.tell()))
+            if data is None:
+                for encoded in postings:
+                    f.write(encoded.tobytes())
+            else:
+                f.write(data)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def build_from_context_map(context_map, output_path, **kwargs):
+    texts = (context_map[i]["context"] for i in range(len(context_map)))
+    return build_bm25_index(texts, output_path, **kwargs)
+
+
+# ------------------- Searching -------------------
+
+class _Terms:
+    """Sorted term list decoded lazily from the mmap (for ``bisect``)."""
+
+    def __init__(self, offsets, blob_start, buffer):
+        self._offsets = offsets
+        self._blob_start = blob_start
+        self._buffer = buffer
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        start = self._blob_start + int(self._offsets[i])
+        end = self._blob_start + int(self._offsets[i + 1])
+        return self._buffer[start:end].decode("utf-8")
+
+
+class BM25Index:
+    """Read-only, mmap-backed BM25 index; ``search`` returns row ids of the context map."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a BM25 index file")
+
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_len])
+        if header.get("version") != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported BM25 index version: {header.get('version')}")
+
+        body = _align(header_start + header_len)
+        pos = header["arrays"]
+        self.docs = header["docs"]
+        self.avgdl = header["avgdl"] or 1.0
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.source = header.get("source")
+        n_terms = header["terms"]
+
+        self.doc_lengths = np.frombuffer(self._mmap, dtype="<u4", count=self.docs,
+                                         offset=body + pos["doc_lengths"])
+        self.doc_freqs = np.frombuffer(self._mmap, dtype="<u4", count=n_terms,
+                                       offset=body + pos["doc_freqs"])
+        self._posting_offsets = np.frombuffer(self._mmap, dtype="<u8", count=n_terms + 1,
+                                              offset=body + pos["posting_offsets"])
+        self._postings_start = body + pos["postings"]
+        term_offsets = np.frombuffer(self._mmap, dtype="<u8", count=n_terms + 1,
+                                     offset=body + pos["term_offsets"])
+        self._terms = _Terms(term_offsets, body + pos["term_blob"], self._mmap)
+        # BM25 length normalisation, computed once per process (4 bytes per passage)
+        self._norm = None
+
+    def close(self):
+        # numpy views keep the mmap exported; drop them before closing
+        self.doc_lengths = self.doc_freqs = self._posting_offsets = self._norm = None
+        self._terms = None
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return self.docs
+
+    def term_id(self, term):
+        i = bisect.bisect_left(self._terms, term)
+        if i < len(self._terms) and self._terms[i] == term:
+            return i
+        return None
+
+    def postings(self, term_id):
+        """Doc ids and term frequencies of one term."""
+        start = self._postings_start + int(self._posting_offsets[term_id])
+        end = self._postings_start + int(self._posting_offsets[term_id + 1])
+        values = varint_decode(self._mmap[start:end])
+        df = int(self.doc_freqs[term_id])
+        return np.cumsum(values[:df]), values[df:].astype(np.float32)
+
+    def _length_norm(self):
+        if self._norm is None:
+            self._norm = (self.k1 * (1 - self.b + self.b * self.doc_lengths / self.avgdl)).astype(np.float32)
+        return self._norm
+
+    def score(self, query):
+        """Dense array of BM25 scores of every passage for ``query``."""
+        norm = self._length_norm()
+        scores = np.zeros(self.docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            doc_ids, tf = self.postings(term_id)
+            df = len(doc_ids)
+            idf = math.log(1 + (self.docs - df + 0.5) / (df + 0.5))
+            # tf * (k1 + 1) / (tf + norm), computed in place over the posting list
+            weights = norm[doc_ids]
+            weights += tf
+            np.divide(tf, weights, out=weights)
+            weights *= idf * (self.k1 + 1)
+            np.add.at(scores, doc_ids, weights)
+        return scores
+
+    def search(self, queries, top_k):
+        """Per query, ``(row_ids, scores)`` of the best matches, highest first."""
+        results = []
+        for query in queries:
+            scores = self.score(query)
+            k = min(top_k, self.docs)
+            if k == 0:
+                results.append((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)))
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top = top[scores[top] > 0]
+            results.append((top, scores[top]))
+        return results
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked lists of keys into one list of ``(key, score)``, best first.
+
+    ``score = sum(1 / (k + rank))`` over the lists a key appears in (rank from 1).
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def bm25_index_path(context_map_path):
+    """The BM25 index that belongs to a context map (``.pkl`` or ``.ctx``)."""
+    return os.path.splitext(context_map_path)[0] + ".bm25"
+
+
+def load_bm25_index(context_map_path, docs=None):
+    """Open the BM25 index next to ``context_map_path``.
+
+    Returns ``None`` if it was not built, or was built from another version of
+    the context map (``docs`` is the size of the loaded map).
+    """
+    path = bm25_index_path(context_map_path)
+    if not os.path.exists(path):
+        return None
+    index = BM25Index(path)
+    if index.source != source_fingerprint(context_map_path) or docs not in (None, index.docs):
+        print(f"Ignoring {path}: it was not built from the current {context_map_path}; "
+              "re-run bm25_index.py to rebuild it")
+        index.close()
+        return None
+    return index
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python bm25_index.py <context_map> [<output.bm25>]")
+        sys.exit(1)
+
+    from context_store import load_context_map
+
+    output_path = sys.argv[2] if len(sys.argv) == 3 else bm25_index_path(sys.argv[1])
+    build_from_context_map(load_context_map(sys.argv[1]), output_path,
+                           source=source_fingerprint(sys.argv[1]))
+    print(f"BM25 index written to {output_path}")
@@ -0,0 +1,243 @@
+#context_store.py
+"""Memory-mapped columnar store for the RAG context map.
+
+The pickled ``context_map`` is a dict of dicts holding every PubMedQA row as
+Python strings. This store keeps the same rows on disk as one UTF-8 blob per
+field plus an offsets array, and opens the file with ``mmap`` so that only the
+rows a query actually touches are decoded. Forked workers share the mapped
+pages through the OS page cache.
+
+File layout (all integers little-endian)::
+
+    b"CTXSTORE"          magic
+    uint64               header length in bytes
+    header               JSON: {"version", "rows", "fields": {name: {...}}, "source"}
+    body, 8-byte aligned; per field (positions relative to the body start):
+        uint64[rows + 1] offsets into the blob
+        bytes            UTF-8 blob
+
+Convert an existing pickle with::
+
+    python context_store.py ai_integration/context_map.pkl ai_integration/context_map.ctx
+
+``source`` records the size and mtime of the pickle the store was converted
+from. A store whose pickle has since been rebuilt is ignored in favour of the
+pickle, so FAISS ids never point at passages of an older corpus.
+"""
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b"CTXSTORE"
+FORMAT_VERSION = 1
+DEFAULT_FIELDS = ("context", "question", "answer")
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def context_map_source(context_map_path):
+    """The file a context map and the stores derived from it are built from.
+
+    That is the pickle when there is one, the context store otherwise.
+    """
+    pickle_path = os.path.splitext(context_map_path)[0] + ".pkl"
+    return pickle_path if os.path.exists(pickle_path) else context_map_path
+
+
+def source_fingerprint(context_map_path):
+    """Size and mtime of the source of ``context_map_path``, to detect rebuilds."""
+    st = os.stat(context_map_source(context_map_path))
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# ------------------- Writing -------------------
+
+def write_context_store(rows, output_path, fields=DEFAULT_FIELDS, source=None):
+    """Write a sequence of row dicts (position == row id) to ``output_path``.
+
+    ``source`` is the ``source_fingerprint`` of the pickle the rows come from.
+    """
+    encoded = {field: [] for field in fields}
+    for row in rows:
+        for field in fields:
+            value = row.get(field, "")
+            encoded[field].append(("" if value is None else str(value)).encode("utf-8"))
+
+    n_rows = len(encoded[fields[0]]) if fields else 0
+    offsets = {}
+    for field in fields:
+        lengths = np.fromiter((len(b) for b in encoded[field]), dtype=np.uint64, count=n_rows)
+        field_offsets = np.zeros(n_rows + 1, dtype=np.uint64)
+        np.cumsum(lengths, out=field_offsets[1:])
+        offsets[field] = field_offsets
+
+    # Positions in the header are relative to the 8-byte aligned body start
+    positions = {}
+    cursor = 0
+    for field in fields:
+        size = int(offsets[field][-1])
+        positions[field] = {"offsets": cursor, "data": _align(cursor + offsets[field].nbytes), "size": size}
+        cursor = _align(positions[field]["data"] + size)
+
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "rows": n_rows,
+        "fields": positions,
+        "source": source,
+    }).encode("utf-8")
+    body_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for field in fields:
+            f.write(b"\0" * (body_start + positions[field]["offsets"] - f.tell()))
+            f.write(offsets[field].astype("<u8").tobytes())
+            f.write(b"\0" * (body_start + positions[field]["data"] - f.tell()))
+            for blob in encoded[field]:
+                f.write(blob)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def convert_pickle(pickle_path, output_path, fields=DEFAULT_FIELDS):
+    """Convert a pickled ``{row_id: {field: str}}`` context map to a store file."""
+    with open(pickle_path, "rb") as f:
+        context_map = pickle.load(f)
+
+    n_rows = len(context_map)
+    if set(context_map.keys()) != set(range(n_rows)):
+        raise ValueError("context map keys must be the contiguous row ids 0..N-1")
+
+    return write_context_store((context_map[i] for i in range(n_rows)), output_path, fields,
+                               source=source_fingerprint(pickle_path))
+
+
+# ------------------- Reading -------------------
+
+class ContextStore:
+    """Read-only, mmap-backed drop-in for the ``context_map`` dict.
+
+    ``store[idx]`` returns a plain dict with the row's fields, decoded on demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a context store file")
+
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_len])
+        if header.get("version") != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported context store version: {header.get('version')}")
+
+        body_start = _align(header_start + header_len)
+        self.rows = header["rows"]
+        self.fields = tuple(header["fields"])
+        self.source = header.get("source")
+        self._offsets = {}
+        self._data_start = {}
+        for field, pos in header["fields"].items():
+            self._offsets[field] = np.frombuffer(
+                self._mmap, dtype="<u8", count=self.rows + 1, offset=body_start + pos["offsets"]
+            )
+            self._data_start[field] = body_start + pos["data"]
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def close(self):
+        # numpy views keep the mmap exported; drop them before closing
+        self._offsets = {}
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = None
+
+    def get_field(self, idx, field):
+        """Decode a single field of a single row."""
+        if not 0 <= idx < self.rows:
+            raise KeyError(idx)
+        offsets = self._offsets[field]
+        start = self._data_start[field] + int(offsets[idx])
+        end = self._data_start[field] + int(offsets[idx + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        return {field: self.get_field(idx, field) for field in self.fields}
+
+    def get(self, idx, default=None):
+        try:
+            return self[idx]
+        except KeyError:
+            return default
+
+    def __contains__(self, idx):
+        return isinstance(idx, (int, np.integer)) and 0 <= int(idx) < self.rows
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(range(self.rows))
+
+    def keys(self):
+        return range(self.rows)
+
+
+def _check_rows(context_map, rows, path):
+    if rows is not None and len(context_map) != rows:
+        raise ValueError(f"{path} has {len(context_map)} rows but the index has {rows}; "
+                         "rebuild them together")
+    return context_map
+
+
+def load_context_map(context_map_path, rows=None):
+    """Open a context store, or fall back to unpickling a legacy ``.pkl`` map.
+
+    If ``context_map_path`` is a pickle with a converted ``.ctx`` file next to
+    it, the store is used instead, unless it was converted from an older
+    version of the pickle or holds a different number of rows. ``rows`` is the
+    number of vectors in the FAISS index; a map of another size raises
+    ``ValueError``.
+    """
+    root, ext = os.path.splitext(context_map_path)
+    if ext == ".pkl":
+        store_path = root + ".ctx"
+        if os.path.exists(store_path):
+            store = ContextStore(store_path)
+            if store.source == source_fingerprint(context_map_path) and rows in (None, store.rows):
+                return store
+            print(f"Ignoring {store_path}: it was not converted from the current "
+                  f"{context_map_path}; re-run context_store.py to rebuild it")
+            store.close()
+        with open(context_map_path, "rb") as f:
+            return _check_rows(pickle.load(f), rows, context_map_path)
+    return _check_rows(ContextStore(context_map_path), rows, context_map_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python context_store.py <context_map.pkl> <context_map.ctx>")
+        sys.exit(1)
+    convert_pickle(sys.argv[1], sys.argv[2])
+    print(f"Context store written to {sys.argv[2]}")
@@ -0,0 +1,86 @@
+#decoding.py
+import math
+import os
+import threading
+
+# ------------------- Decoding Profiles -------------------
+
+# Ordered from most to least expensive; the controller degrades along this list
+DECODING_PROFILES = {
+    'full_beam': {'num_beams': 4, 'max_new_tokens': 512, 'early_stopping': True},
+    'small_beam': {'num_beams': 2, 'max_new_tokens': 384, 'early_stopping': True},
+    'greedy': {'num_beams': 1, 'max_new_tokens': 256},
+}
+DEFAULT_PROFILE = 'full_beam'
+
+LATENCY_SLO_MS = float(os.getenv('RAG_LATENCY_SLO_MS', '8000'))
+# Starting guesses (seconds per generate batch) until real timings come in
+INITIAL_ESTIMATES = {'full_beam': 2.0, 'small_beam': 1.0, 'greedy': 0.4}
+
+
+def generation_kwargs(profile=None):
+    """Keyword arguments for ``model.generate`` for a named profile."""
+    profile = profile or DEFAULT_PROFILE
+    if profile not in DECODING_PROFILES:
+        raise ValueError(f"Unknown decoding profile '{profile}', expected one of {list(DECODING_PROFILES)}")
+    return dict(DECODING_PROFILES[profile])
+
+
+# ------------------- Load-aware Controller -------------------
+
+class DecodingController:
+    """Pick the most expensive profile whose predicted latency meets the SLO.
+
+    The controller tracks how many admitted requests are still outstanding
+    for each profile. The batcher is FIFO, so the backlog drains in
+    ``ceil(outstanding / max_batch_size)`` batches and each batch runs one
+    generate call per profile it contains; a profile with ``n`` outstanding
+    requests therefore appears in at most ``n`` of those batches. Generate
+    time per profile is an exponentially weighted moving average of observed
+    batches. Every ``choose`` must be paired with a ``release`` once the
+    request finishes.
+    """
+
+    def __init__(self, slo_ms=LATENCY_SLO_MS, max_batch_size=1, alpha=0.2,
+                 initial_estimates=None):
+        self.slo = slo_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.alpha = alpha
+        self.estimates = dict(INITIAL_ESTIMATES if initial_estimates is None else initial_estimates)
+        self.outstanding = {profile: 0 for profile in DECODING_PROFILES}
+        self._lock = threading.Lock()
+
+    def _predict(self, profile):
+        counts = dict(self.outstanding)
+        counts[profile] += 1
+        batches = math.ceil(sum(counts.values()) / self.max_batch_size)
+        return sum(min(batches, count) * self.estimates[name] for name, count in counts.items())
+
+    def predicted_latency(self, profile):
+        """Seconds until a request admitted now with ``profile`` would finish."""
+        with self._lock:
+            return self._predict(profile)
+
+    def choose(self):
+        """Return the profile for a request arriving now and count it as outstanding."""
+        with self._lock:
+            chosen = None
+            for profile in DECODING_PROFILES:
+                if self._predict(profile) <= self.slo:
+                    chosen = profile
+                    break
+            # Even the cheapest profile misses the SLO; it still degrades the least
+            chosen = chosen or list(DECODING_PROFILES)[-1]
+            self.outstanding[chosen] += 1
+            return chosen
+
+    def release(self, profile):
+        """Mark a request admitted by ``choose`` as finished (or failed)."""
+        with self._lock:
+            self.outstanding[profile] = max(0, self.outstanding[profile] - 1)
+
+    def record(self, profile, seconds):
+        """Feed back the measured duration of one generate batch."""
+        with self._lock:
+            previous = self.estimates.get(profile, seconds)
+            self.estimates[profile] = (1 - self.alpha) * previous + self.alpha * seconds
@@ -0,0 +1,298 @@
+#gemini_client.py
+"""Gemini client with deadlines, retries, a concurrency cap and a circuit breaker.
+
+``GeminiClient`` wraps a backend object exposing ``generate(prompt, timeout)``
+and ``stream(prompt, timeout)``. ``GenAIBackend`` talks to the real API through
+one shared ``GenerativeModel`` (and therefore one reused gRPC channel);
+``FakeBackend`` simulates latency and failures so the client can be load-tested
+offline.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # google-generativeai not installed (e.g. offline load tests)
+    google_exceptions = None
+
+DEFAULT_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-preview-04-17')
+DEFAULT_TIMEOUT_S = float(os.getenv('GEMINI_TIMEOUT_S', '30'))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+DEFAULT_MAX_QUEUED = int(os.getenv('GEMINI_MAX_QUEUED', '32'))
+DEFAULT_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '2'))
+
+
+class GeminiError(Exception):
+    """Base class for errors raised by the client itself."""
+
+
+class GeminiTimeoutError(GeminiError):
+    """The call did not finish before its deadline."""
+
+
+class GeminiOverloadedError(GeminiError):
+    """Too many calls are already running or waiting."""
+
+
+class CircuitOpenError(GeminiError):
+    """Recent calls failed repeatedly; failing fast until the breaker resets."""
+
+
+# ------------------- Backends -------------------
+
+class GenAIBackend:
+    """Backend for the real Gemini API via ``google.generativeai``."""
+
+    def __init__(self, model=None, model_name=DEFAULT_MODEL_NAME):
+        if model is None:
+            import google.generativeai as genai
+            model = genai.GenerativeModel(model_name)
+        self.model = model
+
+    def generate(self, prompt, timeout):
+        response = self.model.generate_content(prompt, request_options={'timeout': timeout})
+        return response.text
+
+    def stream(self, prompt, timeout):
+        response = self.model.generate_content(
+            prompt, stream=True, request_options={'timeout': timeout}
+        )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only)
+                continue
+            if text:
+                yield text
+
+
+class FakeBackend:
+    """Offline stand-in with log-normal latency and random transient failures."""
+
+    def __init__(self, median_ms=800.0, sigma=0.5, failure_rate=0.0, chunks=20, seed=None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self.chunks = max(1, chunks)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        with self._lock:
+            latency = self.median_ms / 1000.0 * self._random.lognormvariate(0, self.sigma)
+            failed = self._random.random() < self.failure_rate
+        return latency, failed
+
+    def generate(self, prompt, timeout):
+        latency, failed = self._sample()
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError("fake backend deadline exceeded")
+        if failed:
+            raise ConnectionError("fake backend transient failure")
+        return f"### Simulated answer\n\nEcho: {prompt[-200:]}"
+
+    def stream(self, prompt, timeout):
+        latency, failed = self._sample()
+        if failed:
+            raise ConnectionError("fake backend transient failure")
+        for i in range(self.chunks):
+            time.sleep(latency / self.chunks)
+            yield f"token{i} "
+
+
+# ------------------- Resilience -------------------
+
+def is_transient(exc):
+    """Whether an error is worth retrying."""
+    if isinstance(exc, (ConnectionError, TimeoutError, FutureTimeoutError)):
+        return True
+    if google_exceptions is not None:
+        return isinstance(exc, (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+        ))
+    return False
+
+
+class CircuitBreaker:
+    """Open after ``failure_threshold`` consecutive failures, probe after ``reset_timeout``."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                # Let exactly one trial call through
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+# ------------------- Client -------------------
+
+class GeminiClient:
+    """Bounded, deadline-aware front end for a Gemini backend.
+
+    Generate and stream calls share one budget: at most ``max_concurrency``
+    upstream calls run at once and at most ``max_queued`` more wait for a
+    turn; beyond that calls are rejected with ``GeminiOverloadedError``.
+    """
+
+    def __init__(self, backend, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_queued=DEFAULT_MAX_QUEUED, timeout=DEFAULT_TIMEOUT_S,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=0.25, backoff_max=4.0,
+                 breaker=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='gemini')
+        # Running plus waiting calls of both kinds; beyond this we reject instead of queueing
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queued)
+        # Upstream calls in progress, generate and stream alike
+        self._running = threading.BoundedSemaphore(max_concurrency)
+
+    def _record_outcome(self, transient_failure):
+        # Only upstream trouble counts against the breaker; a rejected prompt
+        # still proves the service is reachable
+        if transient_failure:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _backoff(self, attempt):
+        # "Full jitter": uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def generate(self, prompt, timeout=None):
+        """Return the response text, retrying transient errors within one deadline."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        if not self._slots.acquire(blocking=False):
+            raise GeminiOverloadedError("Too many Gemini requests in flight")
+        try:
+            attempt = 0
+            while True:
+                if not self.breaker.allow():
+                    raise CircuitOpenError("Gemini is temporarily unavailable")
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running.acquire(timeout=remaining):
+                    raise GeminiTimeoutError("Gemini request deadline exceeded")
+                remaining = max(0.0, deadline - time.monotonic())
+                try:
+                    future = self._executor.submit(self.backend.generate, prompt, remaining)
+                except BaseException:
+                    self._running.release()
+                    raise
+                # The turn is held until the call returns, even if we stop waiting for it
+                future.add_done_callback(lambda _: self._running.release())
+                try:
+                    result = future.result(timeout=remaining)
+                except Exception as e:
+                    future.cancel()
+                    if isinstance(e, FutureTimeoutError):
+                        e = GeminiTimeoutError("Gemini request deadline exceeded")
+                    retryable = isinstance(e, GeminiTimeoutError) or is_transient(e)
+                    self._record_outcome(retryable)
+
+                    sleep_for = self._backoff(attempt)
+                    if (not retryable or attempt >= self.max_retries
+                            or time.monotonic() + sleep_for >= deadline):
+                        raise e
+                    attempt += 1
+                    time.sleep(sleep_for)
+                    continue
+
+                self.breaker.record_success()
+                return result
+        finally:
+            self._slots.release()
+
+    def stream(self, prompt, timeout=None):
+        """Yield response text chunks; only the initial connection is retried."""
+        timeout = timeout or self.timeout
+
+        if not self._slots.acquire(blocking=False):
+            raise GeminiOverloadedError("Too many Gemini requests in flight")
+        if not self._running.acquire(timeout=timeout):
+            self._slots.release()
+            raise GeminiTimeoutError("Gemini request deadline exceeded")
+        try:
+            attempt = 0
+            while True:
+                if not self.breaker.allow():
+                    raise CircuitOpenError("Gemini is temporarily unavailable")
+                chunks = self.backend.stream(prompt, timeout)
+                try:
+                    first = next(chunks, None)
+                except Exception as e:
+                    retryable = is_transient(e)
+                    self._record_outcome(retryable)
+                    if not retryable or attempt >= self.max_retries:
+                        raise
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                break
+
+            try:
+                if first is not None:
+                    yield first
+                yield from chunks
+            except GeneratorExit:
+                # The consumer went away; the upstream itself was healthy
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                self._record_outcome(is_transient(e))
+                raise
+            self.breaker.record_success()
+        finally:
+            self._running.release()
+            self._slots.release()
+
+    def status(self):
+        return {'circuit': self.breaker.state}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,62 @@
+#gunicorn.conf.py
+"""Pre-fork deployment: load the RAG models once and share them with every worker.
+
+    gunicorn -c gunicorn.conf.py app:app
+    gunicorn -c gunicorn.conf.py inference_server:app
+
+With ``preload_app`` the master imports the app module, which in pre-fork mode
+(``RAG_PREFORK=1``) loads the generator, embedder, FAISS index and passage
+stores synchronously and starts no threads. Forked workers share those pages
+copy-on-write; each worker then starts its own micro-batcher, caches and
+profiler from the module's ``start_worker`` in ``post_fork`` (SQLite
+connections and threads must not cross a fork).
+
+ONNX Runtime sessions start their thread pools when they are created, so with
+``RAG_GENERATOR_BACKEND=onnx`` or ``onnx-int8`` the master only loads the
+tokenizer and every worker creates its own session in ``start_serving``: the
+generator is not shared, and the model has to be exported beforehand
+(``python onnx_backend.py <model_path> [--int8]``).
+
+Tensors, FAISS vectors and the mmap'd stores are plain buffers that workers
+only read, so they stay shared. Python objects are not: a garbage collection
+writes to the header of every object it visits, so GC is disabled while the
+master loads and everything it allocated is moved to the permanent generation
+with ``gc.freeze()`` before forking. The FAISS index is memory-mapped from
+its file (``RAG_INDEX_MMAP``), which also keeps it shared across restarts.
+
+Settings: ``GUNICORN_BIND``, ``GUNICORN_WORKERS``, ``GUNICORN_THREADS`` and
+``RAG_TORCH_THREADS`` (intra-op threads per worker, default cores / workers).
+Measure the effect with ``python benchmarks/prefork_memory.py``.
+"""
+import gc
+import importlib
+import os
+import sys
+
+os.environ.setdefault('RAG_PREFORK', '1')
+os.environ.setdefault('RAG_INDEX_MMAP', '1')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_class = 'gthread'
+preload_app = True
+# Answers can take several seconds under load
+timeout = 120
+
+# No collections while the master allocates the objects the workers will share
+gc.disable()
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    if 'torch' in sys.modules:  # not loaded by a web tier that uses the inference server
+        sys.modules['torch'].set_num_threads(
+            int(os.getenv('RAG_TORCH_THREADS', '0')) or max(1, (os.cpu_count() or 1) // workers))
+
+    module = importlib.import_module(worker.app.app_uri.split(':')[0])
+    module.start_worker()
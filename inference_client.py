@@ -0,0 +1,373 @@
+#inference_client.py
+"""Client for the standalone inference server (inference_server.py).
+
+``InferenceClient`` offers the parts of ``RAGSystem`` the web app calls
+(``answer``, ``answer_stream``, ``retrieve``, ``search_documents``,
+``embed_query``, the session-document calls, ``status``), so app.py swaps it
+in for the in-process models when ``INFERENCE_SERVER_URL`` is set:
+
+    INFERENCE_SERVER_URL=http://127.0.0.1:8600
+    INFERENCE_SERVER_URL=unix:/run/medqa/inference.sock
+
+Requests reuse keep-alive connections from a small pool, and every call has a
+connect timeout and a response timeout. An unreachable server reports the
+``loading`` state, so the UI keeps polling while the model tier restarts.
+The server's stage timings are merged into the web request's breakdown;
+the rest of the round trip is recorded as the ``inference`` stage.
+
+The semantic answer cache for RAG answers lives in the server. The client
+keeps its own ``answer_cache`` for the Gemini answers of the web tier.
+"""
+import codecs
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import metrics
+from answer_cache import AnswerCache
+
+INFERENCE_SERVER_URL = os.getenv('INFERENCE_SERVER_URL') or None
+CONNECT_TIMEOUT_S = float(os.getenv('INFERENCE_CONNECT_TIMEOUT_S', '2'))
+# Includes queueing behind other questions in the server's micro-batcher
+TIMEOUT_S = float(os.getenv('INFERENCE_TIMEOUT_S', '60'))
+HEALTH_TIMEOUT_S = float(os.getenv('INFERENCE_HEALTH_TIMEOUT_S', '5'))
+# Idle keep-alive connections kept per web process
+POOL_SIZE = int(os.getenv('INFERENCE_POOL_SIZE', '16'))
+# Seconds a readiness check is reused before asking the server again
+HEALTH_TTL_S = float(os.getenv('INFERENCE_HEALTH_TTL_S', '5'))
+
+
+class InferenceError(Exception):
+    """The inference server rejected the call or failed to answer it."""
+
+
+class InferenceUnavailableError(InferenceError):
+    """The server could not be reached or its models are not loaded."""
+
+
+class InferenceTimeoutError(InferenceError):
+    """No response before the timeout."""
+
+
+# ------------------- Connections -------------------
+
+class _TCPConnection(http.client.HTTPConnection):
+    """Connects with the connect timeout, then waits up to ``read_timeout`` on reads."""
+
+    def __init__(self, host, port, connect_timeout, read_timeout):
+        super().__init__(host, port, timeout=connect_timeout)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super().connect()
+        self.sock.settimeout(self.read_timeout)
+
+
+class _UnixConnection(_TCPConnection):
+    def __init__(self, socket_path, connect_timeout, read_timeout):
+        super().__init__('localhost', None, connect_timeout, read_timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(self.read_timeout)
+        self.sock = sock
+
+
+class ConnectionPool:
+    """Idle keep-alive connections, most recently used first; opens more when all are busy."""
+
+    def __init__(self, factory, size=POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """``(connection, reused)``"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.factory(), False
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def connection_factory(url, connect_timeout, read_timeout):
+    """Connection constructor for ``http://host:port`` or ``unix:/path/to.sock``."""
+    if url.startswith('unix:'):
+        path = url[len('unix:'):]
+        if path.startswith('//'):
+            path = path[2:]
+        return lambda: _UnixConnection(path, connect_timeout, read_timeout)
+    parts = urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise ValueError(f"Unsupported inference server URL '{url}', expected http://host:port or unix:/path")
+    return lambda: _TCPConnection(parts.hostname, parts.port or 80, connect_timeout, read_timeout)
+
+
+# ------------------- Client -------------------
+
+class _RemoteSessionIndex:
+    """``session_index`` calls app.py makes directly."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def drop(self, key):
+        # Best effort: the server evicts idle sessions by itself as well
+        try:
+            self.client._request('POST', '/documents/drop', {'session_key': key})
+        except InferenceError as e:
+            print(f"Could not drop session documents on the inference server: {e}")
+
+    def status(self):
+        health = self.client._health or {}
+        return health.get('session_documents') or {'sessions': 0, 'chunks': 0}
+
+
+class InferenceClient:
+    """``RAGSystem`` stand-in that forwards to the inference server, see the module docstring."""
+
+    LOADING, READY, FAILED = 'loading', 'ready', 'failed'
+
+    def __init__(self, url, timeout=TIMEOUT_S, connect_timeout=CONNECT_TIMEOUT_S,
+                 health_timeout=HEALTH_TIMEOUT_S, pool_size=POOL_SIZE, health_ttl=HEALTH_TTL_S):
+        self.url = url
+        self.timeout = timeout
+        self.health_timeout = health_timeout
+        self.health_ttl = health_ttl
+        self.state = self.LOADING
+        self.error = None
+        # Model-side queues and caches live in the server (see its /metrics)
+        self.batcher = None
+        self.decoding_controller = None
+        self.query_cache = None
+        # Gemini answers; created once the server reports its embedding size
+        self.answer_cache = None
+        self.session_index = _RemoteSessionIndex(self)
+        # (session_key, saved uploads) from this thread's last ensure_documents
+        self._local = threading.local()
+        self._pool = ConnectionPool(connection_factory(url, connect_timeout, timeout), pool_size)
+        self._health = None
+        self._checked_at = None
+
+    # ------------------- Transport -------------------
+
+    def _request(self, method, path, payload=None, timeout=None, stream=False):
+        """JSON result of one call, or ``(response, connection)`` when ``stream`` is set."""
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        timeout = timeout or self.timeout
+        for attempt in range(2):
+            connection, reused = self._pool.acquire() if attempt == 0 else (self._pool.factory(), False)
+            connection.read_timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except TimeoutError as e:
+                connection.close()
+                raise InferenceTimeoutError(f"No response from the inference server within {timeout:.0f}s") from e
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if reused:
+                    # The server closed an idle keep-alive connection, and most likely the other
+                    # idle ones too; retry on a new connection
+                    self._pool.clear()
+                    continue
+                self._mark_unreachable(e)
+                raise InferenceUnavailableError(f"Inference server unreachable at {self.url}: {e}") from e
+
+            if stream and response.status == 200:
+                return response, connection
+            try:
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise InferenceError(f"Inference server response was cut off: {e}") from e
+            self._finish(response, connection)
+            try:
+                result = json.loads(data)
+            except ValueError:
+                result = {'error': data[:200].decode('utf-8', errors='replace')}
+            if response.status == 503:
+                raise InferenceUnavailableError(result.get('error') or 'Inference server is not ready')
+            if response.status >= 400:
+                raise InferenceError(f"Inference server error {response.status}: {result.get('error')}")
+            return result
+
+    def _finish(self, response, connection):
+        """Return a fully read connection to the pool unless the server is closing it."""
+        if response.will_close:
+            connection.close()
+        else:
+            self._pool.release(connection)
+
+    def _call(self, operation, path, payload):
+        """POST ``payload``; the server's stage timings join this request's breakdown."""
+        start = time.perf_counter()
+        result = self._request('POST', path, payload)
+        timings = result.pop('timings', None) or {}
+        metrics.add_request_timings(timings)
+        metrics.record('inference', max(0.0, time.perf_counter() - start - sum(timings.values())), operation)
+        return result
+
+    def _mark_unreachable(self, error):
+        self.state = self.LOADING
+        self.error = f"Inference server unreachable at {self.url}: {error}"
+        self._health = None
+        self._checked_at = time.monotonic()
+
+    # ------------------- Readiness -------------------
+
+    def _check_health(self):
+        self._checked_at = time.monotonic()
+        try:
+            health = self._request('GET', '/health', timeout=self.health_timeout)
+        except InferenceTimeoutError:
+            return self._health  # busy, not gone; keep the last known state
+        except InferenceError as e:
+            self.state, self.error = self.LOADING, str(e)
+            self._health = None
+            return None
+        if health.get('ready') and self.answer_cache is None:
+            self.answer_cache = AnswerCache(health['embedding_dim'])
+        self.state = self.READY if health.get('ready') else health.get('state', self.LOADING)
+        self.error = health.get('error')
+        self._health = health
+        return health
+
+    @property
+    def is_ready(self):
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.health_ttl:
+            self._check_health()
+        return self.state == self.READY
+
+    def wait_until_ready(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.is_ready:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(1.0, self.health_ttl))
+            self._checked_at = None
+        return True
+
+    def status(self):
+        health = self._check_health()
+        if health is None:
+            return {'state': self.state, 'error': self.error, 'server': self.url}
+        return dict(health, server=self.url)
+
+    def metric_families(self):
+        families = [
+            ('medqa_rag_ready', metrics.GAUGE, 'Whether the RAG system has finished loading.',
+             [({}, int(self.state == self.READY))]),
+        ]
+        if self.answer_cache is not None:
+            families += self.answer_cache.metric_families()
+        return families
+
+    # ------------------- RAGSystem calls -------------------
+
+    def _documents(self, session_key):
+        listed = getattr(self._local, 'documents', None)
+        return listed[1] if listed is not None and listed[0] == session_key else []
+
+    def answer(self, question, session_key=None, inline=False):
+        return self._call('answer', '/answer', {'question': question, 'session_key': session_key,
+                                                'documents': self._documents(session_key), 'inline': inline})
+
+    def retrieve(self, question, session_key=None):
+        result = self._call('retrieve', '/retrieve', {'question': question, 'session_key': session_key,
+                                                      'documents': self._documents(session_key)})
+        return question, result['contexts']
+
+    def answer_stream(self, question, session_key=None):
+        """``RAGSystem.answer_stream`` on the server: the result, then the answer text as it arrives."""
+        start = time.perf_counter()
+        response, connection = self._request('POST', '/stream', {
+            'question': question, 'session_key': session_key, 'documents': self._documents(session_key)},
+            stream=True)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        finished = False
+        try:
+            result = json.loads(response.readline())
+            timings = result.pop('timings', None) or {}
+            metrics.add_request_timings(timings)
+            metrics.record('inference', max(0.0, time.perf_counter() - start - sum(timings.values())), 'stream')
+            yield result
+            while True:
+                chunk = response.read1(8192)
+                if not chunk:
+                    break
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            finished = True
+        except TimeoutError as e:
+            raise InferenceTimeoutError(f"Inference server stopped streaming for {self.timeout:.0f}s") from e
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            raise InferenceError(f"Inference server response was cut off: {e}") from e
+        finally:
+            if finished:
+                self._finish(response, connection)
+            else:
+                connection.close()  # abandoned mid-answer; the rest of the body is still in flight
+
+    def search_documents(self, question, session_key, top_k=None):
+        documents = self._documents(session_key)
+        if not documents:
+            return []
+        return self._call('search_documents', '/search-documents', {
+            'question': question, 'session_key': session_key, 'documents': documents, 'top_k': top_k})['chunks']
+
+    def embed_query(self, question):
+        return np.asarray(self._call('embed', '/embed', {'question': question})['embedding'], dtype=np.float32)
+
+    def add_document(self, session_key, filename, pieces, source=None):
+        return self._call('add_document', '/documents', {
+            'session_key': session_key,
+            'filename': filename,
+            'text': ''.join(pieces),
+            'source': os.path.abspath(source) if source else None,
+        })['indexed']
+
+    def ensure_documents(self, session_key, documents):
+        """List the session's saved uploads for the following calls on this thread.
+
+        The server worker that takes a call indexes any of them it has not
+        seen, so requests spread over several model workers all find them.
+        """
+        self._local.documents = (session_key, [[os.path.abspath(path), filename] for path, filename in documents])
+
+    def close(self):
+        self._pool.clear()
@@ -0,0 +1,232 @@
+#inference_server.py
+"""Standalone inference service: RAG retrieval and generation outside the web tier.
+
+A beam search running in a Flask worker holds a request thread and the CPU
+that cheap requests (pages, logins, session lists) need. This server owns the
+``RAGSystem`` (T5, the embedder, FAISS/BM25, query and answer caches, the
+micro-batcher), and app.py talks to it through
+``inference_client.InferenceClient`` when ``INFERENCE_SERVER_URL`` is set.
+The web tier and the model tier can then be scaled and restarted separately.
+
+    python inference_server.py --bind 127.0.0.1:8600
+    python inference_server.py --bind unix:/run/medqa/inference.sock
+    # production: keep-alive connections, several model workers sharing one copy of the models
+    GUNICORN_BIND=unix:/run/medqa/inference.sock gunicorn -c gunicorn.conf.py inference_server:app
+
+The development server started by ``python inference_server.py`` closes the
+connection after every response, so the client's pool only pays off under
+gunicorn.
+
+Endpoints (JSON in and out unless noted):
+
+    GET  /health             RAGSystem.status() plus ready and embedding_dim
+    POST /answer             question, session_key, documents, inline -> RAGSystem.answer result
+    POST /retrieve           question, session_key, documents -> contexts
+    POST /stream             question, session_key, documents -> result line, then answer text (streamed)
+    POST /search-documents   question, session_key, documents, top_k -> chunks
+    POST /embed              question -> embedding
+    POST /documents          session_key, filename, text, source -> indexed
+    POST /documents/drop     session_key
+    GET  /metrics            Prometheus metrics of the model tier
+
+Results carry the server-side stage ``timings`` for the web request's
+Server-Timing header. ``/stream`` sends ``RAGSystem.answer_stream``'s result
+as the first line of JSON and the answer text after it. ``documents`` lists the session's saved uploads as
+``[path, filename]`` pairs; whichever worker takes the call indexes those it
+has not seen from disk, so the upload folder must be readable here. Paths
+that resolve outside ``INFERENCE_UPLOAD_FOLDER`` (the web tier's
+``uploads``) are rejected with 403. There is no authentication: bind to
+localhost or to a socket only the web tier can open.
+"""
+import argparse
+import json
+import os
+import stat
+import threading
+import time
+import traceback
+from functools import wraps
+
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from werkzeug.serving import run_simple
+
+import metrics
+from rag_system import RAGSystem
+from stub_backends import StubRAGSystem
+
+MODEL_PATH = os.getenv('RAG_MODEL_PATH', 'ai_integration/t5-small-pubmedqa')
+INDEX_PATH = os.getenv('RAG_INDEX_PATH', 'ai_integration/pubmedqa_faiss.index')
+CONTEXT_MAP_PATH = os.getenv('RAG_CONTEXT_MAP_PATH', 'ai_integration/context_map.pkl')
+DEFAULT_BIND = os.getenv('INFERENCE_BIND', '127.0.0.1:8600')
+# Saved uploads are only read from here
+UPLOAD_FOLDER = os.path.realpath(os.getenv('INFERENCE_UPLOAD_FOLDER', 'uploads'))
+
+app = Flask(__name__)
+
+# Same start-up as app.py: background load, or load-only in a pre-fork master (gunicorn.conf.py)
+PREFORK = os.getenv('RAG_PREFORK') == '1'
+rag_class = StubRAGSystem if os.getenv('RAG_BACKEND') == 'fake' else RAGSystem
+rag_system = rag_class(MODEL_PATH, INDEX_PATH, CONTEXT_MAP_PATH, top_k=3)
+if PREFORK:
+    rag_system.load(serve=False)
+else:
+    rag_system.start()
+
+metrics.register_collector(rag_system.metric_families)
+
+
+def start_worker():
+    """Start serving in a pre-forked worker (gunicorn post_fork hook)"""
+    if rag_system.state != rag_system.FAILED:
+        threading.Thread(target=rag_system.start_serving, name='rag-start', daemon=True).start()
+
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint or 'unmatched',
+                                        request.method, str(response.status_code))
+    return response
+
+
+def rag_endpoint(fn):
+    """Run ``fn(data)`` on the JSON body once the models are ready; dict results get ``timings``."""
+    @wraps(fn)
+    def wrapper():
+        if not rag_system.is_ready:
+            return jsonify({'error': f"RAG system is {rag_system.state}", 'state': rag_system.state}), 503
+        data = request.get_json(silent=True) or {}
+        try:
+            with metrics.collect() as timings:
+                result = fn(data)
+        except KeyError as e:
+            return jsonify({'error': f"Missing field {e}"}), 400
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except Exception as e:
+            print(f"Error in {fn.__name__}: {str(e)}")
+            traceback.print_exc()
+            return jsonify({'error': str(e)}), 500
+        if isinstance(result, Response):
+            return result
+        result['timings'] = timings
+        return jsonify(result)
+    return wrapper
+
+
+def upload_path(path):
+    """``path`` resolved, if it lies inside the upload folder"""
+    resolved = os.path.realpath(path)
+    if os.path.commonpath([resolved, UPLOAD_FOLDER]) != UPLOAD_FOLDER:
+        raise PermissionError(f"'{path}' is outside the upload folder")
+    return resolved
+
+
+def session_key(data):
+    """The call's session, with the saved uploads it lists indexed in this worker"""
+    key = data.get('session_key')
+    documents = data.get('documents')
+    if documents:
+        rag_system.ensure_documents(key, [(upload_path(path), filename) for path, filename in documents])
+    return key
+
+
+# ------------------- Endpoints -------------------
+
+@app.route('/health')
+def health():
+    status = rag_system.status()
+    status['ready'] = rag_system.is_ready
+    status['embedding_dim'] = rag_system.index.d if rag_system.is_ready else None
+    return jsonify(status)
+
+
+@app.route('/answer', methods=['POST'])
+@rag_endpoint
+def answer(data):
+    return rag_system.answer(data['question'], session_key(data), inline=bool(data.get('inline')))
+
+
+@app.route('/retrieve', methods=['POST'])
+@rag_endpoint
+def retrieve(data):
+    _, contexts = rag_system.retrieve(data['question'], session_key(data))
+    return {'contexts': contexts}
+
+
+@app.route('/stream', methods=['POST'])
+@rag_endpoint
+def stream(data):
+    answer_stream = rag_system.answer_stream(data['question'], session_key(data))
+    result = next(answer_stream)
+    result['timings'] = metrics.request_timings()
+    return Response(stream_with_context(stream_body(result, answer_stream)), mimetype='text/plain; charset=utf-8')
+
+
+def stream_body(result, answer_stream):
+    try:
+        yield json.dumps(result) + '\n'
+        yield from answer_stream
+    finally:
+        # Releases the admission when the web tier hangs up early
+        answer_stream.close()
+
+
+@app.route('/search-documents', methods=['POST'])
+@rag_endpoint
+def search_documents(data):
+    return {'chunks': rag_system.search_documents(data['question'], session_key(data), data.get('top_k'))}
+
+
+@app.route('/embed', methods=['POST'])
+@rag_endpoint
+def embed(data):
+    return {'embedding': rag_system.embed_query(data['question']).tolist()}
+
+
+@app.route('/documents', methods=['POST'])
+@rag_endpoint
+def add_document(data):
+    source = upload_path(data['source']) if data.get('source') else None
+    indexed = rag_system.add_document(data['session_key'], data['filename'], [data['text']], source=source)
+    return {'indexed': indexed}
+
+
+@app.route('/documents/drop', methods=['POST'])
+def drop_documents():
+    data = request.get_json(silent=True) or {}
+    rag_system.session_index.drop(data.get('session_key'))
+    return jsonify({})
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+# ------------------- CLI -------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve RAG retrieval and generation to the web tier.")
+    parser.add_argument('--bind', default=DEFAULT_BIND, help='host:port or unix:/path/to.sock')
+    args = parser.parse_args()
+
+    if args.bind.startswith('unix:'):
+        path = args.bind[len('unix:'):]
+        # A socket left behind by a previous run would make the bind fail
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        run_simple(f"unix://{path}", 0, app, threaded=True)
+    else:
+        host, _, port = args.bind.rpartition(':')
+        run_simple(host or '127.0.0.1', int(port), app, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#metrics.py
+"""Per-stage latency histograms, Prometheus exposition and Server-Timing.
+
+Code on the request path wraps each stage in ``timed`` (or decorates it with
+``timed_function``). A stage's duration goes into the ``medqa_stage_seconds``
+histogram and, when it runs inside a request started with ``begin_request``,
+into that request's breakdown, which ``app.py`` sends back as a
+``Server-Timing`` header. Recording costs two ``perf_counter`` calls and one
+short lock, so it is safe on the hot path.
+
+Work done on other threads (the RAG micro-batcher) does not see the request's
+context; it collects its own breakdown with ``collect`` and hands it back to
+the request with ``add_request_timings``.
+
+``render`` produces the Prometheus text format for the ``/metrics`` endpoint,
+including values from collectors registered with ``register_collector``
+(queue depths, cache hit rates), which are only read at scrape time.
+"""
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds in seconds: sub-millisecond SQLite calls up to minute-long generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+COUNTER, GAUGE = 'counter', 'gauge'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Thread-safe cumulative histogram, one series per combination of label values."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def snapshot(self):
+        """``{label values: (cumulative bucket counts, sum, count)}``."""
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        result = {}
+        for labels, (counts, total) in series.items():
+            cumulative = []
+            running = 0
+            for count in counts:
+                running += count
+                cumulative.append(running)
+            result[labels] = (cumulative, total, running)
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bounds = self.buckets + (math.inf,)
+        for labels, (cumulative, total, count) in sorted(self.snapshot().items()):
+            for bound, value in zip(bounds, cumulative):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {value}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        with self._lock:
+            self._histograms.append(histogram)
+        return histogram
+
+    def register_collector(self, collect):
+        """``collect()`` returns ``[(name, type, help, [(labels dict, value), ...]), ...]``."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            histograms = list(self._histograms)
+            collectors = list(self._collectors)
+        lines = []
+        for histogram in histograms:
+            lines += histogram.render()
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'medqa_stage_seconds', 'Time spent in each stage of request handling.', ('stage', 'operation'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'medqa_http_request_seconds', 'HTTP request latency until the response starts.',
+    ('endpoint', 'method', 'status'))
+
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ------------------- Stage timing -------------------
+
+# Stage -> seconds for the request being handled in this context (None outside requests)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def record(stage, seconds, operation=''):
+    """Record one stage duration in the histogram and the current request's breakdown."""
+    STAGE_SECONDS.observe(seconds, stage, operation)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage, operation=''):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, operation)
+
+
+def timed_function(stage, operation=None):
+    """Decorator form of ``timed``; the operation defaults to the function name."""
+    def decorator(fn):
+        label = operation or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start, label)
+        return wrapper
+    return decorator
+
+
+def timed_iter(stage, iterator, operation=''):
+    """Yield from ``iterator``, recording only the time spent producing items."""
+    elapsed = 0.0
+    iterator = iter(iterator)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        record(stage, elapsed, operation)
+
+
+# ------------------- Request breakdown -------------------
+
+def begin_request():
+    """Start collecting stage timings for the current request; returns a reset token."""
+    return _request_timings.set({})
+
+
+def end_request(token):
+    try:
+        _request_timings.reset(token)
+    except ValueError:  # finished in another context (e.g. after a streamed response)
+        _request_timings.set(None)
+
+
+def request_timings():
+    timings = _request_timings.get()
+    return dict(timings) if timings else {}
+
+
+def add_request_timings(timings):
+    """Merge a breakdown collected elsewhere (e.g. on the batcher thread) into the request's."""
+    current = _request_timings.get()
+    if current is None or not timings:
+        return
+    for stage, seconds in timings.items():
+        current[stage] = current.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def collect():
+    """Collect stage timings of the enclosed block into the dict it yields."""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings, total=None):
+    """``Server-Timing`` value, e.g. ``embed;dur=12.1, faiss;dur=3.4, total;dur=20.0``."""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
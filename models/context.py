@@ -1,11 +1,11 @@
 # context.py
-import sqlite3
 import time
 import os
+import uuid
 from datetime import datetime
 from pathlib import Path
-
-DB_PATH = os.path.join('instance', 'database.db')
+from models.db import connection
+from metrics import timed_function
 
 class ChatContext:
     @staticmethod
@@ -14,219 +14,285 @@ class ChatContext:
         if not os.path.exists('instance'):
             os.makedirs('instance')
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
+            # Workers starting together would race between checking and altering the schema;
+            # take the write lock first so the others wait and then find it up to date
+            cursor.execute('BEGIN IMMEDIATE')
+
+            # Create chat_sessions table if it doesn't exist
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    title TEXT DEFAULT 'New Chat',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )
+            ''')
+
+            # Create chat_messages table if it doesn't exist
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT,
+                    role TEXT,
+                    content TEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    model TEXT,
+                    context_info TEXT,
+                    FOREIGN KEY (session_id) REFERENCES chat_sessions(id)
+                )
+            ''')
+
+            ChatContext._migrate(cursor)
+            conn.commit()
+
+    @staticmethod
+    def _migrate(cursor):
+        """Bring an existing database up to the current schema (idempotent)."""
+        session_columns = {row['name'] for row in cursor.execute('PRAGMA table_info(chat_sessions)')}
+
+        # Denormalized sidebar fields, kept current by the trigger below
+        if 'last_activity' not in session_columns:
+            cursor.execute('ALTER TABLE chat_sessions ADD COLUMN first_user_message TEXT')
+            cursor.execute('ALTER TABLE chat_sessions ADD COLUMN last_message TEXT')
+            cursor.execute('ALTER TABLE chat_sessions ADD COLUMN last_activity TIMESTAMP')
+
+            # Backfill sessions created before these columns existed
+            cursor.execute('''
+                UPDATE chat_sessions SET
+                    first_user_message = (
+                        SELECT content FROM chat_messages
+                        WHERE session_id = chat_sessions.id AND role = 'user'
+                        ORDER BY timestamp ASC, id ASC
+                        LIMIT 1
+                    ),
+                    last_message = (
+                        SELECT content FROM chat_messages
+                        WHERE session_id = chat_sessions.id
+                        ORDER BY timestamp DESC, id DESC
+                        LIMIT 1
+                    ),
+                    last_activity = COALESCE(
+                        (SELECT MAX(timestamp) FROM chat_messages
+                         WHERE session_id = chat_sessions.id),
+                        created_at
+                    )
+            ''')
+
+        message_columns = {row['name'] for row in cursor.execute('PRAGMA table_info(chat_messages)')}
+        if 'decoding_profile' not in message_columns:
+            cursor.execute('ALTER TABLE chat_messages ADD COLUMN decoding_profile TEXT')
 
-        # Create chat_sessions table if it doesn't exist
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_sessions (
-                id TEXT PRIMARY KEY,
-                user_id INTEGER,
-                title TEXT DEFAULT 'New Chat',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_session_timestamp
+            ON chat_messages (session_id, timestamp)
         ''')
-
-        # Create chat_messages table if it doesn't exist
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                role TEXT,
-                content TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                model TEXT,
-                context_info TEXT,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions(id)
-            )
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id
+            ON chat_messages (session_id, id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_created
+            ON chat_sessions (user_id, created_at)
         ''')
 
-        conn.commit()
-        conn.close()
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_chat_messages_session_summary
+            AFTER INSERT ON chat_messages
+            BEGIN
+                UPDATE chat_sessions SET
+                    first_user_message = CASE
+                        WHEN first_user_message IS NULL AND NEW.role = 'user' THEN NEW.content
+                        ELSE first_user_message
+                    END,
+                    last_message = NEW.content,
+                    last_activity = NEW.timestamp
+                WHERE id = NEW.session_id;
+            END
+        ''')
 
     @staticmethod
+    @timed_function('sqlite')
     def create_session(user_id, title="New Chat"):
         """Create a new chat session and return the session ID."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        session_id = f"session_{int(time.time())}_{user_id}"
-        try:
-            cursor.execute(
-                "INSERT INTO chat_sessions (id, user_id, title) VALUES (?, ?, ?)",
-                (session_id, user_id, title)
-            )
-            conn.commit()
-            return session_id
-        except Exception as e:
-            print(f"Error creating session: {e}")
-            raise
-        finally:
-            conn.close()
+        # The random suffix keeps two sessions created in the same second apart
+        session_id = f"session_{int(time.time())}_{user_id}_{uuid.uuid4().hex[:8]}"
+        with connection() as conn:
+            try:
+                conn.execute(
+                    "INSERT INTO chat_sessions (id, user_id, title) VALUES (?, ?, ?)",
+                    (session_id, user_id, title)
+                )
+                conn.commit()
+                return session_id
+            except Exception as e:
+                print(f"Error creating session: {e}")
+                raise
 
     @staticmethod
-    def add_message(session_id, role, content, model=None, context_info=None):
+    @timed_function('sqlite')
+    def add_message(session_id, role, content, model=None, context_info=None, decoding_profile=None):
         """Add a message to a session."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute('''
-                INSERT INTO chat_messages 
-                (session_id, role, content, model, context_info)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session_id, role, content, model, context_info))
-            conn.commit()
-        except Exception as e:
-            print(f"Error adding message: {e}")
-            raise
-        finally:
-            conn.close()
+        with connection() as conn:
+            try:
+                conn.execute('''
+                    INSERT INTO chat_messages
+                    (session_id, role, content, model, context_info, decoding_profile)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (session_id, role, content, model, context_info, decoding_profile))
+                conn.commit()
+            except Exception as e:
+                print(f"Error adding message: {e}")
+                raise
 
     @staticmethod
+    @timed_function('sqlite')
     def get_session_messages(session_id, limit=None):
         """Retrieve all messages in a session."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            if limit:
+                # Get the latest messages but return them in chronological order
+                cursor = conn.execute('''
+                    SELECT * FROM chat_messages
+                    WHERE session_id = ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                ''', (session_id, limit))
+                # Convert to list and reverse to get chronological order
+                messages = [dict(row) for row in cursor.fetchall()]
+                messages.reverse()  # Reverse to maintain chronological order
+            else:
+                cursor = conn.execute('''
+                    SELECT * FROM chat_messages
+                    WHERE session_id = ?
+                    ORDER BY timestamp ASC
+                ''', (session_id,))
+                messages = [dict(row) for row in cursor.fetchall()]
 
-        if limit:
-            # Get the latest messages but return them in chronological order
-            cursor.execute('''
-                SELECT * FROM chat_messages
-                WHERE session_id = ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (session_id, limit))
-            # Convert to list and reverse to get chronological order
-            messages = [dict(row) for row in cursor.fetchall()]
-            messages.reverse()  # Reverse to maintain chronological order
-        else:
-            cursor.execute('''
-                SELECT * FROM chat_messages
-                WHERE session_id = ?
-                ORDER BY timestamp ASC
-            ''', (session_id,))
-            messages = [dict(row) for row in cursor.fetchall()]
-            
-        conn.close()
         return messages
 
     @staticmethod
+    @timed_function('sqlite')
+    def get_session_messages_page(session_id, before_id=None, limit=50):
+        """Retrieve one page of messages older than ``before_id`` (newest page if None).
+
+        Returns ``(messages, has_more)`` with messages in chronological order.
+        """
+        with connection() as conn:
+            if before_id is None:
+                cursor = conn.execute('''
+                    SELECT * FROM chat_messages
+                    WHERE session_id = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (session_id, limit + 1))
+            else:
+                cursor = conn.execute('''
+                    SELECT * FROM chat_messages
+                    WHERE session_id = ? AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (session_id, before_id, limit + 1))
+            messages = [dict(row) for row in cursor.fetchall()]
+
+        # One extra row tells us whether an older page exists
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+        return messages, has_more
+
+    @staticmethod
+    @timed_function('sqlite')
     def get_session_info(session_id):
         """Get information about a session."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            session = conn.execute('''
+                SELECT * FROM chat_sessions
+                WHERE id = ?
+            ''', (session_id,)).fetchone()
 
-        cursor.execute('''
-            SELECT * FROM chat_sessions
-            WHERE id = ?
-        ''', (session_id,))
-        
-        session = cursor.fetchone()
-        conn.close()
-        
         return dict(session) if session else None
 
     @staticmethod
-    def get_user_sessions(user_id):
-        """Get all chat sessions for a user with their title and last message."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT * FROM chat_sessions
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id,))
+    @timed_function('sqlite')
+    def get_user_sessions(user_id, limit=None, offset=0):
+        """Get a page of chat sessions for a user with their title and last message."""
+        with connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, user_id, title, created_at, last_activity,
+                       first_user_message, last_message
+                FROM chat_sessions
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT ? OFFSET ?
+            ''', (user_id, -1 if limit is None else limit, offset))
 
-        sessions = [dict(row) for row in cursor.fetchall()]
+            sessions = [dict(row) for row in cursor.fetchall()]
 
         for session in sessions:
-            # Get the first user message as title if title is default
-            if session.get('title') == 'New Chat':
-                cursor.execute('''
-                    SELECT content FROM chat_messages
-                    WHERE session_id = ? AND role = 'user'
-                    ORDER BY timestamp ASC
-                    LIMIT 1
-                ''', (session['id'],))
-                first_msg = cursor.fetchone()
-                if first_msg:
-                    session['title'] = first_msg['content']
-                    if len(session['title']) > 30:
-                        session['title'] = session['title'][:30] + '...'
-
-            # Get the last message for preview
-            cursor.execute('''
-                SELECT content FROM chat_messages
-                WHERE session_id = ?
-                ORDER BY timestamp DESC
-                LIMIT 1
-            ''', (session['id'],))
-            last_msg = cursor.fetchone()
-            session['last_message'] = last_msg['content'] if last_msg else "No messages yet"
-
-        conn.close()
+            # Use the first user message as title if title is default
+            first_msg = session.pop('first_user_message')
+            if session.get('title') == 'New Chat' and first_msg:
+                session['title'] = first_msg
+                if len(session['title']) > 30:
+                    session['title'] = session['title'][:30] + '...'
+
+            if session['last_message'] is None:
+                session['last_message'] = "No messages yet"
+
         return sessions
 
     @staticmethod
+    @timed_function('sqlite')
     def rename_session(session_id, user_id, new_title):
         """Rename a chat session."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute('''
-                UPDATE chat_sessions 
-                SET title = ?
-                WHERE id = ? AND user_id = ?
-            ''', (new_title, session_id, user_id))
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error renaming session: {e}")
-            return False
-        finally:
-            conn.close()
+        with connection() as conn:
+            try:
+                cursor = conn.execute('''
+                    UPDATE chat_sessions
+                    SET title = ?
+                    WHERE id = ? AND user_id = ?
+                ''', (new_title, session_id, user_id))
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                print(f"Error renaming session: {e}")
+                return False
 
     @staticmethod
+    @timed_function('sqlite')
     def delete_session(session_id, user_id):
         """Delete a chat session and all its messages."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            # Verify the session belongs to the user
-            cursor.execute('''
-                SELECT id FROM chat_sessions
-                WHERE id = ? AND user_id = ?
-            ''', (session_id, user_id))
-            
-            if not cursor.fetchone():
-                conn.close()
-                return False
-                
-            # First delete all messages in the session
-            cursor.execute('''
-                DELETE FROM chat_messages
-                WHERE session_id = ?
-            ''', (session_id,))
+            try:
+                # Verify the session belongs to the user
+                cursor.execute('''
+                    SELECT id FROM chat_sessions
+                    WHERE id = ? AND user_id = ?
+                ''', (session_id, user_id))
 
-            # Then delete the session itself
-            cursor.execute('''
-                DELETE FROM chat_sessions
-                WHERE id = ? AND user_id = ?
-            ''', (session_id, user_id))
+                if not cursor.fetchone():
+                    return False
 
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error deleting session: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
\ No newline at end of file
+                # First delete all messages in the session
+                cursor.execute('''
+                    DELETE FROM chat_messages
+                    WHERE session_id = ?
+                ''', (session_id,))
+
+                # Then delete the session itself
+                cursor.execute('''
+                    DELETE FROM chat_sessions
+                    WHERE id = ? AND user_id = ?
+                ''', (session_id, user_id))
+
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Error deleting session: {e}")
+                conn.rollback()
+                return False
@@ -0,0 +1,121 @@
+#models\db.py
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.path.join('instance', 'database.db')
+
+# Connection tuning (override through environment variables)
+POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '16'))
+BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+STATEMENT_CACHE_SIZE = int(os.getenv('SQLITE_STATEMENT_CACHE_SIZE', '256'))
+
+_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+class ConnectionPool:
+    """A bounded pool of WAL-mode SQLite connections for one database file.
+
+    Each borrowed connection is used by a single thread at a time and goes back
+    to the pool afterwards, so short-lived request threads reuse connections
+    (and their prepared-statement caches) instead of reconnecting.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        synchronous = SYNCHRONOUS if SYNCHRONOUS in _SYNCHRONOUS_MODES else 'NORMAL'
+        conn.execute(f'PRAGMA synchronous={synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn):
+        # Never hand a connection with an open transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=None):
+    """Return the process-wide pool for ``db_path`` (defaults to ``DB_PATH``)."""
+    db_path = db_path or DB_PATH
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        # Connections must not be shared across fork(); start a fresh pool
+        if pool is None or pool._pid != os.getpid():
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+@contextmanager
+def connection(db_path=None):
+    """Borrow a pooled connection; uncommitted work is rolled back on return."""
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+
+def close_all():
+    """Close every idle pooled connection (e.g. before forking workers)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
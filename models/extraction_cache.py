@@ -0,0 +1,148 @@
+#models\extraction_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Cache limits (override through environment variables)
+CACHE_MAX_BYTES = int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+CACHE_MAX_AGE_S = float(os.getenv('EXTRACTION_CACHE_MAX_AGE_S', str(7 * 24 * 3600)))
+# Re-scan the directory at most this often; writes in between are tracked in memory
+SWEEP_INTERVAL_S = 60
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ExtractionCache:
+    """Extracted upload text stored under the SHA-256 of the uploaded bytes.
+
+    ``<digest>.txt`` holds the text and ``<digest>.json`` its metadata (page
+    count, truncation and the limits it was extracted with). A hit bumps the
+    file's mtime, so the sweep evicts least recently used entries first once
+    the directory exceeds ``max_bytes``; entries unused for ``max_age``
+    seconds are removed regardless. Any other ``.txt`` files in the directory
+    (e.g. from before the cache existed) are swept the same way.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_S):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.sweep()
+
+    @staticmethod
+    def digest(file):
+        """SHA-256 hex digest of a file-like object, read in blocks."""
+        sha = hashlib.sha256()
+        file.seek(0)
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b''):
+            sha.update(block)
+        file.seek(0)
+        return sha.hexdigest()
+
+    def text_path(self, digest):
+        return os.path.join(self.directory, f"{digest}.txt")
+
+    def _meta_path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest, limits=None):
+        """Metadata of a cached extraction (with ``path``), or None on a miss.
+
+        A result that was truncated under different ``limits`` counts as a miss.
+        """
+        path = self.text_path(digest)
+        try:
+            with open(self._meta_path(digest), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('truncated') and limits is not None and meta.get('limits') != list(limits):
+                raise FileNotFoundError(path)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        meta['path'] = path
+        return meta
+
+    def put(self, digest, pages=None, truncated=None, limits=None):
+        """Record metadata once ``text_path(digest)`` has been written."""
+        path = self.text_path(digest)
+        meta_path = self._meta_path(digest)
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'pages': pages,
+                'truncated': truncated,
+                'limits': list(limits) if limits is not None else None,
+                'created_at': time.time()
+            }, f)
+        os.replace(tmp_path, meta_path)
+
+        with self._lock:
+            self.size_bytes += os.path.getsize(path) + os.path.getsize(meta_path)
+            due = (self.size_bytes > self.max_bytes
+                   or time.monotonic() - self._last_sweep > SWEEP_INTERVAL_S)
+        if due:
+            self.sweep()
+
+    def sweep(self):
+        """Delete expired entries, then least recently used ones until under ``max_bytes``."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.txt'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                meta_path = entry.path[:-len('.txt')] + '.json'
+                try:
+                    meta_size = os.path.getsize(meta_path)
+                except OSError:
+                    meta_size = 0
+                entries.append((stat.st_mtime, stat.st_size + meta_size, entry.path, meta_path))
+
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+        cutoff = time.time() - self.max_age
+        evicted = 0
+        for mtime, size, path, meta_path in entries:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            for stale in (meta_path, path):  # metadata first so readers miss cleanly
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self.size_bytes = total
+            self.evictions += evicted
+            self._last_sweep = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'size_bytes': self.size_bytes,
+                'max_bytes': self.max_bytes
+            }
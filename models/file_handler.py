@@ -1,5 +1,11 @@
 #model\file_handler.py
 import os
+import shutil
+import tempfile
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import fitz  # PyMuPDF
 from docx import Document
 from pptx import Presentation
@@ -7,9 +13,11 @@ import pytesseract
 from PIL import Image, ImageEnhance, UnidentifiedImageError
 from io import BytesIO
 import magic  # python-magic-bin
-from typing import Optional, Union
+from typing import Iterator, List, Optional, Union
 import logging
 
+from metrics import timed_function, timed_iter
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,20 +26,102 @@ logger = logging.getLogger(__name__)
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'pptx', 'png', 'jpg', 'jpeg'}
 
+# Extraction limits (override through environment variables)
+MAX_UPLOAD_BYTES = int(os.getenv('EXTRACT_MAX_BYTES', str(50 * 1024 * 1024)))
+MAX_PAGES = int(os.getenv('EXTRACT_MAX_PAGES', '500'))
+MAX_CHARS = int(os.getenv('EXTRACT_MAX_CHARS', '1000000'))
+
+# PDFs with at least this many pages are split into page ranges across processes
+PARALLEL_MIN_PAGES = int(os.getenv('EXTRACT_PARALLEL_MIN_PAGES', '64'))
+PAGES_PER_TASK = int(os.getenv('EXTRACT_PAGES_PER_TASK', '32'))
+# 0 disables the process pool; it also needs fork() so workers skip re-importing the app,
+# and is started by start_pdf_pool() before the process starts any threads
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Longest image side handed to Tesseract: about 300 DPI on an A4 page. Larger
+# photos only make OCR slower, so they are downscaled to this first.
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '3500'))
+IMAGE_MIME_TYPES = ('image/png', 'image/jpeg')
+
 # Configure Tesseract path (Windows)
 TESSERACT_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 if os.path.exists(TESSERACT_PATH):
     pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
 
+class FileTooLargeError(ValueError):
+    """The upload exceeds ``MAX_UPLOAD_BYTES`` and was not parsed."""
+
+
 def allowed_file(filename: str) -> bool:
     """Check if the file has an allowed extension."""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _stream_size(file) -> int:
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+def _limit_chars(pieces: Iterator[str], max_chars: int, report: dict) -> Iterator[str]:
+    """Stop the extractor once ``max_chars`` characters have been produced."""
+    remaining = max_chars
+    try:
+        for piece in pieces:
+            if len(piece) >= remaining:
+                report['truncated'] = 'chars'
+                if remaining:
+                    yield piece[:remaining]
+                    remaining = 0
+                return
+            remaining -= len(piece)
+            yield piece
+    finally:
+        # Closing the extractor releases its temp file and cancels pending page ranges
+        pieces.close()
+        report['chars'] = max_chars - remaining
+
 def extract_text_from_file(file: Union[BytesIO, str]) -> Optional[str]:
     """Extract text from supported files with dual detection (MIME + extension)."""
+    text = "\n".join(iter_text_from_file(file))
+    return text or None
+
+def iter_text_from_file(file: Union[BytesIO, str], report: Optional[dict] = None,
+                        max_chars: int = MAX_CHARS) -> Iterator[str]:
+    """Yield the text of a supported file piece by piece (pages, paragraphs, slides).
+
+    Uploads over ``MAX_UPLOAD_BYTES`` raise ``FileTooLargeError`` before any
+    parsing. Page and character limits cut extraction short; ``report`` (if
+    given) receives ``pages``, ``chars`` and ``truncated`` (``None``,
+    ``'pages'`` or ``'chars'``).
+    """
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    
+    report = {} if report is None else report
+    report.update(pages=0, chars=0, truncated=None)
+    if _stream_size(file) > MAX_UPLOAD_BYTES:
+        raise FileTooLargeError(f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit")
+
+    handler = _detect_handler(file)
+    if handler is None:
+        return
+    # Only the time spent extracting is recorded, not the consumer's time between pieces
+    kind = handler.__name__[len('iter_text_from_'):]
+    yield from timed_iter('extract', _limit_chars(handler(file, report), max_chars, report), kind)
+
+def is_image_file(file) -> bool:
+    """True for PNG/JPEG uploads (these are OCR'd through ``models.ocr_queue``)."""
+    try:
+        file.seek(0)
+        file_type = magic.from_buffer(file.read(1024), mime=True)
+        file.seek(0)
+        return file_type in IMAGE_MIME_TYPES
+    except Exception as mime_error:
+        logger.warning(f"MIME detection failed: {mime_error}")
+    filename = getattr(file, 'filename', '') or ''
+    return filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+
+def _detect_handler(file):
+    """Pick a streaming extractor by MIME type, falling back to the extension."""
     try:
         # Primary detection: MIME type
         file.seek(0)
@@ -39,15 +129,14 @@ def extract_text_from_file(file: Union[BytesIO, str]) -> Optional[str]:
         file.seek(0)
         
         handlers = {
-            'application/pdf': extract_text_from_pdf,
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': extract_text_from_docx,
-            'application/vnd.openxmlformats-officedocument.presentationml.presentation': extract_text_from_pptx
+            'application/pdf': iter_text_from_pdf,
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': iter_text_from_docx,
+            'application/vnd.openxmlformats-officedocument.presentationml.presentation': iter_text_from_pptx,
+            **{mime: iter_text_from_image for mime in IMAGE_MIME_TYPES}
         }
         
         if handler := handlers.get(file_type):
-            return handler(file)
-        elif file_type in ('image/png', 'image/jpeg'):
-            return extract_text_from_image(file)
+            return handler
             
     except Exception as mime_error:
         logger.warning(f"MIME detection failed: {mime_error}")
@@ -57,71 +146,198 @@ def extract_text_from_file(file: Union[BytesIO, str]) -> Optional[str]:
         if hasattr(file, 'filename'):
             filename = file.filename.lower()
             ext_handlers = {
-                '.pdf': extract_text_from_pdf,
-                '.docx': extract_text_from_docx,
-                '.pptx': extract_text_from_pptx,
-                '.png': extract_text_from_image,
-                '.jpg': extract_text_from_image,
-                '.jpeg': extract_text_from_image
+                '.pdf': iter_text_from_pdf,
+                '.docx': iter_text_from_docx,
+                '.pptx': iter_text_from_pptx,
+                '.png': iter_text_from_image,
+                '.jpg': iter_text_from_image,
+                '.jpeg': iter_text_from_image
             }
             for ext, handler in ext_handlers.items():
                 if filename.endswith(ext):
-                    return handler(file)
+                    return handler
                     
     except Exception as ext_error:
         logger.error(f"Extension fallback failed: {ext_error}")
     
     return None
 
+# ------------------- PDF -------------------
+
+_pdf_pool = None
+_pdf_pool_pid = None
+
+def start_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """Fork the page-extraction workers now, while this process has no other threads.
+
+    A fork() taken while another thread holds a lock (torch, tokenizers,
+    logging) copies the lock in its held state and can deadlock the child,
+    so the web app calls this at start-up (or in each pre-forked worker)
+    rather than on the first large upload.
+    """
+    global _pdf_pool, _pdf_pool_pid
+    if EXTRACT_WORKERS <= 0 or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    if _pdf_pool is None or _pdf_pool_pid != os.getpid():
+        pool = ProcessPoolExecutor(EXTRACT_WORKERS, mp_context=multiprocessing.get_context('fork'))
+        # A fork-context pool forks all its workers on the first submit
+        pool.submit(int).result()
+        _pdf_pool, _pdf_pool_pid = pool, os.getpid()
+    return _pdf_pool
+
+def _get_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """Process pool for page-parallel PDF extraction, or None where unavailable."""
+    if _pdf_pool is not None and _pdf_pool_pid == os.getpid():
+        return _pdf_pool
+    # Forking lazily is only safe while no other thread is running
+    if threading.active_count() == 1:
+        return start_pdf_pool()
+    return None
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Worker: text of pages ``start``..``stop - 1`` (empty pages included)."""
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+def _spool_to_disk(file) -> str:
+    """Copy an upload to a temp file so PyMuPDF (and pool workers) can open it by path."""
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    with os.fdopen(fd, 'wb') as out:
+        file.seek(0)
+        shutil.copyfileobj(file, out, 1024 * 1024)
+    return path
+
+def iter_text_from_pdf(file: BytesIO, report: Optional[dict] = None,
+                       max_pages: int = MAX_PAGES) -> Iterator[str]:
+    """Yield the text of each non-empty PDF page, in order.
+
+    Large documents are split into page ranges that a process pool extracts
+    in parallel; results are still yielded in page order as soon as each
+    range is ready.
+    """
+    global _pdf_pool
+    report = {} if report is None else report
+    path = _spool_to_disk(file)
+    futures = []
+    try:
+        with fitz.open(path) as doc:
+            page_count = doc.page_count
+            pages = min(page_count, max_pages)
+            if page_count > max_pages:
+                report['truncated'] = 'pages'
+
+            pool = _get_pdf_pool() if pages >= PARALLEL_MIN_PAGES else None
+            if pool is None:
+                for i in range(pages):
+                    text = doc[i].get_text()
+                    report['pages'] = i + 1
+                    if text:
+                        yield text
+                return
+
+        futures = [
+            pool.submit(_extract_page_range, path, start, min(start + PAGES_PER_TASK, pages))
+            for start in range(0, pages, PAGES_PER_TASK)
+        ]
+        for future in futures:
+            texts = future.result()
+            report['pages'] = report.get('pages', 0) + len(texts)
+            for text in texts:
+                if text:
+                    yield text
+    except BrokenProcessPool as e:
+        # A worker died; a threaded process cannot fork a new pool, so it extracts serially from now on
+        _pdf_pool = None
+        logger.error(f"PDF extraction failed: {e}")
+    except Exception as e:
+        logger.error(f"PDF extraction failed: {e}")
+    finally:
+        for future in futures:
+            future.cancel()
+        # Running workers may still have the file open; wait for them before deleting it
+        for future in futures:
+            if not future.cancelled():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        os.remove(path)
+
 def extract_text_from_pdf(file: BytesIO) -> Optional[str]:
     """Extract text from PDF with PyMuPDF."""
+    return "\n".join(iter_text_from_pdf(file)) or None
+
+# ------------------- Office documents -------------------
+
+def iter_text_from_docx(file: BytesIO, report: Optional[dict] = None,
+                        max_pages: int = MAX_PAGES) -> Iterator[str]:
+    """Yield the text of each non-empty DOCX paragraph."""
     try:
         file.seek(0)
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
-            return "\n".join(page.get_text() for page in doc if page.get_text())
+        doc = Document(getattr(file, 'stream', file))
+        for paragraph in doc.paragraphs:
+            if paragraph.text:
+                yield paragraph.text
     except Exception as e:
-        logger.error(f"PDF extraction failed: {e}")
-        return None
+        logger.error(f"DOCX extraction failed: {e}")
 
 def extract_text_from_docx(file: BytesIO) -> Optional[str]:
     """Extract text from DOCX."""
+    return "\n".join(iter_text_from_docx(file)) or None
+
+def iter_text_from_pptx(file: BytesIO, report: Optional[dict] = None,
+                        max_pages: int = MAX_PAGES) -> Iterator[str]:
+    """Yield the text of each non-empty shape, slide by slide (slides count as pages)."""
+    report = {} if report is None else report
     try:
         file.seek(0)
-        doc = Document(BytesIO(file.read()))
-        return "\n".join(p.text for p in doc.paragraphs if p.text)
+        prs = Presentation(getattr(file, 'stream', file))
+        for number, slide in enumerate(prs.slides, start=1):
+            if number > max_pages:
+                report['truncated'] = 'pages'
+                return
+            report['pages'] = number
+            for shape in slide.shapes:
+                if hasattr(shape, "text") and shape.text.strip():
+                    yield shape.text.strip()
     except Exception as e:
-        logger.error(f"DOCX extraction failed: {e}")
-        return None
+        logger.error(f"PPTX extraction failed: {e}")
 
 def extract_text_from_pptx(file: BytesIO) -> Optional[str]:
     """Extract text from PPTX."""
-    try:
-        file.seek(0)
-        prs = Presentation(BytesIO(file.read()))
-        return "\n".join(
-            shape.text.strip()
-            for slide in prs.slides
-            for shape in slide.shapes
-            if hasattr(shape, "text") and shape.text.strip()
-        )
-    except Exception as e:
-        logger.error(f"PPTX extraction failed: {e}")
-        return None
+    return "\n".join(iter_text_from_pptx(file)) or None
+
+# ------------------- Images -------------------
+
+def iter_text_from_image(file: BytesIO, report: Optional[dict] = None,
+                         max_pages: int = MAX_PAGES) -> Iterator[str]:
+    """OCR an image as a single piece of text."""
+    text = extract_text_from_image(file)
+    if text:
+        yield text
+
+def prepare_image_for_ocr(data: bytes, max_side: int = OCR_MAX_SIDE) -> Image.Image:
+    """Decode, downscale and contrast-enhance an image for Tesseract."""
+    img = Image.open(BytesIO(data))
+    # JPEGs can be decoded at a reduced scale directly (never below max_side)
+    img.draft('L', (max_side, max_side))
+    img = img.convert('L')  # Grayscale
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    enhancer = ImageEnhance.Contrast(img)
+    return enhancer.enhance(2.0)  # Increase contrast
+
+@timed_function('ocr', 'tesseract')
+def ocr_image_bytes(data: bytes) -> Optional[str]:
+    """Run Tesseract over an encoded image; raises on unreadable input."""
+    text = pytesseract.image_to_string(prepare_image_for_ocr(data), config='--psm 6')
+    return text.strip() if text else None
 
 def extract_text_from_image(file: BytesIO) -> Optional[str]:
     """Enhanced OCR text extraction with image preprocessing."""
     try:
         file.seek(0)
-        img = Image.open(BytesIO(file.read()))
-        
-        # Preprocessing for better OCR
-        img = img.convert('L')  # Grayscale
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(2.0)  # Increase contrast
-        
-        # OCR with configured Tesseract
-        text = pytesseract.image_to_string(img, config='--psm 6')
-        return text.strip() if text else None
+        return ocr_image_bytes(file.read())
         
     except UnidentifiedImageError:
         logger.error("Invalid image file")
@@ -0,0 +1,137 @@
+#models\ocr_queue.py
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import UnidentifiedImageError
+
+from models.db import DB_PATH, connection
+from models.file_handler import ocr_image_bytes
+
+# Queue tuning (override through environment variables)
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '2'))
+OCR_MAX_PENDING = int(os.getenv('OCR_MAX_PENDING', '32'))
+OCR_JOB_TTL_S = float(os.getenv('OCR_JOB_TTL_S', '600'))
+
+
+class OCRQueueFullError(Exception):
+    """Too many OCR jobs are already queued or running."""
+
+
+class OCRQueue:
+    """Run image OCR off the request thread on a bounded worker pool.
+
+    Each job runs a tesseract subprocess, so worker threads are enough for
+    parallelism and ``workers`` bounds how many run at once. ``submit``
+    returns a job id immediately; ``get`` reports the job's status and result
+    to its owner. Finished jobs are forgotten after ``job_ttl`` seconds.
+
+    Job state is kept in SQLite, so with several web workers the poll can
+    land on any of them; the OCR itself runs in the worker that accepted the
+    upload, and ``max_pending`` bounds that worker's queue.
+    """
+
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+    def __init__(self, workers=OCR_WORKERS, max_pending=OCR_MAX_PENDING, job_ttl=OCR_JOB_TTL_S,
+                 db_path=None):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.job_ttl = job_ttl
+        self.db_path = db_path or DB_PATH
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with connection(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ocr_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    filename TEXT,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            ''')
+            conn.commit()
+
+    def _update(self, job_id, **fields):
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with connection(self.db_path) as conn:
+            conn.execute(f"UPDATE ocr_jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def submit(self, data, owner, filename, on_result=None):
+        """Queue OCR of encoded image bytes and return the job id.
+
+        ``on_result(text)`` runs on the worker once text is extracted; its
+        return value becomes the job's result (``{'content': text}`` by default).
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise OCRQueueFullError("Too many images are waiting for OCR, please try again shortly")
+            self._pending += 1
+        try:
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            with connection(self.db_path) as conn:
+                # Unfinished jobs this old belonged to a worker that has since exited
+                conn.execute('DELETE FROM ocr_jobs WHERE COALESCE(finished_at, created_at) < ?',
+                             (now - self.job_ttl,))
+                conn.execute(
+                    'INSERT INTO ocr_jobs (job_id, owner, filename, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (job_id, owner, filename, self.QUEUED, now)
+                )
+                conn.commit()
+            self._executor.submit(self._run, job_id, data, on_result)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id, data, on_result):
+        try:
+            self._update(job_id, status=self.RUNNING)
+            text = ocr_image_bytes(data)
+            if not text:
+                raise ValueError('Could not extract text from file')
+            result = on_result(text) if on_result else {'content': text}
+            self._update(job_id, status=self.DONE, result=json.dumps(result), finished_at=time.time())
+        except UnidentifiedImageError:
+            self._update(job_id, status=self.FAILED, error='Invalid image file', finished_at=time.time())
+        except Exception as e:
+            print(f"OCR job {job_id} failed: {str(e)}")
+            self._update(job_id, status=self.FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id, owner):
+        """Status (and result or error) of a job, or None if unknown to ``owner``."""
+        with connection(self.db_path) as conn:
+            job = conn.execute('SELECT * FROM ocr_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if job is None or job['owner'] != owner:
+            return None
+        response = {'job_id': job_id, 'status': job['status'], 'filename': job['filename']}
+        if job['status'] == self.DONE:
+            response.update(json.loads(job['result']))
+        elif job['status'] == self.FAILED:
+            response['error'] = job['error']
+        return response
+
+    def status(self):
+        with self._lock:
+            return {'workers': self.workers, 'pending': self._pending, 'max_pending': self.max_pending}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,140 @@
+#onnx_backend.py
+"""Alternative CPU inference backends for the RAG generator and embedder.
+
+``RAG_GENERATOR_BACKEND`` selects how the fine-tuned T5 runs:
+
+    torch       fp32 PyTorch (default)
+    torch-int8  PyTorch with dynamic int8 quantisation of Linear layers
+    onnx        ONNX Runtime, encoder + decoder with cached past key/values
+    onnx-int8   ONNX Runtime with dynamically int8-quantised graphs
+
+The ONNX variants need ``optimum[onnxruntime]``. The model is exported on first
+use into ``<model_path>-onnx`` (``-onnx-int8`` when quantised) and reused after
+that, or ahead of time with::
+
+    python onnx_backend.py ai_integration/t5-small-pubmedqa [--int8]
+
+``RAG_QUANTIZE_EMBEDDER=1`` applies dynamic int8 quantisation to the
+SentenceTransformer as well.
+
+ONNX Runtime starts its intra-op thread pool when a session is created, and
+threads do not survive a fork, so a pre-forking master only loads the
+tokenizer (``load_onnx_tokenizer``) and every worker creates its own session.
+"""
+import os
+import sys
+
+import torch
+
+GENERATOR_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+GENERATOR_BACKEND = os.getenv('RAG_GENERATOR_BACKEND', 'torch')
+QUANTIZE_EMBEDDER = os.getenv('RAG_QUANTIZE_EMBEDDER', '0') == '1'
+
+# File names written by optimum's seq2seq export
+ONNX_FILES = ('encoder_model.onnx', 'decoder_model.onnx', 'decoder_with_past_model.onnx')
+
+
+def quantize_dynamic_int8(model):
+    """Replace ``nn.Linear`` layers with dynamically quantised int8 versions."""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _require_optimum():
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    except ImportError as e:
+        raise ImportError(
+            "The ONNX backend needs optimum with ONNX Runtime: pip install 'optimum[onnxruntime]'"
+        ) from e
+    return ORTModelForSeq2SeqLM, ORTQuantizer, AutoQuantizationConfig
+
+
+def onnx_export_dir(model_path, quantized=False):
+    return f"{model_path.rstrip('/')}-onnx" + ("-int8" if quantized else "")
+
+
+def export_onnx(model_path, output_dir=None):
+    """Export the fine-tuned T5 encoder and decoders (with past) to ONNX."""
+    ORTModelForSeq2SeqLM, _, _ = _require_optimum()
+    from transformers import T5Tokenizer
+
+    output_dir = output_dir or onnx_export_dir(model_path)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_path, export=True, use_cache=True)
+    model.save_pretrained(output_dir)
+    T5Tokenizer.from_pretrained(model_path).save_pretrained(output_dir)
+    return output_dir
+
+
+def quantize_onnx(export_dir, output_dir):
+    """Dynamically quantise every exported graph to int8 weights."""
+    _, ORTQuantizer, AutoQuantizationConfig = _require_optimum()
+    from transformers import T5Tokenizer
+
+    config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    for file_name in ONNX_FILES:
+        quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=file_name)
+        quantizer.quantize(save_dir=output_dir, quantization_config=config)
+    T5Tokenizer.from_pretrained(export_dir).save_pretrained(output_dir)
+    return output_dir
+
+
+def _onnx_files(quantized):
+    if not quantized:
+        return list(ONNX_FILES)
+    return [name.replace('.onnx', '_quantized.onnx') for name in ONNX_FILES]
+
+
+def load_onnx_generator(model_path, quantized=False):
+    """Load (exporting on first use) the ONNX Runtime T5 model and its tokenizer."""
+    ORTModelForSeq2SeqLM, _, _ = _require_optimum()
+    from transformers import T5Tokenizer
+
+    export_dir = onnx_export_dir(model_path)
+    if not os.path.exists(os.path.join(export_dir, ONNX_FILES[0])):
+        export_onnx(model_path, export_dir)
+
+    if not quantized:
+        model = ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+        return model, T5Tokenizer.from_pretrained(export_dir)
+
+    quant_dir = onnx_export_dir(model_path, quantized=True)
+    quant_files = _onnx_files(quantized=True)
+    if not os.path.exists(os.path.join(quant_dir, quant_files[0])):
+        quantize_onnx(export_dir, quant_dir)
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(
+        quant_dir,
+        encoder_file_name=quant_files[0],
+        decoder_file_name=quant_files[1],
+        decoder_with_past_file_name=quant_files[2],
+        use_cache=True
+    )
+    return model, T5Tokenizer.from_pretrained(quant_dir)
+
+
+def load_onnx_tokenizer(model_path, quantized=False):
+    """Tokenizer of an exported model, without creating an ONNX Runtime session.
+
+    Exporting runs the model, so in a pre-forking master the graphs must
+    already exist; this raises ``FileNotFoundError`` otherwise.
+    """
+    from transformers import T5Tokenizer
+
+    model_dir = onnx_export_dir(model_path, quantized)
+    if not os.path.exists(os.path.join(model_dir, _onnx_files(quantized)[0])):
+        raise FileNotFoundError(
+            f"No ONNX export in {model_dir}; run "
+            f"'python onnx_backend.py {model_path}{' --int8' if quantized else ''}' before starting the workers"
+        )
+    return T5Tokenizer.from_pretrained(model_dir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[2:] not in ([], ["--int8"]):
+        print("Usage: python onnx_backend.py <model_path> [--int8]")
+        sys.exit(1)
+
+    quantized = sys.argv[2:] == ["--int8"]
+    load_onnx_generator(sys.argv[1], quantized)
+    print(f"ONNX model written to {onnx_export_dir(sys.argv[1], quantized)}")
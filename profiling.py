@@ -0,0 +1,298 @@
+#profiling.py
+"""On-demand request profiling and a low-rate continuous sampler.
+
+Two ways to profile one request (see ``profile_request``):
+
+    sample    a background thread snapshots the request thread's Python stack
+              every ``PROFILE_INTERVAL_MS``; the result is stored as collapsed
+              stacks (``frame;frame;frame count`` lines), the input format of
+              flamegraph.pl, speedscope and inferno
+    cprofile  deterministic cProfile with exact call counts, stored as a
+              ``.pstats`` file (snakeviz, gprof2dot, flameprof); slower, and it
+              distorts very hot small functions
+
+Both store a summary with the top functions by self and total time under
+``PROFILE_DIR``; only the newest ``PROFILE_MAX_STORED`` profiles are kept.
+
+``ContinuousProfiler`` samples every thread at ``PROFILE_CONTINUOUS_HZ``
+(off by default) and aggregates collapsed stacks under the endpoint each
+thread is serving, for an always-on, low-overhead view of where time goes.
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('instance', 'profiles'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '1'))
+PROFILE_MAX_STORED = int(os.getenv('PROFILE_MAX_STORED', '50'))
+PROFILE_CONTINUOUS_HZ = float(os.getenv('PROFILE_CONTINUOUS_HZ', '0'))
+# Distinct stacks kept by the continuous sampler; further new stacks are counted as dropped
+CONTINUOUS_MAX_STACKS = 20000
+MAX_STACK_DEPTH = 128
+HOT_SPOTS = 25
+
+MODES = ('sample', 'cprofile')
+
+
+def _frame_name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    # Collapsed-stack lines use ';' between frames and ' ' before the count
+    name = getattr(code, 'co_qualname', code.co_name)  # Python 3.11+: includes the class
+    return f"{module}.{name}".replace(';', ':').replace(' ', '_')
+
+
+def collapse(frame, max_depth=MAX_STACK_DEPTH):
+    """A frame's call stack as ``root;...;leaf``."""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def hot_spots(stacks, interval, top=HOT_SPOTS):
+    """Functions with the most self and total samples in a collapsed-stack Counter."""
+    self_samples = Counter()
+    total_samples = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        self_samples[frames[-1]] += count
+        for name in set(frames):
+            total_samples[name] += count
+    return [
+        {'function': name, 'self_ms': round(self_samples[name] * interval * 1000, 1),
+         'total_ms': round(total * interval * 1000, 1)}
+        for name, total in sorted(total_samples.items(), key=lambda item: (-self_samples[item[0]], -item[1]))[:top]
+    ]
+
+
+def cprofile_hot_spots(profiler, top=HOT_SPOTS):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, self_time, total_time, _) in stats.stats.items():
+        module = os.path.splitext(os.path.basename(filename))[0]
+        # '~' marks builtins
+        rows.append({'function': name if filename == '~' else f"{module}.{name}", 'calls': calls,
+                     'self_ms': round(self_time * 1000, 1), 'total_ms': round(total_time * 1000, 1)})
+    rows.sort(key=lambda row: -row['self_ms'])
+    return rows[:top]
+
+
+# ------------------- Sampling -------------------
+
+class SamplingProfiler:
+    """Collect collapsed stacks of selected threads from a background thread.
+
+    ``thread_ids`` fixes the threads to sample; otherwise ``label_for(thread_id)``
+    decides per thread (None skips it) and its value becomes the root frame.
+    """
+
+    def __init__(self, interval, thread_ids=None, label_for=None, max_stacks=None):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.label_for = label_for
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(exclude=own)
+
+    def sample(self, exclude=None):
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, frame in frames.items():
+                if thread_id == exclude:
+                    continue
+                if self.thread_ids is not None:
+                    if thread_id not in self.thread_ids:
+                        continue
+                    stack = collapse(frame)
+                else:
+                    label = self.label_for(thread_id) if self.label_for else 'all'
+                    if label is None:
+                        continue
+                    stack = f"{label};{collapse(frame)}"
+                if self.max_stacks is not None and stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    self.dropped += 1
+                    continue
+                self.stacks[stack] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def reset(self):
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+            self.dropped = 0
+
+
+class ContinuousProfiler:
+    """Process-wide low-rate sampler; stacks are grouped under each thread's current endpoint."""
+
+    def __init__(self, hz=PROFILE_CONTINUOUS_HZ):
+        self.hz = hz
+        self.started_at = None
+        self._labels = {}  # thread id -> endpoint being served
+        self._sampler = None
+
+    @property
+    def enabled(self):
+        return self._sampler is not None
+
+    def start(self):
+        if self.hz > 0 and self._sampler is None:
+            self._sampler = SamplingProfiler(1.0 / self.hz, label_for=self._labels.get,
+                                             max_stacks=CONTINUOUS_MAX_STACKS).start()
+            self.started_at = time.time()
+        return self
+
+    def enter(self, label):
+        """Mark the calling thread as serving ``label`` until ``leave``."""
+        if self._sampler is not None:
+            self._labels[threading.get_ident()] = label
+
+    def leave(self):
+        self._labels.pop(threading.get_ident(), None)
+
+    def snapshot(self, reset=False):
+        if self._sampler is None:
+            return None
+        text = self._sampler.collapsed()
+        info = {'since': self.started_at, 'samples': self._sampler.samples, 'dropped': self._sampler.dropped}
+        if reset:
+            self._sampler.reset()
+            self.started_at = time.time()
+        return text, info
+
+
+# ------------------- Stored profiles -------------------
+
+class ProfileStore:
+    """Profiles on disk: ``<id>.json`` summary plus ``<id>.collapsed`` or ``<id>.pstats``."""
+
+    def __init__(self, directory=PROFILE_DIR, max_profiles=PROFILE_MAX_STORED):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def path(self, profile_id, extension):
+        if not all(c in '0123456789abcdef' for c in profile_id):
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(self, summary, collapsed=None, profiler=None):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = summary['id']
+        if collapsed is not None:
+            with open(self.path(profile_id, 'collapsed'), 'w', encoding='utf-8') as f:
+                f.write(collapsed)
+        if profiler is not None:
+            profiler.dump_stats(self.path(profile_id, 'pstats'))
+        with open(self.path(profile_id, 'json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            summaries = sorted(
+                (os.path.getmtime(os.path.join(self.directory, name)), name[:-len('.json')])
+                for name in os.listdir(self.directory) if name.endswith('.json')
+            )
+            for _, profile_id in summaries[:max(0, len(summaries) - self.max_profiles)]:
+                for extension in ('json', 'collapsed', 'pstats'):
+                    try:
+                        os.remove(self.path(profile_id, extension))
+                    except OSError:
+                        pass
+
+    def get(self, profile_id):
+        try:
+            with open(self.path(profile_id, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        summaries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                summary = self.get(name[:-len('.json')])
+                if summary is not None:
+                    summary.pop('hot_spots', None)
+                    summaries.append(summary)
+        return sorted(summaries, key=lambda summary: summary['started_at'], reverse=True)
+
+
+class ProfileRun:
+    def __init__(self, mode, label):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.label = label
+        self.summary = None
+
+
+@contextmanager
+def profile_request(store, mode, label, interval_ms=PROFILE_INTERVAL_MS, **details):
+    """Profile the enclosed block (run on the calling thread) and save it to ``store``."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode '{mode}', expected one of {MODES}")
+    run = ProfileRun(mode, label)
+    started_at = time.time()
+    start = time.perf_counter()
+    if mode == 'sample':
+        profiler = SamplingProfiler(interval_ms / 1000.0, thread_ids=[threading.get_ident()]).start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield run
+    finally:
+        if mode == 'sample':
+            profiler.stop()
+        else:
+            profiler.disable()
+        run.summary = {
+            'id': run.id,
+            'mode': mode,
+            'label': label,
+            'started_at': started_at,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+            **details,
+        }
+        if mode == 'sample':
+            run.summary.update(samples=profiler.samples, interval_ms=interval_ms,
+                               hot_spots=hot_spots(profiler.stacks, profiler.interval))
+            store.save(run.summary, collapsed=profiler.collapsed())
+        else:
+            run.summary['hot_spots'] = cprofile_hot_spots(profiler)
+            store.save(run.summary, profiler=profiler)
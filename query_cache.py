@@ -0,0 +1,289 @@
+#query_cache.py
+"""Cache of query embeddings and retrieval hits, keyed on normalized query text.
+
+Most RAG traffic repeats a few hundred common questions, and each repeat would
+otherwise pay for an embedding forward pass, a FAISS search and a BM25
+search. ``QueryCache`` keeps, per normalized query, retrieval mode and depth:
+
+    embedding   the L2-normalized query vector (still needed to search the
+                session's uploaded documents, which are never cached)
+    ids/scores  the dense top-``depth`` passage ids and similarity scores
+    lexical     the BM25 top-``depth`` ids and scores (hybrid/bm25 modes)
+
+Two tiers: an in-process LRU of ``RAG_QUERY_CACHE_SIZE`` entries, and when
+``RAG_QUERY_CACHE_DB`` is set, a SQLite table shared by every worker on the
+host that survives restarts. Entries carry a version derived from the index,
+context store and BM25 files and the embedding/search settings
+(``retrieval_version``); rows of any other version are ignored, so
+rebuilding an index invalidates the cache without manual steps. Other
+versions may still be in use by sibling processes (another tier, or workers
+not yet restarted onto the new index), so their rows are not deleted on
+sight: the row bound evicts least recently used rows first, and rows unused
+for ``RAG_QUERY_CACHE_STALE_S`` are dropped whenever a cache opens the table.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# In-process entries (0 disables the cache)
+QUERY_CACHE_SIZE = int(os.getenv('RAG_QUERY_CACHE_SIZE', '4096'))
+# Shared SQLite tier; in-process only when unset
+QUERY_CACHE_DB = os.getenv('RAG_QUERY_CACHE_DB') or None
+QUERY_CACHE_DB_ROWS = int(os.getenv('RAG_QUERY_CACHE_DB_ROWS', '100000'))
+# Rows of other versions unused for this long are deleted when a cache opens the table
+QUERY_CACHE_STALE_S = float(os.getenv('RAG_QUERY_CACHE_STALE_S', '86400'))
+# Check the SQLite row count after this many inserts
+PRUNE_EVERY = 256
+
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_query(text):
+    """Case, Unicode form, whitespace and trailing punctuation do not change the cache key."""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _SPACE.sub(' ', text).strip().rstrip('?!. ')
+
+
+def retrieval_version(paths, *settings):
+    """Short hash of the files retrieval reads (path, size, mtime) and the settings that shape results."""
+    sha = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # optional files (e.g. no BM25 index) only count when present
+        sha.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    for setting in settings:
+        sha.update(f"{setting};".encode())
+    return sha.hexdigest()[:16]
+
+
+class CachedRetrieval:
+    """Retrieval result of one query before passages are looked up."""
+
+    __slots__ = ('embedding', 'ids', 'scores', 'lexical')
+
+    def __init__(self, embedding, ids, scores, lexical=None):
+        self.embedding = embedding
+        self.ids = ids
+        self.scores = scores
+        self.lexical = lexical  # (ids, scores) from BM25, or None in dense mode
+
+
+class QueryCache:
+    """Two-tier LRU of ``CachedRetrieval`` entries, see the module docstring."""
+
+    def __init__(self, version, max_entries=QUERY_CACHE_SIZE, db_path=QUERY_CACHE_DB,
+                 max_rows=QUERY_CACHE_DB_ROWS):
+        self.version = version
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._inserts = 0
+        if db_path:
+            self._open_db()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(query, mode, depth):
+        return f"{mode}:{depth}:{normalize_query(query)}"
+
+    # ------------------- Lookups -------------------
+
+    def get_many(self, keys):
+        """Cached entries for ``keys``, None where neither tier has one."""
+        if not self.enabled:
+            return [None] * len(keys)
+        found = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    found[i] = entry
+            self.hits += len(keys) - len(missing)
+
+        if missing and self._db is not None:
+            loaded = self._db_get([keys[i] for i in missing])
+            still_missing = []
+            for i in missing:
+                entry = loaded.get(keys[i])
+                if entry is None:
+                    still_missing.append(i)
+                else:
+                    found[i] = entry
+            with self._lock:
+                for key, entry in loaded.items():
+                    self._remember(key, entry)
+                self.db_hits += len(missing) - len(still_missing)
+            missing = still_missing
+
+        with self._lock:
+            self.misses += len(missing)
+        return found
+
+    def put_many(self, items):
+        """Store ``(key, CachedRetrieval)`` pairs in both tiers."""
+        if not self.enabled or not items:
+            return
+        with self._lock:
+            for key, entry in items:
+                self._remember(key, entry)
+        if self._db is not None:
+            self._db_put(items)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.db_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.db_hits) / lookups, 4) if lookups else None,
+                'version': self.version,
+                'shared': self._db is not None,
+            }
+
+    def metric_families(self):
+        stats = self.stats()
+        return [
+            ('medqa_query_cache_lookups_total', metrics.COUNTER, 'Retrieval cache lookups by result.',
+             [({'result': 'hit'}, stats['hits']), ({'result': 'shared_hit'}, stats['db_hits']),
+              ({'result': 'miss'}, stats['misses'])]),
+            ('medqa_query_cache_hit_ratio', metrics.GAUGE, 'Retrieval cache hits (either tier) per lookup.',
+             [({}, stats['hit_ratio'])]),
+            ('medqa_query_cache_entries', metrics.GAUGE, 'Retrieval results held in memory.',
+             [({}, stats['entries'])]),
+        ]
+
+    # ------------------- SQLite tier -------------------
+
+    def _open_db(self):
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    version TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    ids BLOB NOT NULL,
+                    scores BLOB NOT NULL,
+                    lexical_ids BLOB,
+                    lexical_scores BLOB,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (version, key)
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_query_cache_used ON query_cache(used_at)')
+            # Other versions' rows may belong to a sibling process; only drop those it stopped using
+            db.execute('DELETE FROM query_cache WHERE version != ? AND used_at < ?',
+                       (self.version, time.time() - QUERY_CACHE_STALE_S))
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            print(f"Query cache database unavailable, using memory only: {e}")
+
+    def _db_get(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        try:
+            with self._db_lock:
+                rows = self._db.execute(
+                    f'SELECT key, embedding, ids, scores, lexical_ids, lexical_scores FROM query_cache '
+                    f'WHERE version = ? AND key IN ({placeholders})', [self.version, *keys]).fetchall()
+                if rows:
+                    self._db.execute(
+                        f'UPDATE query_cache SET used_at = ? WHERE version = ? AND key IN ({placeholders})',
+                        [time.time(), self.version, *[row[0] for row in rows]])
+                    self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Query cache read failed: {e}")
+            return {}
+        return {row[0]: self._decode(row[1:]) for row in rows}
+
+    def _db_put(self, items):
+        now = time.time()
+        rows = [(self.version, key, *self._encode(entry), now) for key, entry in items]
+        try:
+            with self._db_lock:
+                self._db.executemany('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self._db.commit()
+                self._inserts += len(rows)
+                if self._inserts >= PRUNE_EVERY:
+                    self._inserts = 0
+                    self._prune()
+        except sqlite3.Error as e:
+            print(f"Query cache write failed: {e}")
+
+    def _prune(self):
+        """Drop least recently used rows beyond ``max_rows`` (caller holds ``_db_lock``)."""
+        count = self._db.execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+        if count > self.max_rows:
+            self._db.execute(
+                'DELETE FROM query_cache WHERE rowid IN '
+                '(SELECT rowid FROM query_cache ORDER BY used_at LIMIT ?)', (count - self.max_rows,))
+            self._db.commit()
+
+    @staticmethod
+    def _encode(entry):
+        lexical_ids = lexical_scores = None
+        if entry.lexical is not None:
+            lexical_ids = np.asarray(entry.lexical[0], dtype=np.int64).tobytes()
+            lexical_scores = np.asarray(entry.lexical[1], dtype=np.float32).tobytes()
+        return (np.asarray(entry.embedding, dtype=np.float32).tobytes(),
+                np.asarray(entry.ids, dtype=np.int64).tobytes(),
+                np.asarray(entry.scores, dtype=np.float32).tobytes(),
+                lexical_ids, lexical_scores)
+
+    @staticmethod
+    def _decode(row):
+        embedding, ids, scores, lexical_ids, lexical_scores = row
+        lexical = None
+        if lexical_ids is not None:
+            lexical = (np.frombuffer(lexical_ids, dtype=np.int64), np.frombuffer(lexical_scores, dtype=np.float32))
+        return CachedRetrieval(np.frombuffer(embedding, dtype=np.float32),
+                               np.frombuffer(ids, dtype=np.int64),
+                               np.frombuffer(scores, dtype=np.float32), lexical)
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
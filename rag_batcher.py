@@ -0,0 +1,115 @@
+#rag_batcher.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# ------------------- Batching Configuration -------------------
+
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv('RAG_BATCH_MAX_SIZE', '8'))
+DEFAULT_MAX_WAIT_MS = float(os.getenv('RAG_BATCH_MAX_WAIT_MS', '10'))
+
+
+# ------------------- Micro-batching Scheduler -------------------
+
+class RAGBatcher:
+    """Collect concurrent RAG questions into small batches.
+
+    ``batch_fn`` receives a list of submitted items (plain questions, or
+    whatever the caller enqueues) and must return one result per item in the
+    same order (see ``rag_qa.rag_pipeline_batch``). Callers block in
+    ``submit`` until their own result is ready.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start the background worker thread (idempotent)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='rag-batcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the worker after the batch currently being processed."""
+        self._stopped.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def queue_depth(self):
+        """Number of questions waiting to be picked up by the worker."""
+        return self._queue.qsize()
+
+    def submit_async(self, question):
+        """Enqueue a question and return a ``Future`` for its result."""
+        future = Future()
+        self._queue.put((question, future))
+        return future
+
+    def submit(self, question, timeout=None):
+        """Enqueue a question and wait for its result."""
+        return self.submit_async(question).result(timeout=timeout)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect_batch()
+            # Skip callers that gave up (cancelled) before the batch started
+            batch = [(question, future) for question, future in batch
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            questions = [question for question, _ in batch]
+            try:
+                results = self.batch_fn(questions)
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"batch_fn returned {len(results)} results for {len(batch)} questions"
+                    )
+            except Exception as e:
+                print(f"Error in RAG batch of {len(batch)}: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+        # Fail anything still queued so callers do not wait forever
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("RAG batcher stopped"))
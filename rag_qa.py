@@ -1,75 +1,403 @@
 #rag_qa.py
+import os
+
 import faiss
-import pickle
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+import numpy as np
+import torch
+from queue import Empty
+from threading import Event, Thread
+from transformers import (
+    StoppingCriteria,
+    StoppingCriteriaList,
+    T5ForConditionalGeneration,
+    T5Tokenizer,
+    TextIteratorStreamer,
+)
 from sentence_transformers import SentenceTransformer
+from context_store import load_context_map
+from ann_index import load_index, similarity_scores
+from decoding import DEFAULT_PROFILE, generation_kwargs
+from metrics import timed
+from onnx_backend import (
+    GENERATOR_BACKEND,
+    GENERATOR_BACKENDS,
+    QUANTIZE_EMBEDDER,
+    load_onnx_generator,
+    quantize_dynamic_int8,
+)
+from token_store import encode_passage
+from bm25_index import reciprocal_rank_fusion
+from query_cache import CachedRetrieval
+
+# T5 was fine-tuned on inputs truncated to this many tokens
+MAX_INPUT_LENGTH = 512
+
+# 'hybrid' fuses dense and BM25 rankings when a BM25 index is loaded; 'dense' or 'bm25' use one of them
+RETRIEVAL_MODE = os.getenv('RAG_RETRIEVAL_MODE', 'hybrid')
+RETRIEVAL_MODES = ('dense', 'hybrid', 'bm25')
+# Candidates taken from each ranking before fusion
+FUSION_DEPTH = int(os.getenv('RAG_FUSION_DEPTH', '20'))
+# Sentence-transformers model name or local directory
+EMBEDDING_MODEL = os.getenv('RAG_EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+# Longest wait for the next streamed piece before giving up on generation
+STREAM_TIMEOUT_S = float(os.getenv('RAG_STREAM_TIMEOUT_S', '60'))
 
 # ------------------- Load RAG System Components -------------------
 
-def load_rag_system(model_path, index_path, context_map_path):
-    """Load the saved RAG system components."""
+def load_generator(model_path, backend=GENERATOR_BACKEND):
+    """Load the fine-tuned T5 model and its tokenizer on the selected backend."""
+    if backend not in GENERATOR_BACKENDS:
+        raise ValueError(f"Unknown generator backend '{backend}', expected one of {GENERATOR_BACKENDS}")
+
+    if backend.startswith('onnx'):
+        return load_onnx_generator(model_path, quantized=backend == 'onnx-int8')
+
     tokenizer = T5Tokenizer.from_pretrained(model_path)
     model = T5ForConditionalGeneration.from_pretrained(model_path)
     model.eval()
-    
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    index = faiss.read_index(index_path)
-    
-    with open(context_map_path, 'rb') as f:
-        context_map = pickle.load(f)
-        
+    if backend == 'torch-int8':
+        model = quantize_dynamic_int8(model)
+    return model, tokenizer
+
+
+def load_embedding_model(quantize=QUANTIZE_EMBEDDER):
+    """Load the sentence embedding model used for retrieval."""
+    embedding_model = SentenceTransformer(EMBEDDING_MODEL, device='cpu' if quantize else None)
+    if quantize:
+        embedding_model = quantize_dynamic_int8(embedding_model)
+    return embedding_model
+
+
+def load_rag_system(model_path, index_path, context_map_path, backend=GENERATOR_BACKEND):
+    """Load the saved RAG system components."""
+    model, tokenizer = load_generator(model_path, backend)
+
+    embedding_model = load_embedding_model()
+    # Search knobs (nprobe / efSearch) come from the environment
+    index = load_index(index_path)
+
+    # mmap-backed store when available, legacy pickle otherwise
+    context_map = load_context_map(context_map_path, index.ntotal)
+
     return model, tokenizer, embedding_model, index, context_map
 
 
 # ------------------- RAG Core Functions -------------------
 
-def retrieve_context(query, embedding_model, index, context_map, top_k=3):
+def retrieve_context(query, embedding_model, index, context_map, top_k=3,
+                     session_index=None, session_key=None, lexical_index=None, query_cache=None):
     """Retrieve the most relevant contexts for a given query."""
-    query_embedding = embedding_model.encode([query])
-    faiss.normalize_L2(query_embedding)
-    distances, indices = index.search(query_embedding, top_k)
-    
-    retrieved_contexts = []
-    retrieved_info = []
-    
-    for idx in indices[0]:
-        idx = int(idx)
-        context = context_map[idx]["context"]
-        retrieved_contexts.append(context)
-        retrieved_info.append({
-            "context": context,
-            "original_question": context_map[idx]["question"],
-            "original_answer": context_map[idx]["answer"],
-            "similarity_score": float(1 - distances[0][list(indices[0]).index(idx)])
-        })
-    
-    return retrieved_contexts, retrieved_info
-
-
-def generate_answer(question, contexts, model, tokenizer):
+    return retrieve_context_batch([query], embedding_model, index, context_map, top_k,
+                                  session_index, [session_key], lexical_index, query_cache)[0]
+
+
+def _passage_info(context_map, idx, similarity_score):
+    row = context_map[int(idx)]
+    return {
+        "context": row["context"],
+        "context_id": int(idx),
+        "source": "pubmedqa",
+        "original_question": row["question"],
+        "original_answer": row["answer"],
+        "similarity_score": similarity_score
+    }
+
+
+def retrieve_context_batch(queries, embedding_model, index, context_map, top_k=3,
+                           session_index=None, session_keys=None, lexical_index=None, query_cache=None):
+    """Retrieve contexts for several queries with one encode and one index search.
+
+    With a ``session_index`` (see ``session_index.SessionDocumentIndex``),
+    chunks of the documents uploaded to ``session_keys[i]`` compete with the
+    PubMedQA passages for query ``i`` on cosine similarity.
+
+    With a ``lexical_index`` (see ``bm25_index.BM25Index``) and the ``hybrid``
+    retrieval mode, the top ``FUSION_DEPTH`` dense and BM25 candidates are
+    merged with reciprocal-rank fusion; passages found only by BM25 carry a
+    ``similarity_score`` of None.
+
+    With a ``query_cache`` (see ``query_cache.QueryCache``), queries seen
+    before skip the embedding model and both index searches; only the
+    uploaded-document search, which changes per session, always runs.
+
+    Returns a list with one ``(retrieved_contexts, retrieved_info)`` pair per query.
+    """
+    mode = RETRIEVAL_MODE if lexical_index is not None else 'dense'
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+    depth = top_k if mode == 'dense' else max(top_k, FUSION_DEPTH)
+
+    if query_cache is not None:
+        keys = [query_cache.key(query, mode, depth) for query in queries]
+        with timed('query_cache', 'get'):
+            cached = query_cache.get_many(keys)
+    else:
+        cached = [None] * len(queries)
+    missing = [i for i, entry in enumerate(cached) if entry is None]
+    if missing:
+        computed = _search_uncached([queries[i] for i in missing], embedding_model, index,
+                                    lexical_index, mode, depth)
+        for i, entry in zip(missing, computed):
+            cached[i] = entry
+        if query_cache is not None:
+            query_cache.put_many([(keys[i], cached[i]) for i in missing])
+    query_embeddings = np.stack([entry.embedding for entry in cached])
+
+    if session_index is not None and session_keys is not None:
+        with timed('uploads', 'search'):
+            uploaded = session_index.search(session_keys, query_embeddings, depth)
+    else:
+        uploaded = [[] for _ in queries]
+
+    results = []
+    for entry, row_uploaded in zip(cached, uploaded):
+        retrieved_info = []
+
+        for score, idx in zip(entry.scores, entry.ids):
+            if idx < 0:  # approximate indices may return fewer than top_k hits
+                continue
+            retrieved_info.append(_passage_info(context_map, idx, float(score)))
+
+        if row_uploaded:
+            retrieved_info = sorted(
+                retrieved_info + row_uploaded, key=lambda info: info["similarity_score"], reverse=True
+            )
+
+        if entry.lexical is not None:
+            retrieved_info = _fuse(retrieved_info, entry.lexical, context_map)
+
+        retrieved_info = retrieved_info[:top_k]
+        results.append(([info["context"] for info in retrieved_info], retrieved_info))
+
+    return results
+
+
+def _search_uncached(queries, embedding_model, index, lexical_index, mode, depth):
+    """Embed ``queries`` and search the PubMedQA indexes, one ``CachedRetrieval`` per query."""
+    with timed('embed', 'query'):
+        query_embeddings = embedding_model.encode(list(queries))
+        faiss.normalize_L2(query_embeddings)
+    if mode == 'bm25':
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        dense = [empty for _ in queries]
+    else:
+        with timed('faiss', 'search'):
+            distances, indices = index.search(query_embeddings, depth)
+            dense = list(zip(indices, similarity_scores(index, distances)))
+
+    if mode == 'dense':
+        lexical = [None for _ in queries]
+    else:
+        with timed('bm25', 'search'):
+            lexical = lexical_index.search(queries, depth)
+
+    return [CachedRetrieval(embedding, ids, scores, hits)
+            for embedding, (ids, scores), hits in zip(query_embeddings, dense, lexical)]
+
+
+def _fuse(dense_info, lexical_hits, context_map):
+    """Reciprocal-rank fusion of a dense ranking (retrieved-info dicts) and BM25 hits."""
+    candidates = {}
+    dense_keys = []
+    for rank, info in enumerate(dense_info):
+        key = info["context_id"] if info["context_id"] is not None else ("upload", rank)
+        candidates[key] = info
+        dense_keys.append(key)
+
+    lexical_keys = []
+    for idx, score in zip(*lexical_hits):
+        key = int(idx)
+        if key not in candidates:
+            candidates[key] = _passage_info(context_map, key, None)
+        candidates[key]["bm25_score"] = float(score)
+        lexical_keys.append(key)
+
+    fused = []
+    for key, score in reciprocal_rank_fusion([dense_keys, lexical_keys]):
+        info = candidates[key]
+        info["fusion_score"] = score
+        fused.append(info)
+    return fused
+
+
+def generate_answer(question, contexts, model, tokenizer, profile=None):
     """Generate an answer using the fine-tuned T5 model."""
-    combined_context = " ".join(contexts)
-    input_text = f"question: {question} context: {combined_context}"
-    input_ids = tokenizer(input_text, return_tensors="pt", max_length=512, truncation=True).input_ids
-    
-    outputs = model.generate(
-        input_ids=input_ids,
-        max_length=512,
-        num_beams=4,
-        early_stopping=True
-    )
-    
-    answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return answer
+    return generate_answer_batch([question], [contexts], model, tokenizer, profile)[0]
+
+
+def generator_passages(retrieved_info, token_store=None):
+    """Passages to feed the generator: token IDs from the store, or the text.
+
+    Uploaded document chunks are not in the store and are always passed as text.
+    """
+    return [
+        token_store[info["context_id"]]
+        if token_store is not None and info["context_id"] is not None else info["context"]
+        for info in retrieved_info
+    ]
+
+
+def allocate_token_budgets(lengths, budget):
+    """Split ``budget`` tokens between passages of the given lengths.
+
+    Each passage gets an equal share; passages shorter than their share keep
+    all of their tokens and what they leave over goes to the longer ones.
+    """
+    budgets = [0] * len(lengths)
+    remaining = max(0, budget)
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    for n, i in enumerate(order):
+        budgets[i] = min(lengths[i], remaining // (len(order) - n))
+        remaining -= budgets[i]
+    return budgets
+
+
+def build_input_ids(question, passages, tokenizer, max_length=MAX_INPUT_LENGTH):
+    """Token IDs for ``question: ... context: ...``, the format T5 was fine-tuned on.
+
+    ``passages`` holds passage text or pre-computed token IDs (see
+    ``token_store``). Every passage is cut to its own budget, so the input
+    always fits ``max_length`` without the last passages being truncated away.
+    """
+    prefix = tokenizer.encode(f"question: {question} context:", add_special_tokens=False)
+    prefix = prefix[:max_length - 1]
+    passages = [
+        encode_passage(tokenizer, passage) if isinstance(passage, str) else passage
+        for passage in passages
+    ]
+    budgets = allocate_token_budgets([len(ids) for ids in passages], max_length - 1 - len(prefix))
+
+    pieces = [np.asarray(prefix, dtype=np.int64)]
+    pieces += [np.asarray(ids[:budget], dtype=np.int64) for ids, budget in zip(passages, budgets)]
+    pieces.append(np.asarray([tokenizer.eos_token_id], dtype=np.int64))
+    return np.concatenate(pieces)
+
+
+def encode_inputs(questions, contexts_list, tokenizer):
+    """Right-padded ``input_ids`` and ``attention_mask`` tensors for a batch."""
+    rows = [build_input_ids(question, contexts, tokenizer)
+            for question, contexts in zip(questions, contexts_list)]
+    width = max(len(ids) for ids in rows)
+    input_ids = torch.full((len(rows), width), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+    for i, ids in enumerate(rows):
+        input_ids[i, :len(ids)] = torch.from_numpy(ids)
+        attention_mask[i, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def generate_answer_batch(questions, contexts_list, model, tokenizer, profile=None):
+    """Generate answers for several questions with one padded ``generate`` call.
 
+    Each entry of ``contexts_list`` holds passage text or pre-computed token
+    IDs (see ``generator_passages``). ``profile`` names a decoding profile from
+    ``decoding.DECODING_PROFILES`` (full beam search when omitted).
+    """
+    with timed('prompt', 'encode'):
+        input_ids, attention_mask = encode_inputs(questions, contexts_list, tokenizer)
 
-def rag_pipeline(question, model, tokenizer, embedding_model, index, context_map, top_k=3):
+    with timed('generate', profile or DEFAULT_PROFILE):
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            **generation_kwargs(profile)
+        )
+
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+class _StopOnEvent(StoppingCriteria):
+    """Stop generation once the consumer of a stream has gone away."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+
+def stream_answer(question, contexts, model, tokenizer, profile='greedy', timeout=STREAM_TIMEOUT_S):
+    """Yield the answer text piece by piece while T5 is still decoding.
+
+    Beam search cannot emit anything until it has finished, so only
+    single-beam profiles can be streamed. An exception raised by
+    ``generate`` is re-raised to the consumer, and a generation that emits
+    nothing for ``timeout`` seconds raises ``TimeoutError``.
+    """
+    kwargs = generation_kwargs(profile)
+    if kwargs.get('num_beams', 1) != 1:
+        raise ValueError(f"Decoding profile '{profile}' uses beam search and cannot be streamed")
+
+    with timed('prompt', 'encode'):
+        input_ids, attention_mask = encode_inputs([question], [contexts], tokenizer)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+    stop_event = Event()
+    errors = []
+
+    def run():
+        try:
+            model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_event)]),
+                **kwargs
+            )
+        except BaseException as e:
+            errors.append(e)
+            # generate() only ends the stream when it finishes; without this the consumer waits forever
+            streamer.end()
+
+    thread = Thread(target=run, daemon=True)
+    with timed('generate', f"stream:{profile}"):
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        except Empty:
+            raise TimeoutError(f"No generated text for {timeout:.0f}s") from None
+        finally:
+            # If the client disconnected, let generate() finish early
+            stop_event.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+def rag_pipeline(question, model, tokenizer, embedding_model, index, context_map, top_k=3,
+                 profile=None, token_store=None, lexical_index=None, query_cache=None):
     """Full RAG pipeline: retrieve contexts and generate an answer."""
-    contexts, retrieved_info = retrieve_context(question, embedding_model, index, context_map, top_k)
-    answer = generate_answer(question, contexts, model, tokenizer)
-    
+    _, retrieved_info = retrieve_context(question, embedding_model, index, context_map, top_k,
+                                         lexical_index=lexical_index, query_cache=query_cache)
+    answer = generate_answer(question, generator_passages(retrieved_info, token_store),
+                             model, tokenizer, profile)
+
     return {
         'question': question,
         'retrieved_contexts': retrieved_info,
         'generated_answer': answer
     }
+
+
+def rag_pipeline_batch(questions, model, tokenizer, embedding_model, index, context_map, top_k=3,
+                       profile=None, token_store=None, lexical_index=None, query_cache=None):
+    """Batched RAG pipeline: one result dict per question, in input order."""
+    retrieved = retrieve_context_batch(questions, embedding_model, index, context_map, top_k,
+                                       lexical_index=lexical_index, query_cache=query_cache)
+    answers = generate_answer_batch(
+        questions,
+        [generator_passages(retrieved_info, token_store) for _, retrieved_info in retrieved],
+        model,
+        tokenizer,
+        profile
+    )
+
+    return [
+        {
+            'question': question,
+            'retrieved_contexts': retrieved_info,
+            'generated_answer': answer
+        }
+        for question, (_, retrieved_info), answer in zip(questions, retrieved, answers)
+    ]
@@ -0,0 +1,469 @@
+#rag_system.py
+import os
+import threading
+import time
+import traceback
+
+import faiss
+
+from rag_qa import (
+    EMBEDDING_MODEL,
+    FUSION_DEPTH,
+    RETRIEVAL_MODE,
+    generate_answer_batch,
+    generator_passages,
+    load_generator,
+    load_embedding_model,
+    rag_pipeline,
+    retrieve_context_batch,
+    stream_answer,
+)
+from answer_cache import AnswerCache
+from ann_index import DEFAULT_EF_SEARCH, DEFAULT_NPROBE, load_index
+from bm25_index import bm25_index_path, load_bm25_index
+from context_store import load_context_map
+from decoding import DECODING_PROFILES, DEFAULT_PROFILE, DecodingController, generation_kwargs
+import metrics
+from onnx_backend import GENERATOR_BACKEND, QUANTIZE_EMBEDDER, load_onnx_tokenizer
+from query_cache import QueryCache, retrieval_version
+from rag_batcher import RAGBatcher
+from session_index import SessionDocumentIndex
+from token_store import load_token_store
+
+# Number of dummy questions to run after loading (0 disables warm-up)
+WARMUP_QUERIES = int(os.getenv('RAG_WARMUP_QUERIES', '3'))
+
+SAMPLE_QUESTIONS = [
+    "What is the treatment for hypertension in elderly patients?",
+    "Does metformin reduce cardiovascular risk in type 2 diabetes?",
+    "Is vitamin D supplementation associated with fewer fractures?",
+    "What are the risk factors for postoperative delirium?",
+]
+
+
+class RAGSystem:
+    """Holds the RAG components and loads them off the request path.
+
+    ``state`` moves from ``loading`` to ``ready`` or ``failed``; ``components``
+    records per-component progress so the UI can show what is still loading.
+    """
+
+    LOADING, READY, FAILED = 'loading', 'ready', 'failed'
+    COMPONENTS = ('generator', 'embedding_model', 'index', 'context_map', 'token_store', 'lexical_index')
+
+    def __init__(self, model_path, index_path, context_map_path, top_k=3,
+                 warmup_queries=WARMUP_QUERIES):
+        self.model_path = model_path
+        self.index_path = index_path
+        self.context_map_path = context_map_path
+        self.top_k = top_k
+        self.warmup_queries = warmup_queries
+
+        self.model = None
+        self.tokenizer = None
+        self.embedding_model = None
+        self.index = None
+        self.context_map = None
+        self.token_store = None
+        self.lexical_index = None
+        self.query_cache = None
+        self.answer_cache = None
+        self.batcher = None
+        self.decoding_controller = None
+        # Uploaded documents, searched next to the PubMedQA index per chat session
+        self.session_index = SessionDocumentIndex()
+
+        # Set when a pre-fork master leaves creating the generator to the workers
+        self._generator_deferred = False
+
+        self.state = self.LOADING
+        self.error = None
+        self.components = {name: {'status': 'pending', 'seconds': None} for name in self.COMPONENTS}
+        self.warmup = {'status': 'pending' if warmup_queries > 0 else 'disabled', 'seconds': None}
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def is_ready(self):
+        return self.state == self.READY
+
+    def start(self):
+        """Load everything on a background thread and return immediately."""
+        self._thread = threading.Thread(target=self.load, name='rag-loader', daemon=True)
+        self._thread.start()
+        return self
+
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def _load_component(self, name, loader):
+        self.components[name]['status'] = 'loading'
+        start = time.perf_counter()
+        try:
+            result = loader()
+        except Exception:
+            self.components[name]['status'] = 'failed'
+            raise
+        self.components[name].update(status='loaded', seconds=round(time.perf_counter() - start, 2))
+        return result
+
+    def load(self, warm_up=True, serve=True):
+        """Load all components synchronously, then optionally warm up.
+
+        With ``serve=False`` only the models are loaded: no thread is started
+        and nothing is run through them, so a pre-forking server can load them
+        once in its master process and share them copy-on-write with the
+        workers it forks, which then each call ``start_serving``. An ONNX
+        Runtime session starts threads as soon as it is created, so with the
+        ONNX backends only the tokenizer is loaded here and each worker
+        creates its own generator in ``start_serving``.
+        """
+        print("Loading RAG system components...")
+        try:
+            self._load_models(defer_generator=not serve)
+        except Exception as e:
+            self._fail(e)
+            return False
+        if not serve:
+            print("RAG models loaded, waiting for workers to start serving")
+            return True
+        return self.start_serving(warm_up)
+
+    def start_serving(self, warm_up=True):
+        """Create the per-process parts (caches, micro-batcher, decoding controller) and mark ready."""
+        try:
+            if self._generator_deferred:
+                self.model, self.tokenizer = self._load_component(
+                    'generator', lambda: load_generator(self.model_path))
+                self._generator_deferred = False
+            # Repeated questions skip embedding and index search; rebuilt indexes invalidate it
+            self.query_cache = QueryCache(self.retrieval_version())
+            # Paraphrases of recent context-free questions reuse the stored answer
+            self.answer_cache = AnswerCache(self.index.d)
+
+            # Concurrent RAG requests are grouped into micro-batches
+            self.batcher = RAGBatcher(self.answer_batch).start()
+            # Decoding effort adapts to queue depth to keep latency within the SLO
+            self.decoding_controller = DecodingController(max_batch_size=self.batcher.max_batch_size)
+        except Exception as e:
+            self._fail(e)
+            return False
+
+        self.state = self.READY
+        self._ready.set()
+        print("RAG system loaded successfully!")
+
+        if warm_up:
+            self.warm_up()
+        return True
+
+    def _fail(self, error):
+        print(f"Failed to load RAG system: {error}")
+        traceback.print_exc()
+        self.error = str(error)
+        self.state = self.FAILED
+        self._ready.set()
+
+    def _load_models(self, defer_generator=False):
+        """Load the generator, embedder, indexes and passage stores.
+
+        ``defer_generator`` leaves an ONNX Runtime generator to ``start_serving``.
+        """
+        self._generator_deferred = defer_generator and GENERATOR_BACKEND.startswith('onnx')
+        if self._generator_deferred:
+            # The token store only needs the tokenizer; the model follows in start_serving
+            self.tokenizer = self._load_component('generator', lambda: load_onnx_tokenizer(
+                self.model_path, quantized=GENERATOR_BACKEND == 'onnx-int8'))
+        else:
+            self.model, self.tokenizer = self._load_component(
+                'generator', lambda: load_generator(self.model_path))
+        self.embedding_model = self._load_component('embedding_model', load_embedding_model)
+        # Search knobs (nprobe / efSearch) come from the environment
+        self.index = self._load_component('index', lambda: load_index(self.index_path))
+        # mmap-backed store when available, legacy pickle otherwise; row ids
+        # must line up with the index vectors
+        self.context_map = self._load_component(
+            'context_map', lambda: load_context_map(self.context_map_path, self.index.ntotal))
+        # Pre-tokenized passages; prompts fall back to tokenizing text without them
+        self.token_store = self._load_component(
+            'token_store',
+            lambda: load_token_store(self.context_map_path, self.tokenizer, len(self.context_map)))
+        if self.token_store is None:
+            self.components['token_store']['status'] = 'unavailable'
+        # BM25 index for hybrid retrieval; dense-only without it
+        self.lexical_index = self._load_component(
+            'lexical_index', lambda: load_bm25_index(self.context_map_path, len(self.context_map)))
+        if self.lexical_index is None:
+            self.components['lexical_index']['status'] = 'unavailable'
+
+    def retrieval_version(self):
+        """Version of everything a cached retrieval result depends on."""
+        root = os.path.splitext(self.context_map_path)[0]
+        paths = [self.index_path, self.context_map_path, root + '.ctx', bm25_index_path(self.context_map_path)]
+        return retrieval_version(paths, EMBEDDING_MODEL, QUANTIZE_EMBEDDER, DEFAULT_NPROBE,
+                                 DEFAULT_EF_SEARCH, RETRIEVAL_MODE, FUSION_DEPTH)
+
+    def warm_up(self):
+        """Run dummy queries so the first real request does not pay for cold caches."""
+        if self.warmup_queries <= 0:
+            return
+        self.warmup['status'] = 'running'
+        start = time.perf_counter()
+        questions = [SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)] for i in range(self.warmup_queries)]
+        try:
+            # Exercise both the single-request and the batched code paths
+            self.answer_single(questions[0])
+            self.answer_batch(questions)
+            # A full batch per decoding profile seeds the controller's estimates
+            # with the batch size it will see under load
+            for profile in DECODING_PROFILES:
+                self.answer_batch([(questions[0], profile)] * self.batcher.max_batch_size)
+        except Exception as e:
+            print(f"RAG warm-up failed: {e}")
+            self.warmup['status'] = 'failed'
+            return
+        self.warmup.update(status='done', seconds=round(time.perf_counter() - start, 2))
+
+    def add_document(self, session_key, filename, pieces, source=None):
+        """Chunk and embed uploaded text into the session's document index."""
+        if not self.is_ready:
+            raise Exception("RAG system is not properly loaded")
+        return self.session_index.add_document(session_key, filename, pieces, self.embedding_model, source)
+
+    def ensure_documents(self, session_key, documents):
+        """Re-index saved uploads this process has not seen (or has evicted)."""
+        if self.is_ready and documents:
+            self.session_index.ensure_documents(session_key, documents, self.embedding_model)
+
+    def retrieve(self, question, session_key=None):
+        """Retrieve contexts for one question, including the session's uploads."""
+        return retrieve_context_batch([question], self.embedding_model, self.index, self.context_map,
+                                      self.top_k, self.session_index, [session_key],
+                                      self.lexical_index, self.query_cache)[0]
+
+    def search_documents(self, question, session_key, top_k=None):
+        """Uploaded-document chunks matching ``question`` (for prompts of other models)."""
+        if not self.is_ready or not self.session_index.has_documents(session_key):
+            return []
+        query_embeddings = self.embed_query(question)[None, :]
+        return self.session_index.search([session_key], query_embeddings, top_k or self.top_k)[0]
+
+    def embed_query(self, question):
+        """L2-normalized embedding of one question."""
+        with metrics.timed('embed', 'query'):
+            embedding = self.embedding_model.encode([question])
+            faiss.normalize_L2(embedding)
+        return embedding[0]
+
+    def answer_single(self, question):
+        """Run the RAG pipeline for one question without batching."""
+        return rag_pipeline(question, self.model, self.tokenizer, self.embedding_model,
+                            self.index, self.context_map, top_k=self.top_k,
+                            token_store=self.token_store, lexical_index=self.lexical_index,
+                            query_cache=self.query_cache)
+
+    def passages(self, retrieved_info):
+        """Generator input for retrieved passages (token IDs when pre-tokenized)."""
+        return generator_passages(retrieved_info, self.token_store)
+
+    def generate(self, questions, passages, profile):
+        """Answers for a batch of questions, one list of passages each."""
+        return generate_answer_batch(questions, passages, self.model, self.tokenizer, profile)
+
+    def stream(self, question, passages, profile):
+        """Yield the answer to one question as it is generated."""
+        return stream_answer(question, passages, self.model, self.tokenizer, profile)
+
+    def answer_batch(self, items):
+        """Answer a batch of questions or ``(question, profile[, session_key])`` tuples.
+
+        Retrieval runs once for the whole batch; generation runs once per
+        decoding profile present in it. Each result carries the batch's stage
+        timings under ``'timings'``.
+        """
+        with metrics.collect() as timings:
+            results = self._answer_batch(items)
+        for result in results:
+            result['timings'] = timings
+        return results
+
+    def _answer_batch(self, items):
+        items = [
+            (item + (None,) * (3 - len(item))) if isinstance(item, tuple) else (item, DEFAULT_PROFILE, None)
+            for item in items
+        ]
+        questions = [question for question, _, _ in items]
+        retrieved = retrieve_context_batch(questions, self.embedding_model, self.index,
+                                           self.context_map, self.top_k,
+                                           self.session_index, [key for _, _, key in items],
+                                           self.lexical_index, self.query_cache)
+
+        results = [None] * len(items)
+        by_profile = {}
+        for position, (_, profile, _) in enumerate(items):
+            by_profile.setdefault(profile, []).append(position)
+
+        for profile, positions in by_profile.items():
+            start = time.perf_counter()
+            answers = self.generate(
+                [questions[i] for i in positions],
+                [self.passages(retrieved[i][1]) for i in positions],
+                profile
+            )
+            if self.decoding_controller is not None:
+                self.decoding_controller.record(profile, time.perf_counter() - start)
+
+            for i, answer in zip(positions, answers):
+                results[i] = {
+                    'question': questions[i],
+                    'retrieved_contexts': retrieved[i][1],
+                    'generated_answer': answer,
+                    'decoding_profile': profile
+                }
+        return results
+
+    def answer(self, question, session_key=None, inline=False):
+        """Answer through the micro-batcher (the normal request path).
+
+        The decoding profile is chosen from the outstanding backlog so that
+        latency degrades gracefully under load. Documents uploaded to
+        ``session_key`` are retrieved alongside PubMedQA. ``inline`` runs a
+        batch of one on the calling thread instead, so a request profiler
+        sees retrieval and generation in the request's own stack.
+
+        Without uploaded documents the answer depends only on the question, so
+        a paraphrase of a recently answered question is served from the
+        answer cache; the result then carries ``answer_cache`` with the
+        cached question and its similarity. Only ``DEFAULT_PROFILE`` answers
+        are cached, so a load spike does not leave degraded answers behind.
+        """
+        if not self.is_ready:
+            raise Exception("RAG system is not properly loaded")
+        cache_embedding, hit = self._cached_answer(question, session_key)
+        if hit is not None:
+            return hit
+
+        profile = self.decoding_controller.choose()
+        try:
+            result = self._answer(question, session_key, inline, profile)
+        finally:
+            self.decoding_controller.release(profile)
+        self._store_answer(cache_embedding, question, result)
+        return result
+
+    def answer_stream(self, question, session_key=None):
+        """Streaming form of ``answer``: a generator of the result, then the answer text.
+
+        The first item is the result without ``generated_answer``; the text
+        follows in pieces. Admission, the decoding profile and the answer
+        cache work as in ``answer``. Beam search only has text once it has
+        finished, so beam profiles go through the micro-batcher and arrive as
+        one piece; greedy answers are streamed as they are decoded. Close the
+        generator when abandoning it so its admission is released.
+        """
+        if not self.is_ready:
+            raise Exception("RAG system is not properly loaded")
+        cache_embedding, hit = self._cached_answer(question, session_key)
+        if hit is not None:
+            answer = hit.pop('generated_answer')
+            yield hit
+            yield answer
+            return
+
+        profile = self.decoding_controller.choose()
+        try:
+            if generation_kwargs(profile).get('num_beams', 1) != 1:
+                result = self._answer(question, session_key, False, profile)
+                answer = result.pop('generated_answer')
+                yield result
+                yield answer
+            else:
+                _, contexts = self.retrieve(question, session_key)
+                result = {'question': question, 'retrieved_contexts': contexts, 'decoding_profile': profile}
+                yield result
+                pieces = []
+                for piece in self.stream(question, self.passages(contexts), profile):
+                    pieces.append(piece)
+                    yield piece
+                answer = ''.join(pieces)
+        finally:
+            self.decoding_controller.release(profile)
+        self._store_answer(cache_embedding, question, dict(result, generated_answer=answer))
+
+    def _cached_answer(self, question, session_key):
+        """``(embedding, result)`` from the answer cache; the embedding is None when uploaded
+        documents make the answer uncacheable, the result None on a miss."""
+        if not self.answer_cache.enabled or self.session_index.has_documents(session_key):
+            return None, None
+        cache_embedding = self.embed_query(question)
+        with metrics.timed('answer_cache', 'lookup'):
+            hit = self.answer_cache.lookup('rag', cache_embedding)
+        if hit is None:
+            return cache_embedding, None
+        payload, similarity, cached_question = hit
+        return cache_embedding, dict(payload, question=question,
+                                     answer_cache={'question': cached_question, 'similarity': round(similarity, 4)})
+
+    def _store_answer(self, cache_embedding, question, result):
+        # Answers decoded with a cheaper profile under load would outlive the load
+        if cache_embedding is not None and result['decoding_profile'] == DEFAULT_PROFILE:
+            self.answer_cache.store('rag', cache_embedding, question, {
+                'retrieved_contexts': result['retrieved_contexts'],
+                'generated_answer': result['generated_answer'],
+                'decoding_profile': result['decoding_profile'],
+            })
+
+    def _answer(self, question, session_key, inline, profile):
+        """Answer with a profile admitted by the decoding controller."""
+        if inline:
+            # Stages were recorded straight into this request's breakdown
+            return self._answer_batch([(question, profile, session_key)])[0]
+        start = time.perf_counter()
+        result = self.batcher.submit((question, profile, session_key))
+
+        # The batch ran on the batcher thread; attribute its stages to this request
+        timings = result.pop('timings', {})
+        metrics.record('rag_queue', max(0.0, time.perf_counter() - start - sum(timings.values())))
+        metrics.add_request_timings(timings)
+        return result
+
+    def metric_families(self):
+        """Readiness, batcher, decoding and cache metrics (see ``metrics.register_collector``)."""
+        families = [
+            ('medqa_rag_ready', metrics.GAUGE, 'Whether the RAG system has finished loading.',
+             [({}, int(self.is_ready))]),
+        ]
+        if self.batcher is not None:
+            families.append(('medqa_rag_queue_depth', metrics.GAUGE, 'Questions waiting for the RAG micro-batcher.',
+                             [({}, self.batcher.queue_depth())]))
+        controller = self.decoding_controller
+        if controller is not None:
+            families.append(('medqa_rag_outstanding', metrics.GAUGE, 'Admitted RAG requests not yet answered.',
+                             [({'profile': name}, count) for name, count in controller.outstanding.items()]))
+            families.append(('medqa_rag_generate_estimate_seconds', metrics.GAUGE,
+                             'Estimated generate time per batch and decoding profile.',
+                             [({'profile': name}, seconds) for name, seconds in controller.estimates.items()]))
+        if self.query_cache is not None:
+            families += self.query_cache.metric_families()
+        if self.answer_cache is not None:
+            families += self.answer_cache.metric_families()
+
+        documents = self.session_index.status()
+        families.append(('medqa_session_documents_chunks', metrics.GAUGE, 'Uploaded-document chunks held in memory.',
+                         [({}, documents['chunks'])]))
+        return families
+
+    def status(self):
+        return {
+            'state': self.state,
+            'error': self.error,
+            'components': self.components,
+            'warmup': self.warmup,
+            'session_documents': self.session_index.status(),
+            'query_cache': self.query_cache.stats() if self.query_cache is not None else None,
+            'answer_cache': self.answer_cache.stats() if self.answer_cache is not None else None,
+            'decoding_estimates': (
+                {name: round(seconds, 3) for name, seconds in self.decoding_controller.estimates.items()}
+                if self.decoding_controller is not None else None
+            ),
+        }
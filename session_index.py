@@ -0,0 +1,204 @@
+#session_index.py
+"""Small per-session vector indexes over uploaded documents.
+
+Uploaded text is split into overlapping word chunks, embedded with the same
+SentenceTransformer as the PubMedQA index and added to an exact inner-product
+FAISS index that belongs to one chat session. ``rag_qa.retrieve_context_batch``
+searches it next to the main index, so prompts carry only the few chunks that
+match the question instead of the whole document.
+
+Indexes live in process memory. Sessions idle for longer than the TTL, or the
+least recently used ones beyond the session limit, are evicted; an evicted (or
+never seen, e.g. in another worker) session is rebuilt from the saved upload
+text by ``ensure_documents``.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+CHUNK_WORDS = int(os.getenv('SESSION_DOC_CHUNK_WORDS', '120'))
+CHUNK_OVERLAP = int(os.getenv('SESSION_DOC_CHUNK_OVERLAP', '20'))
+MAX_CHUNKS_PER_SESSION = int(os.getenv('SESSION_DOC_MAX_CHUNKS', '2000'))
+MAX_SESSIONS = int(os.getenv('SESSION_DOC_MAX_SESSIONS', '64'))
+SESSION_TTL_S = float(os.getenv('SESSION_DOC_TTL_S', '3600'))
+EMBED_BATCH_SIZE = 64
+
+
+def chunk_words(pieces, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Yield chunks of ``chunk_words`` words from an iterable of text pieces.
+
+    Consecutive chunks share ``overlap`` words so a sentence cut at a chunk
+    boundary is still retrievable in one piece.
+    """
+    step = max(1, chunk_words - overlap)
+    window = []
+    emitted = 0  # words of the current window already covered by a yielded chunk
+    for piece in pieces:
+        window.extend(piece.split())
+        while len(window) >= chunk_words:
+            yield " ".join(window[:chunk_words])
+            window = window[step:]
+            emitted = overlap
+    if len(window) > emitted:
+        yield " ".join(window)
+
+
+class _SessionDocuments:
+    def __init__(self, dim):
+        self.index = faiss.IndexFlatIP(dim)
+        self.chunks = []     # (filename, text) per index row
+        self.sources = {}     # saved upload path -> chunks indexed from it
+        self.last_used = time.monotonic()
+
+
+class SessionDocumentIndex:
+    """Per-session FAISS indexes of uploaded document chunks, with TTL/LRU eviction."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL_S,
+                 max_chunks=MAX_CHUNKS_PER_SESSION):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self.max_chunks = max_chunks
+        self._sessions = OrderedDict()
+        self._indexing = set()  # (key, path) pairs being rebuilt right now
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.ttl
+        for key in [key for key, docs in self._sessions.items() if docs.last_used < cutoff]:
+            del self._sessions[key]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _touch(self, key):
+        docs = self._sessions.get(key)
+        if docs is not None:
+            docs.last_used = time.monotonic()
+            self._sessions.move_to_end(key)
+        return docs
+
+    def add_document(self, key, filename, pieces, embedding_model, source=None):
+        """Chunk, embed and index text pieces for session ``key``.
+
+        Returns the number of chunks added (the session's chunk limit applies).
+        A ``source`` that is already indexed for this session is not added twice.
+        """
+        if source is not None:
+            with self._lock:
+                docs = self._touch(key)
+                if docs is not None and source in docs.sources:
+                    return docs.sources[source]
+
+        added = 0
+        batch = []
+        # Stop reading and encoding once the session is full instead of embedding chunks it would drop
+        room = self._room(key)
+        if room > 0:
+            for chunk in chunk_words(pieces):
+                batch.append(chunk)
+                if len(batch) >= min(EMBED_BATCH_SIZE, room):
+                    added += self._add_chunks(key, filename, batch, embedding_model)
+                    batch = []
+                    room = self._room(key)
+                    if room <= 0:
+                        break
+            if batch:
+                added += self._add_chunks(key, filename, batch, embedding_model)
+
+        if source is not None:
+            with self._lock:
+                docs = self._touch(key)
+                if docs is not None:
+                    docs.sources[source] = added
+        return added
+
+    def _room(self, key):
+        """Chunks session ``key`` can still take."""
+        with self._lock:
+            docs = self._touch(key)
+            return self.max_chunks - (len(docs.chunks) if docs is not None else 0)
+
+    def _add_chunks(self, key, filename, chunks, embedding_model):
+        # Encoding is the slow part; keep it outside the lock
+        embeddings = np.asarray(embedding_model.encode(chunks), dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+
+        with self._lock:
+            docs = self._touch(key)
+            if docs is None:
+                docs = self._sessions[key] = _SessionDocuments(embeddings.shape[1])
+                self._evict()
+            room = self.max_chunks - len(docs.chunks)
+            if room <= 0:
+                return 0
+            docs.index.add(embeddings[:room])
+            docs.chunks.extend((filename, chunk) for chunk in chunks[:room])
+            return min(room, len(chunks))
+
+    def ensure_documents(self, key, documents, embedding_model):
+        """Index any saved uploads of session ``key`` that this process has not seen.
+
+        ``documents`` is a list of ``(saved_path, filename)`` pairs.
+        """
+        for path, filename in documents:
+            with self._lock:
+                docs = self._touch(key)
+                if (docs is not None and path in docs.sources) or (key, path) in self._indexing:
+                    continue
+                self._indexing.add((key, path))
+            try:
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        self.add_document(key, filename, f, embedding_model, source=path)
+            finally:
+                with self._lock:
+                    self._indexing.discard((key, path))
+
+    def has_documents(self, key):
+        with self._lock:
+            docs = self._sessions.get(key)
+            return docs is not None and docs.index.ntotal > 0
+
+    def search(self, keys, query_embeddings, top_k):
+        """Top chunks per query; ``keys[i]`` names the session of query ``i`` (or None).
+
+        ``query_embeddings`` must already be L2-normalised. Returns one list of
+        retrieved-info dicts per query.
+        """
+        results = [[] for _ in keys]
+        with self._lock:
+            self._evict()
+            for i, key in enumerate(keys):
+                docs = self._touch(key) if key is not None else None
+                if docs is None or docs.index.ntotal == 0:
+                    continue
+                scores, indices = docs.index.search(query_embeddings[i:i + 1], min(top_k, docs.index.ntotal))
+                for score, idx in zip(scores[0], indices[0]):
+                    if idx < 0:
+                        continue
+                    filename, text = docs.chunks[idx]
+                    results[i].append({
+                        "context": text,
+                        "context_id": None,
+                        "source": "upload",
+                        "filename": filename,
+                        "original_question": filename,
+                        "original_answer": None,
+                        "similarity_score": float(score)
+                    })
+        return results
+
+    def drop(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def status(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'chunks': sum(docs.index.ntotal for docs in self._sessions.values())
+            }
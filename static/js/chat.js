@@ -27,6 +27,12 @@ document.addEventListener("DOMContentLoaded", function () {
   let currentModel = modelSelector.value;
   let sessionsList = [];
 
+  // Message history pagination for the active session
+  let oldestMessageId = null;
+  let hasOlderMessages = false;
+  let loadingOlderMessages = false;
+  const MESSAGE_PAGE_SIZE = 50;
+
   // Configure marked options for markdown parsing
   marked.setOptions({
     renderer: new marked.Renderer(),
@@ -110,6 +116,13 @@ document.addEventListener("DOMContentLoaded", function () {
   });
   fileInput.addEventListener("change", handleFileUpload);
 
+  // Lazy-load older messages when the user scrolls to the top
+  chatMessages.addEventListener("scroll", function() {
+    if (chatMessages.scrollTop < 80) {
+      loadOlderMessages();
+    }
+  });
+
   // Close modals when clicking outside
   window.addEventListener("click", function(event) {
     if (event.target === renameModal) {
@@ -124,16 +137,26 @@ document.addEventListener("DOMContentLoaded", function () {
     fetch("/api/check-system-status")
       .then(response => response.json())
       .then(data => {
-        if (!data.rag_system) {
-          // If RAG system is not available, disable the option
-          const ragOption = Array.from(modelSelector.options).find(opt => opt.value === "rag");
-          if (ragOption) {
-            ragOption.disabled = true;
-            ragOption.text += " (unavailable)";
+        const ragOption = Array.from(modelSelector.options).find(opt => opt.value === "rag");
+        const ragState = data.rag_status ? data.rag_status.state : (data.rag_system ? "ready" : "failed");
+
+        if (ragOption) {
+          if (!ragOption.dataset.label) {
+            ragOption.dataset.label = ragOption.text;
           }
-          
+          ragOption.disabled = !data.rag_system;
+          ragOption.text = ragOption.dataset.label +
+            (ragState === "loading" ? " (loading...)" : data.rag_system ? "" : " (unavailable)");
+        }
+
+        // Models load in the background; poll until loading has finished
+        if (ragState === "loading") {
+          setTimeout(checkSystemStatus, 3000);
+        }
+
+        if (!data.rag_system) {
           // If current selection is RAG, switch to Gemini
-          if (currentModel === "rag") {
+          if (currentModel === "rag" && data.gemini_api) {
             modelSelector.value = "gemini";
             currentModel = "gemini";
             updateWelcomeMessage();
@@ -143,7 +166,7 @@ document.addEventListener("DOMContentLoaded", function () {
         if (!data.gemini_api) {
           // If Gemini API is not available, disable the option
           const geminiOption = Array.from(modelSelector.options).find(opt => opt.value === "gemini");
-          if (geminiOption) {
+          if (geminiOption && !geminiOption.disabled) {
             geminiOption.disabled = true;
             geminiOption.text += " (unavailable)";
           }
@@ -157,7 +180,7 @@ document.addEventListener("DOMContentLoaded", function () {
         }
         
         // If neither system is available, show error message
-        if (!data.rag_system && !data.gemini_api) {
+        if (!data.rag_system && !data.gemini_api && ragState !== "loading") {
           addBotMessage("⚠️ No AI models are currently available. Please check your server configuration.", false);
         }
       })
@@ -204,6 +227,7 @@ document.addEventListener("DOMContentLoaded", function () {
         // Clear current chat and update session ID
         chatMessages.innerHTML = "";
         activeSessionId = data.session_id;
+        hasOlderMessages = false;
         
         // Add welcome message
         updateWelcomeMessage();
@@ -220,61 +244,177 @@ document.addEventListener("DOMContentLoaded", function () {
     });
   }
 
-  function sendMessage() {
+  async function sendMessage() {
     const message = userInput.value.trim();
     if (!message) return;
 
     addUserMessage(message);
     userInput.value = "";
 
-    // Show loading indicator
+    // Show loading indicator until the first token arrives
     const loadingDiv = document.createElement("div");
     loadingDiv.className = "message bot-message";
     loadingDiv.innerHTML = '<div class="loading"></div>';
     chatMessages.appendChild(loadingDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
 
-    // Send to backend with model selection
-    fetch("/api/chat", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({ 
-        message: message,
-        model: currentModel 
-      }),
-    })
-      .then((response) => {
-        if (!response.ok) {
-          throw new Error(`HTTP error! Status: ${response.status}`);
+    let streamingMessage = null;
+    let contextInfo = [];
+
+    try {
+      // Send to backend with model selection and read the answer as it is generated
+      const response = await fetch("/api/chat/stream", {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({ 
+          message: message,
+          model: currentModel 
+        }),
+      });
+
+      if (!response.ok) {
+        let errorMessage = `HTTP error! Status: ${response.status}`;
+        try {
+          const errorData = await response.json();
+          errorMessage = errorData.error || errorMessage;
+        } catch (e) {
+          // Keep the status-based message
         }
-        return response.json();
-      })
-      .then((data) => {
-        // Remove loading indicator
-        chatMessages.removeChild(loadingDiv);
+        throw new Error(errorMessage);
+      }
+
+      await readEventStream(response, (event, data) => {
+        if (event === "meta") {
+          contextInfo = data.context_info || [];
+        } else if (event === "token") {
+          if (!streamingMessage) {
+            loadingDiv.remove();
+            streamingMessage = createStreamingBotMessage();
+          }
+          streamingMessage.append(data.text);
+        } else if (event === "done") {
+          if (!streamingMessage) {
+            loadingDiv.remove();
+            streamingMessage = createStreamingBotMessage();
+          }
+          streamingMessage.finish(data.response);
 
-        if (data.error) {
-          addBotMessage("Sorry, I encountered an error: " + data.error);
-        } else {
-          // Use markdown rendering for the response
-          addBotMessage(data.response, true);
-          
           // If RAG model was used and context info is provided, show it
-          if (data.context_info && data.context_info.length > 0) {
-            addContextInfo(data.context_info);
+          if (contextInfo.length > 0) {
+            addContextInfo(contextInfo);
           }
+        } else if (event === "error") {
+          loadingDiv.remove();
+          addBotMessage("Sorry, I encountered an error: " + data.error);
         }
-        
-        // Refresh chat history after a message exchange
-        loadChatHistory();
-      })
-      .catch((error) => {
-        console.error("Error in chat request:", error);
-        chatMessages.removeChild(loadingDiv);
-        addBotMessage(`Sorry, there was a connection error: ${error.message}. Please check the console for more details.`);
       });
+
+      // Refresh chat history after a message exchange
+      loadChatHistory();
+    } catch (error) {
+      console.error("Error in chat request:", error);
+      loadingDiv.remove();
+      addBotMessage(`Sorry, there was a connection error: ${error.message}. Please check the console for more details.`);
+    }
+  }
+
+  // Parse a text/event-stream response body and call onEvent(event, data) per message
+  async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = "message";
+        const dataLines = [];
+        rawEvent.split("\n").forEach(line => {
+          if (line.startsWith("event:")) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith("data:")) {
+            dataLines.push(line.slice(5).trim());
+          }
+        });
+        if (dataLines.length > 0) {
+          onEvent(event, JSON.parse(dataLines.join("\n")));
+        }
+      }
+    }
+  }
+
+  // Bot message that re-renders its markdown as partial output arrives
+  function createStreamingBotMessage() {
+    const messageDiv = document.createElement("div");
+    messageDiv.className = "message bot-message";
+
+    const modelBadge = document.createElement("span");
+    modelBadge.className = "model-badge";
+    modelBadge.textContent = currentModel === "gemini" ? "Gemini" : "RAG";
+    messageDiv.appendChild(modelBadge);
+
+    const markdownContent = document.createElement("div");
+    markdownContent.className = "markdown-content";
+    messageDiv.appendChild(markdownContent);
+    chatMessages.appendChild(messageDiv);
+
+    let text = "";
+    let frameId = null;
+
+    function render() {
+      frameId = null;
+      try {
+        markdownContent.innerHTML = marked.parse(text);
+      } catch (e) {
+        markdownContent.textContent = text;
+      }
+      chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    return {
+      append(piece) {
+        text += piece;
+        // Re-render at most once per animation frame
+        if (frameId === null) {
+          frameId = requestAnimationFrame(render);
+        }
+      },
+      finish(finalText) {
+        if (frameId !== null) {
+          cancelAnimationFrame(frameId);
+        }
+        text = finalText;
+        render();
+        messageDiv.querySelectorAll("pre code").forEach((block) => {
+          hljs.highlightElement(block);
+        });
+      },
+    };
+  }
+
+  async function waitForUploadJob(jobId) {
+    let delay = 500;
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, delay));
+      const response = await fetch(`/api/upload/${jobId}`);
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || `HTTP error! Status: ${response.status}`);
+      }
+      if (data.status === "done" || data.status === "failed") {
+        return data;
+      }
+      delay = Math.min(delay * 1.5, 3000);
+    }
   }
 
   async function handleFileUpload(event) {
@@ -298,17 +438,29 @@ document.addEventListener("DOMContentLoaded", function () {
         throw new Error(errorData.error || `HTTP error! Status: ${response.status}`);
       }
 
-      const data = await response.json();
+      let data = await response.json();
+
+      // Images are OCR'd in the background; wait for the job to finish
+      if (response.status === 202) {
+        addBotMessage(`Reading the text in ${file.name}...`);
+        data = await waitForUploadJob(data.job_id);
+      }
 
       if (data.error) {
         addBotMessage(`Error processing file: ${data.error}`);
       } else {
+        // Very long documents are cut at the server's page/character limits
+        const truncatedNote = data.truncated
+          ? ` It is very long, so only the first ${data.pages} pages were read.`
+          : "";
         addBotMessage(
-          `I've received your ${file.name}. Here's a summary of its contents:`
+          `I've received your ${file.name}.${truncatedNote} Here's a summary of its contents:`
         );
 
-        // Send extracted text to chat
-        const prompt = `Summarize this medical document and highlight key findings:\n\n${data.content}`;
+        // Indexed documents are retrieved server-side; only paste the preview as a fallback
+        const prompt = data.indexed
+          ? `Summarize the uploaded medical document "${file.name}" and highlight key findings.`
+          : `Summarize this medical document and highlight key findings:\n\n${data.content}`;
 
         // Show loading
         const loadingDiv = document.createElement("div");
@@ -361,22 +513,24 @@ document.addEventListener("DOMContentLoaded", function () {
     event.target.value = "";
   }
 
-  function addUserMessage(text) {
+  function addUserMessage(text, target = chatMessages) {
     const messageDiv = document.createElement("div");
     messageDiv.className = "message user-message";
     messageDiv.textContent = text;
-    chatMessages.appendChild(messageDiv);
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    target.appendChild(messageDiv);
+    if (target === chatMessages) {
+      chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
   }
 
-  function addBotMessage(text, useMarkdown = false) {
+  function addBotMessage(text, useMarkdown = false, target = chatMessages, model = currentModel) {
     const messageDiv = document.createElement("div");
     messageDiv.className = "message bot-message";
 
     // Add model badge to show which model generated the response
     const modelBadge = document.createElement("span");
     modelBadge.className = "model-badge";
-    modelBadge.textContent = currentModel === "gemini" ? "Gemini" : "RAG";
+    modelBadge.textContent = model === "gemini" ? "Gemini" : "RAG";
     messageDiv.appendChild(modelBadge);
 
     if (useMarkdown) {
@@ -411,12 +565,14 @@ document.addEventListener("DOMContentLoaded", function () {
       messageDiv.appendChild(textDiv);
     }
 
-    chatMessages.appendChild(messageDiv);
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    target.appendChild(messageDiv);
+    if (target === chatMessages) {
+      chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
   }
 
   // Function to display RAG context information
-  function addContextInfo(contextInfo) {
+  function addContextInfo(contextInfo, target = chatMessages) {
     const contextDiv = document.createElement("div");
     contextDiv.className = "context-info";
     
@@ -426,23 +582,36 @@ document.addEventListener("DOMContentLoaded", function () {
     
     // Add each context source with its confidence score
     contextInfo.forEach((ctx, index) => {
-      if (ctx.similarity_score) {
+      // Passages found only by keyword search (hybrid retrieval) have no similarity score
+      if (ctx.similarity_score || ctx.bm25_score) {
         const ctxItem = document.createElement("div");
         ctxItem.className = "context-item";
         
         // Format the similarity score as a percentage
-        const scorePercent = Math.round(ctx.similarity_score * 100);
+        const scoreLabel = ctx.similarity_score
+          ? `${Math.round(ctx.similarity_score * 100)}% match`
+          : "keyword match";
+        const label = ctx.source === "upload"
+          ? `Your document: ${ctx.filename}`
+          : ctx.original_question;
         
-        ctxItem.innerHTML = `
-          <span class="context-source">${index + 1}. "${ctx.original_question.substring(0, 50)}${ctx.original_question.length > 50 ? '...' : ''}"</span>
-          <span class="context-score">${scorePercent}% match</span>
-        `;
+        // Labels come from uploaded file names and passages; never parse them as HTML
+        const sourceSpan = document.createElement("span");
+        sourceSpan.className = "context-source";
+        sourceSpan.textContent = `${index + 1}. "${label.substring(0, 50)}${label.length > 50 ? '...' : ''}"`;
+        const scoreSpan = document.createElement("span");
+        scoreSpan.className = "context-score";
+        scoreSpan.textContent = scoreLabel;
+        ctxItem.appendChild(sourceSpan);
+        ctxItem.appendChild(scoreSpan);
         contextDiv.appendChild(ctxItem);
       }
     });
     
-    chatMessages.appendChild(contextDiv);
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    target.appendChild(contextDiv);
+    if (target === chatMessages) {
+      chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
   }
 
   // Enhanced loadChatHistory function
@@ -602,6 +771,7 @@ document.addEventListener("DOMContentLoaded", function () {
       if (sessionId === activeSessionId) {
         chatMessages.innerHTML = "";
         activeSessionId = null;
+        hasOlderMessages = false;
         updateWelcomeMessage();
       }
       
@@ -614,7 +784,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
   async function loadSession(sessionId) {
     try {
-      const response = await fetch(`/api/chat/session/${sessionId}`);
+      const response = await fetch(`/api/chat/session/${sessionId}?limit=${MESSAGE_PAGE_SIZE}`);
       if (!response.ok) {
         console.error("Error loading session:", response.statusText);
         return;
@@ -625,8 +795,10 @@ document.addEventListener("DOMContentLoaded", function () {
       // Clear current chat
       chatMessages.innerHTML = "";
       
-      // Update active session
+      // Update active session and pagination state
       activeSessionId = sessionId;
+      oldestMessageId = data.next_before_id;
+      hasOlderMessages = data.has_more;
       
       // Update sidebar to show active session
       document.querySelectorAll(".session-item").forEach(item => {
@@ -641,33 +813,15 @@ document.addEventListener("DOMContentLoaded", function () {
 
       // Add messages to chat in correct order
       if (data.messages && data.messages.length > 0) {
-        data.messages.forEach((msg) => {
-          if (msg.role === "user") {
-            addUserMessage(msg.content);
-          } else {
-            // For bot messages, check if there's model info
-            const modelType = msg.model || "gemini"; // Default to gemini if not specified
-            currentModel = modelType; // Update the current model selection
-            
-            // Update the dropdown to match
-            modelSelector.value = modelType;
-            
-            // Display the message
-            addBotMessage(msg.content, true);
-            
-            // If RAG context exists, display it
-            if (msg.context_info) {
-              try {
-                const contextInfo = JSON.parse(msg.context_info);
-                if (contextInfo && contextInfo.length > 0) {
-                  addContextInfo(contextInfo);
-                }
-              } catch (e) {
-                console.error("Failed to parse context info", e);
-              }
-            }
-          }
-        });
+        renderHistoryMessages(data.messages, chatMessages);
+
+        // Continue with the model used for the most recent bot message
+        const lastBotMessage = data.messages.filter(msg => msg.role !== "user").pop();
+        if (lastBotMessage) {
+          currentModel = lastBotMessage.model || "gemini"; // Default to gemini if not specified
+          modelSelector.value = currentModel;
+        }
+        chatMessages.scrollTop = chatMessages.scrollHeight;
       } else {
         // If no messages, add welcome message
         updateWelcomeMessage();
@@ -676,4 +830,67 @@ document.addEventListener("DOMContentLoaded", function () {
       console.error("Error loading session:", error);
     }
   }
+
+  // Fetch the page before the oldest loaded message and prepend it
+  async function loadOlderMessages() {
+    if (!activeSessionId || !hasOlderMessages || loadingOlderMessages) return;
+    loadingOlderMessages = true;
+    const sessionId = activeSessionId;
+
+    try {
+      const response = await fetch(
+        `/api/chat/session/${sessionId}?before_id=${oldestMessageId}&limit=${MESSAGE_PAGE_SIZE}`
+      );
+      if (!response.ok) {
+        console.error("Error loading older messages:", response.statusText);
+        return;
+      }
+
+      const data = await response.json();
+      // Ignore the page if the user switched sessions meanwhile
+      if (sessionId !== activeSessionId) return;
+
+      oldestMessageId = data.next_before_id;
+      hasOlderMessages = data.has_more;
+
+      if (data.messages && data.messages.length > 0) {
+        const fragment = document.createDocumentFragment();
+        renderHistoryMessages(data.messages, fragment);
+
+        // Keep the visible messages in place while content grows above them
+        const previousHeight = chatMessages.scrollHeight;
+        chatMessages.insertBefore(fragment, chatMessages.firstChild);
+        chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+      }
+    } catch (error) {
+      console.error("Error loading older messages:", error);
+    } finally {
+      loadingOlderMessages = false;
+    }
+  }
+
+  // Render stored messages (chronological order) into target
+  function renderHistoryMessages(messages, target) {
+    messages.forEach((msg) => {
+      if (msg.role === "user") {
+        addUserMessage(msg.content, target);
+      } else {
+        // For bot messages, show the model that produced them
+        const modelType = msg.model || "gemini"; // Default to gemini if not specified
+        addBotMessage(msg.content, true, target, modelType);
+        
+        // If RAG context exists, display it
+        if (msg.context_info) {
+          try {
+            const contextInfo = JSON.parse(msg.context_info);
+            if (contextInfo && contextInfo.length > 0) {
+              addContextInfo(contextInfo, target);
+            }
+          } catch (e) {
+            console.error("Failed to parse context info", e);
+          }
+        }
+      }
+    });
+  }
 });
\ No newline at end of file
@@ -0,0 +1,134 @@
+#stub_backends.py
+"""Offline stand-ins for the RAG models, for load testing the web app.
+
+``StubRAGSystem`` replaces the model loading of ``RAGSystem`` (T5, MiniLM,
+the FAISS index and the PubMedQA passages) with:
+
+    HashingEmbedder   deterministic pseudo-random unit vectors per text, so
+                      repeated questions embed identically (caches still hit)
+    corpus            ``RAG_FAKE_PASSAGES`` synthetic passages in a flat
+                      inner-product FAISS index
+    generation        sleeps for a log-normal latency scaled by the decoding
+                      profile's beams x max_new_tokens and the batch size
+
+Everything else (micro-batcher, decoding controller, uploaded-document index,
+query and answer caches, metrics) is the production code. Enable it with
+``RAG_BACKEND=fake``, together with ``GEMINI_BACKEND=fake`` for Gemini.
+The stubs sleep instead of computing, so they reproduce latency and queueing
+but not the CPU contention of real inference.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from decoding import DECODING_PROFILES, DEFAULT_PROFILE
+from metrics import timed
+from rag_system import RAGSystem
+
+STUB_EMBED_MS = float(os.getenv('RAG_FAKE_EMBED_MS', '10'))
+# Median latency of one full-beam answer; other profiles are scaled from it
+STUB_GENERATE_MS = float(os.getenv('RAG_FAKE_GENERATE_MS', '1500'))
+STUB_SIGMA = float(os.getenv('RAG_FAKE_SIGMA', '0.4'))
+STUB_PASSAGES = int(os.getenv('RAG_FAKE_PASSAGES', '5000'))
+# Extra cost of each further question in a batch, relative to the first
+BATCH_COST = 0.15
+EMBEDDING_DIM = 384
+
+WORDS = ("patients treatment risk mortality trial cohort hypertension diabetes insulin statin "
+         "elderly children outcome therapy dose placebo randomized association fracture delirium").split()
+
+
+class LatencyModel:
+    """Log-normal latency around a median, the shape of most service latencies."""
+
+    def __init__(self, median_ms, sigma=STUB_SIGMA, seed=None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, scale=1.0):
+        with self._lock:
+            return self.median_ms / 1000.0 * scale * self._random.lognormvariate(0, self.sigma)
+
+    def sleep(self, scale=1.0):
+        time.sleep(self.sample(scale))
+
+
+def profile_cost(profile):
+    """Cost of a decoding profile relative to the default one (beams x token budget)."""
+    def cost(name):
+        settings = DECODING_PROFILES[name]
+        return settings.get('num_beams', 1) * settings['max_new_tokens']
+    return cost(profile) / cost(DEFAULT_PROFILE)
+
+
+class HashingEmbedder:
+    """``SentenceTransformer.encode`` stand-in: a fixed random unit vector per text."""
+
+    def __init__(self, dim=EMBEDDING_DIM, latency=None):
+        self.dim = dim
+        self.latency = latency or LatencyModel(STUB_EMBED_MS)
+
+    def encode(self, texts, **kwargs):
+        texts = list(texts)
+        self.latency.sleep(1 + 0.1 * (len(texts) - 1))
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+
+def synthetic_corpus(count, dim=EMBEDDING_DIM, seed=0):
+    """``(index, context_map)`` of ``count`` filler passages with random embeddings."""
+    rng = np.random.default_rng(seed)
+    context_map = [{
+        'context': " ".join(rng.choice(WORDS, size=120)).capitalize() + ".",
+        'question': " ".join(rng.choice(WORDS, size=8)).capitalize() + "?",
+        'answer': str(rng.choice(['yes', 'no', 'maybe'])),
+    } for _ in range(count)]
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(dim)
+    index.add(vectors)
+    return index, context_map
+
+
+class StubRAGSystem(RAGSystem):
+    """``RAGSystem`` with stand-in models, see the module docstring."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.generate_latency = LatencyModel(STUB_GENERATE_MS)
+
+    def _load_models(self, defer_generator=False):
+        self.embedding_model = self._load_component('embedding_model', HashingEmbedder)
+        self.index, self.context_map = self._load_component(
+            'index', lambda: synthetic_corpus(STUB_PASSAGES))
+        for name in self.COMPONENTS:
+            self.components[name]['status'] = 'stub'
+        self.components['token_store']['status'] = 'unavailable'
+        self.components['lexical_index']['status'] = 'unavailable'
+
+    def answer_single(self, question):
+        return self.answer_batch([question])[0]
+
+    def generate(self, questions, passages, profile):
+        with timed('generate', profile):
+            self.generate_latency.sleep(profile_cost(profile) * (1 + BATCH_COST * (len(questions) - 1)))
+        return [f"Simulated {profile} answer to: {question}" for question in questions]
+
+    def stream(self, question, passages, profile):
+        words = f"Simulated {profile} answer to: {question}".split()
+        seconds = self.generate_latency.sample(profile_cost(profile))
+        with timed('generate', f"stream:{profile}"):
+            for word in words:
+                time.sleep(seconds / len(words))
+                yield word + " "
@@ -0,0 +1,167 @@
+#tests/test_context_migration.py
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import db
+from models.context import ChatContext
+
+# Schema and queries of the chat tables before the sidebar columns were added
+BASELINE_SCHEMA = '''
+    CREATE TABLE chat_sessions (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        title TEXT DEFAULT 'New Chat',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+    CREATE TABLE chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        model TEXT,
+        context_info TEXT,
+        FOREIGN KEY (session_id) REFERENCES chat_sessions(id)
+    );
+'''
+
+SESSIONS = [
+    ('session_a', 1, 'New Chat', '2024-01-01 09:00:00'),
+    ('session_b', 1, 'Statins', '2024-01-02 09:00:00'),
+    ('session_c', 1, 'New Chat', '2024-01-03 09:00:00'),
+    ('session_d', 2, 'New Chat', '2024-01-04 09:00:00'),
+]
+
+MESSAGES = [
+    ('session_a', 'user', 'Does aspirin reduce the risk of myocardial infarction in adults?', '2024-01-01 09:01:00'),
+    ('session_a', 'assistant', 'Yes, in secondary prevention.', '2024-01-01 09:01:05'),
+    ('session_a', 'user', 'What about primary prevention?', '2024-01-01 09:02:00'),
+    ('session_a', 'assistant', 'The benefit is smaller.', '2024-01-01 09:02:05'),
+    ('session_b', 'user', 'Do statins lower dementia risk?', '2024-01-02 09:01:00'),
+    ('session_b', 'assistant', 'The evidence is mixed.', '2024-01-02 09:01:05'),
+    ('session_d', 'assistant', 'Welcome back.', '2024-01-04 09:01:00'),
+]
+
+LEGACY_MESSAGE_COLUMNS = ('id', 'session_id', 'role', 'content', 'timestamp', 'model', 'context_info')
+
+
+def legacy_user_sessions(conn, user_id):
+    sessions = [dict(row) for row in conn.execute(
+        'SELECT * FROM chat_sessions WHERE user_id = ? ORDER BY created_at DESC', (user_id,))]
+    for session in sessions:
+        if session['title'] == 'New Chat':
+            first_msg = conn.execute('''
+                SELECT content FROM chat_messages
+                WHERE session_id = ? AND role = 'user'
+                ORDER BY timestamp ASC LIMIT 1
+            ''', (session['id'],)).fetchone()
+            if first_msg:
+                session['title'] = first_msg['content']
+                if len(session['title']) > 30:
+                    session['title'] = session['title'][:30] + '...'
+        last_msg = conn.execute('''
+            SELECT content FROM chat_messages
+            WHERE session_id = ? ORDER BY timestamp DESC LIMIT 1
+        ''', (session['id'],)).fetchone()
+        session['last_message'] = last_msg['content'] if last_msg else "No messages yet"
+    return [{key: session[key] for key in ('id', 'title', 'created_at', 'last_message')} for session in sessions]
+
+
+def legacy_messages(conn, session_id):
+    return [dict(row) for row in conn.execute(
+        'SELECT * FROM chat_messages WHERE session_id = ? ORDER BY timestamp ASC', (session_id,))]
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    # DB_PATH is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    db.close_all()
+    os.makedirs('instance')
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('INSERT INTO chat_sessions (id, user_id, title, created_at) VALUES (?, ?, ?, ?)', SESSIONS)
+    conn.executemany('INSERT INTO chat_messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+                     MESSAGES)
+    conn.commit()
+    expected = {
+        'sessions': {user_id: legacy_user_sessions(conn, user_id) for user_id in (1, 2)},
+        'messages': {session_id: legacy_messages(conn, session_id) for session_id, *_ in SESSIONS},
+    }
+    conn.close()
+    yield expected
+    db.close_all()
+
+
+def session_summary(session_id):
+    with db.connection() as conn:
+        row = conn.execute('''
+            SELECT first_user_message, last_message, last_activity
+            FROM chat_sessions WHERE id = ?
+        ''', (session_id,)).fetchone()
+    return tuple(row)
+
+
+def test_migration_backfills_session_summary(baseline_db):
+    ChatContext.init_db()
+    ChatContext.init_db()
+
+    assert session_summary('session_a') == (
+        'Does aspirin reduce the risk of myocardial infarction in adults?',
+        'The benefit is smaller.',
+        '2024-01-01 09:02:05',
+    )
+    assert session_summary('session_b') == (
+        'Do statins lower dementia risk?', 'The evidence is mixed.', '2024-01-02 09:01:05')
+    # No messages: activity falls back to the creation time
+    assert session_summary('session_c') == (None, None, '2024-01-03 09:00:00')
+    assert session_summary('session_d') == (None, 'Welcome back.', '2024-01-04 09:01:00')
+
+
+def test_trigger_keeps_session_summary_current(baseline_db):
+    ChatContext.init_db()
+    ChatContext.init_db()
+
+    ChatContext.add_message('session_c', 'user', 'Is vitamin D linked to fewer fractures?')
+    first_user_message, last_message, last_activity = session_summary('session_c')
+    assert first_user_message == 'Is vitamin D linked to fewer fractures?'
+    assert last_message == 'Is vitamin D linked to fewer fractures?'
+    assert last_activity is not None
+
+    ChatContext.add_message('session_c', 'assistant', 'Only in deficient patients.')
+    ChatContext.add_message('session_a', 'user', 'And for diabetics?')
+    assert session_summary('session_c')[:2] == (
+        'Is vitamin D linked to fewer fractures?', 'Only in deficient patients.')
+    # The first user message never changes once it is set
+    assert session_summary('session_a')[:2] == (
+        'Does aspirin reduce the risk of myocardial infarction in adults?', 'And for diabetics?')
+
+
+def test_queries_match_the_baseline_schema(baseline_db):
+    ChatContext.init_db()
+    ChatContext.init_db()
+
+    for user_id, expected in baseline_db['sessions'].items():
+        sessions = ChatContext.get_user_sessions(user_id)
+        assert [{key: session[key] for key in ('id', 'title', 'created_at', 'last_message')}
+                for session in sessions] == expected
+
+    for session_id, expected in baseline_db['messages'].items():
+        messages, has_more = ChatContext.get_session_messages_page(session_id)
+        assert not has_more
+        # Same rows and values; the migration only adds the decoding_profile column
+        assert [{key: message[key] for key in LEGACY_MESSAGE_COLUMNS} for message in messages] == \
+            [{key: message[key] for key in LEGACY_MESSAGE_COLUMNS} for message in expected]
+
+    # Paging walks back through the same messages
+    newest, has_more = ChatContext.get_session_messages_page('session_a', limit=3)
+    older, has_more_older = ChatContext.get_session_messages_page('session_a', before_id=newest[0]['id'], limit=3)
+    assert has_more and not has_more_older
+    assert [m['content'] for m in older + newest] == [m['content'] for m in baseline_db['messages']['session_a']]
@@ -0,0 +1,26 @@
+#tests/test_profiling.py
+import cProfile
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from profiling import cprofile_hot_spots
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+def test_cprofile_hot_spots_report_call_counts():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(3):
+        work(1000)
+    profiler.disable()
+
+    rows = cprofile_hot_spots(profiler, top=50)
+    assert rows
+    assert all('calls' in row for row in rows)
+    row = next(row for row in rows if row['function'] == 'test_profiling.work')
+    assert row['calls'] == 3
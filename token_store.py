@@ -0,0 +1,204 @@
+#token_store.py
+"""Pre-tokenized passages for the RAG generator.
+
+Every request used to join the full text of the retrieved abstracts and run
+the T5 tokenizer over it, only to truncate the result at 512 tokens. This
+store holds each passage's token IDs, computed once when the index is built,
+so prompts can be assembled directly from token arrays (see
+``rag_qa.build_input_ids``).
+
+File layout (all integers little-endian)::
+
+    b"TOKSTORE"          magic
+    uint64               header length in bytes
+    header               JSON: {"version", "rows", "dtype", "max_length", "tokenizer", "source"}
+    body, 8-byte aligned:
+        uint64[rows + 1] offsets (in tokens) into the ids array
+        dtype[...]       token ids of every passage, concatenated
+
+The store sits next to the context store and is only used when it was built
+with the same tokenizer as the loaded generator, from the current version of
+the context map (``source``, see ``context_store.source_fingerprint``)::
+
+    python token_store.py ai_integration/t5-small-pubmedqa ai_integration/context_map.pkl
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from context_store import source_fingerprint
+
+MAGIC = b"TOKSTORE"
+FORMAT_VERSION = 1
+# T5 never sees more than this many input tokens, so longer passages are cut here
+MAX_PASSAGE_TOKENS = 512
+# Encoded as part of the fingerprint; exported copies of the tokenizer agree on it
+FINGERPRINT_TEXT = "question: Does aspirin reduce the risk of myocardial infarction? context:"
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Identify a tokenizer well enough to detect a store built with another one."""
+    return {
+        "vocab_size": len(tokenizer),
+        "probe": list(tokenizer.encode(FINGERPRINT_TEXT, add_special_tokens=False)),
+    }
+
+
+def token_store_path(context_map_path):
+    """The token store that belongs to a context map (``.pkl`` or ``.ctx``)."""
+    return os.path.splitext(context_map_path)[0] + ".tok"
+
+
+# ------------------- Writing -------------------
+
+def encode_passage(tokenizer, text, max_length=MAX_PASSAGE_TOKENS):
+    """Token IDs of one passage, without special tokens."""
+    return tokenizer.encode(text, add_special_tokens=False, truncation=True, max_length=max_length)
+
+
+def write_token_store(texts, tokenizer, output_path, max_length=MAX_PASSAGE_TOKENS, source=None):
+    """Tokenize ``texts`` (position == row id) and write them to ``output_path``.
+
+    ``source`` is the ``source_fingerprint`` of the context map the texts come from.
+    """
+    dtype = np.dtype("<u2") if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.dtype("<u4")
+    encoded = [np.asarray(encode_passage(tokenizer, text, max_length), dtype=dtype) for text in texts]
+
+    n_rows = len(encoded)
+    offsets = np.zeros(n_rows + 1, dtype="<u8")
+    np.cumsum([len(ids) for ids in encoded], out=offsets[1:])
+
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "rows": n_rows,
+        "dtype": dtype.str,
+        "max_length": max_length,
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "source": source,
+    }).encode("utf-8")
+    body_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(b"\0" * (body_start - f.tell()))
+        f.write(offsets.tobytes())
+        for ids in encoded:
+            f.write(ids.tobytes())
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def build_token_store(context_map, tokenizer, output_path, max_length=MAX_PASSAGE_TOKENS, source=None):
+    """Pre-tokenize the ``context`` field of every row of a context map."""
+    texts = (context_map[i]["context"] for i in range(len(context_map)))
+    return write_token_store(texts, tokenizer, output_path, max_length, source)
+
+
+# ------------------- Reading -------------------
+
+class TokenStore:
+    """Read-only, mmap-backed passage token IDs.
+
+    ``store[idx]`` returns a numpy view of the row's token IDs; nothing is
+    copied until the prompt is assembled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a token store file")
+
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_len])
+        if header.get("version") != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported token store version: {header.get('version')}")
+
+        body_start = _align(header_start + header_len)
+        self.rows = header["rows"]
+        self.max_length = header["max_length"]
+        self.tokenizer = header["tokenizer"]
+        self.source = header.get("source")
+        self._offsets = np.frombuffer(self._mmap, dtype="<u8", count=self.rows + 1, offset=body_start)
+        self._ids = np.frombuffer(
+            self._mmap, dtype=np.dtype(header["dtype"]), count=int(self._offsets[-1]),
+            offset=body_start + self._offsets.nbytes
+        )
+
+    def close(self):
+        # numpy views keep the mmap exported; drop them before closing
+        self._offsets = self._ids = None
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = None
+
+    def matches(self, tokenizer):
+        return self.tokenizer == tokenizer_fingerprint(tokenizer)
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        if not 0 <= idx < self.rows:
+            raise KeyError(idx)
+        return self._ids[int(self._offsets[idx]):int(self._offsets[idx + 1])]
+
+    def __len__(self):
+        return self.rows
+
+
+def load_token_store(context_map_path, tokenizer, rows=None):
+    """Open the token store next to ``context_map_path`` if it fits ``tokenizer``.
+
+    Returns ``None`` when there is no store, it was built with a different
+    tokenizer, or from another version of the context map (``rows`` is the
+    size of the loaded map); prompts are then tokenized from the passage
+    text instead.
+    """
+    path = token_store_path(context_map_path)
+    if not os.path.exists(path):
+        return None
+    store = TokenStore(path)
+    if not store.matches(tokenizer):
+        print(f"Ignoring {path}: built with tokenizer {store.tokenizer}, "
+              f"generator uses {tokenizer_fingerprint(tokenizer)}")
+        store.close()
+        return None
+    if store.source != source_fingerprint(context_map_path) or rows not in (None, store.rows):
+        print(f"Ignoring {path}: it was not built from the current {context_map_path}; "
+              "re-run token_store.py to rebuild it")
+        store.close()
+        return None
+    return store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python token_store.py <model_path> <context_map> [<output.tok>]")
+        sys.exit(1)
+
+    from transformers import T5Tokenizer
+    from context_store import load_context_map
+
+    model_path, context_map_path = sys.argv[1], sys.argv[2]
+    output_path = sys.argv[3] if len(sys.argv) == 4 else token_store_path(context_map_path)
+    build_token_store(load_context_map(context_map_path), T5Tokenizer.from_pretrained(model_path), output_path,
+                      source=source_fingerprint(context_map_path))
+    print(f"Token store written to {output_path}")